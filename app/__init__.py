@@ -1,45 +1,79 @@
-print("Starting package load: app/__init__.py")
 import os
-import sys
 import logging
 from flask import Flask, render_template, flash
-from .extensions import db, login_manager, migrate, csrf
+from .extensions import db, login_manager, csrf
 from .models.user import User
 from .utils.logging_config import setup_logging
+from .utils.user_cache import init_user_cache
+from .utils.tracking_index import init_tracking_index
 from .config import config
 from uuid import UUID
 
 logger = logging.getLogger(__name__)
 
-def create_app(config_name=None):
-    """Application factory function"""
+# Modules of app.routes whose blueprint is registered unless BLUEPRINTS says otherwise
+BLUEPRINTS = ('main', 'auth', 'shipments', 'tracking', 'contacts', 'admin', 'api', 'profile')
+
+def init_request_hooks(app):
+    """Metrics, query inspection, SQL tags, profiling and the watchdog"""
+    from .utils.metrics import init_metrics
+    from .utils.query_inspector import init_query_inspector
+    from .utils.sql_comments import init_sql_comments
+    from .utils.request_profiler import init_request_profiler
+    from .utils.watchdog import init_watchdog
+
+    # Request metrics (/admin/metrics)
+    try:
+        init_metrics(app)
+    except Exception as e:
+        logger.error(f"Failed to set up request metrics: {str(e)}", exc_info=True)
+        raise
+    
+    # N+1, slow query and query budget checks (QUERY_INSPECTION)
+    init_query_inspector(app)
+    
+    # Tag SQL with endpoint, request id and pid (SQL_COMMENTS)
+    init_sql_comments(app)
+    
+    # cProfile for requests signed by an admin (X-Profile header)
+    init_request_profiler(app)
+    
+    # Stack snapshots of requests slower than SLOW_REQUEST_SECONDS
+    init_watchdog(app)
+
+def create_app(config_name=None, blueprints=None):
+    """Application factory function
+
+    ``blueprints`` names the app.routes modules to register; by default the
+    BLUEPRINTS setting, or all of them. With an empty list the app only has
+    its configuration, logging and database, which is all scripts such as
+    check_shipments.py need: routes, request hooks, CLI commands and
+    Flask-Migrate are then not even imported.
+    """
     logger.debug("Starting application initialization")
-    logger.debug(f"Python path during create_app: {sys.path}")
-    logger.debug(f"Current working directory: {os.getcwd()}")
     
     if not config_name:
         config_name = os.environ.get('FLASK_ENV', 'development')
-    logger.debug(f"Using configuration: {config_name}")
+    logger.debug("Using configuration: %s", config_name)
     
     # Initialize Flask app with explicit template folder
     template_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), 'templates'))
     static_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), 'static'))
     app = Flask(__name__, template_folder=template_dir, static_folder=static_dir)
-    logger.debug(f"Template directory set to: {template_dir}")
+    logger.debug("Template directory set to: %s", template_dir)
     logger.debug("Flask app instance created")
     
     # Load configuration
     try:
         app.config.from_object(config[config_name])
         logger.debug("Configuration loaded successfully")
-        logger.debug(f"Loaded config values: {dict(app.config)}")
     except Exception as e:
         logger.error(f"Failed to load configuration: {str(e)}", exc_info=True)
         raise
     
     # Set up logging
     try:
-        setup_logging()
+        setup_logging(app)
         logger.debug("Logging configured")
     except Exception as e:
         logger.error(f"Failed to setup logging: {str(e)}", exc_info=True)
@@ -49,7 +83,6 @@ def create_app(config_name=None):
     try:
         logger.debug("Initializing extensions")
         db.init_app(app)
-        migrate.init_app(app, db)
         login_manager.init_app(app)
         csrf.init_app(app)
         logger.debug("Extensions initialized")
@@ -70,40 +103,79 @@ def create_app(config_name=None):
         logger.error(f"400 Error: {str(e)}")
         return render_template('error.html', error=f"Bad request: {str(e)}"), 400
     
-    # Register blueprints
-    try:
-        logger.debug("Registering blueprints")
-        from .routes import main, auth, shipments, tracking, contacts, admin, api, profile
-        app.register_blueprint(main.bp)
-        app.register_blueprint(auth.bp)
-        app.register_blueprint(shipments.bp)
-        app.register_blueprint(tracking.bp)
-        app.register_blueprint(contacts.bp)
-        app.register_blueprint(admin.bp)
-        app.register_blueprint(api.bp)
-        app.register_blueprint(profile.bp)
-        logger.debug("Blueprints registered")
-    except Exception as e:
-        logger.error(f"Failed to register blueprints: {str(e)}", exc_info=True)
-        raise
+    if blueprints is None:
+        blueprints = [name.strip() for name in app.config['BLUEPRINTS'].split(',') if name.strip()] or BLUEPRINTS
+    unknown = set(blueprints) - set(BLUEPRINTS)
+    if unknown:
+        raise ValueError(f"Unknown blueprints: {', '.join(sorted(unknown))}")
+    
+    if blueprints:
+        init_request_hooks(app)
+        
+        # Compiled templates on disk, shared by workers (warmed up in gunicorn's post_worker_init)
+        from .utils.warmup import init_template_cache
+        init_template_cache(app)
+        
+        # Register blueprints
+        try:
+            logger.debug("Registering blueprints: %s", ', '.join(blueprints))
+            from importlib import import_module
+            for name in BLUEPRINTS:
+                if name in blueprints:
+                    app.register_blueprint(import_module(f'.routes.{name}', __name__).bp)
+            logger.debug("Blueprints registered")
+        except Exception as e:
+            logger.error(f"Failed to register blueprints: {str(e)}", exc_info=True)
+            raise
+        
+        # flask db; alembic is slow to import, so scripts go without
+        from flask_migrate import Migrate
+        Migrate(app, db)
+        
+        # Register CLI maintenance commands
+        from .commands import register_commands
+        register_commands(app)
+        
+        # Configure CSRF to accept tokens from headers (after blueprints are registered)
+        from .extensions import configure_csrf
+        configure_csrf(app)
     
-    # Configure CSRF to accept tokens from headers (after blueprints are registered)
-    from .extensions import configure_csrf
-    configure_csrf(app)
+    # User loader callback; snapshots come from a per-worker cache (USER_CACHE_SECONDS)
+    user_cache = init_user_cache(app)
     
-    # User loader callback
     @login_manager.user_loader
     def load_user(user_id):
         try:
             # Attempt to convert the user_id to UUID
             uuid_id = UUID(user_id)
-            return db.session.get(User, uuid_id)
         except (ValueError, TypeError):
             # If the user_id is not a valid UUID, return None
             # This will cause Flask-Login to treat the user as not authenticated
             return None
+        if user_cache is not None:
+            return user_cache.get(uuid_id)
+        return db.session.get(User, uuid_id)
+    
+    if 'tracking' in blueprints:
+        # Waybill filter and answer cache of the public tracking views (TRACKING_CACHE_SECONDS)
+        init_tracking_index(app)
+    
+    if 'api' in blueprints:
+        import jwt
+        from .utils.api_tokens import init_api_tokens, request_token_claims, token_user_id
+        init_api_tokens(app)
+        
+        # API calls without a session are made by the user of their bearer token
+        @login_manager.request_loader
+        def load_user_from_token(request):
+            if request.blueprint != 'api':
+                return None
+            try:
+                claims = request_token_claims()
+            except jwt.InvalidTokenError:
+                return None
+            user_id = token_user_id(claims) if claims else None
+            return load_user(str(user_id)) if user_id else None
     
     logger.debug("Application initialization completed")
-    logger.debug(f"Final app object type: {type(app)}")
-    logger.debug(f"Final app object attributes: {dir(app)}")
     return app 
\ No newline at end of file
@@ -9,7 +9,7 @@ login_manager = LoginManager()
 @login_manager.user_loader
 def load_user(user_id):
     """Load user by ID with UUID validation"""
-    logger.debug(f"Loading user with ID: {user_id}")
+    logger.debug("Loading user with ID: %s", user_id)
     
     # Validate UUID format
     if not User.is_valid_uuid(user_id):
@@ -19,7 +19,7 @@ def load_user(user_id):
     try:
         user = User.query.get(str(user_id))
         if user:
-            logger.debug(f"Found user: {user.username}")
+            logger.debug("Found user: %s", user.username)
             return user
         else:
             logger.error(f"No user found with ID: {user_id}")
@@ -0,0 +1,180 @@
+import logging
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from .extensions import db
+from .models.stats import reconcile_user_stats
+from .utils.archive import archive_shipments
+from .utils.sync import purge_tombstones
+from .utils.idempotency import purge_idempotency_keys
+from .utils.sql_comments import parse_tagged_log, summarize
+from .utils.request_profiler import PROFILE_HEADER, profile_token, profiles_dir
+from .utils.seed import SEED_PASSWORD, seed_database
+from .utils.file_storage import get_upload_path
+from .utils.warmup import template_cache_dir, warm_up
+from .models.user import User
+
+logger = logging.getLogger(__name__)
+
+@click.command('reconcile-user-stats')
+@click.option('--user-id', default=None, help='Only rebuild the counters of this user.')
+@with_appcontext
+def reconcile_user_stats_command(user_id):
+    """Rebuild the per-user shipment counters from export_request."""
+    try:
+        count = reconcile_user_stats(db.session.connection(), user_id)
+        db.session.commit()
+        click.echo(f"Reconciled shipment stats for {count} users")
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error reconciling user stats: {str(e)}", exc_info=True)
+        raise click.ClickException(str(e))
+
+@click.command('archive-shipments')
+@click.option('--older-than-days', type=int, default=None, help='Age in days (defaults to ARCHIVE_AFTER_DAYS).')
+@click.option('--batch-size', type=int, default=None, help='Shipments per transaction (defaults to ARCHIVE_BATCH_SIZE).')
+@click.option('--max-batches', type=int, default=None, help='Stop after this many batches.')
+@click.option('--pause', type=float, default=0, help='Seconds to sleep between batches.')
+@with_appcontext
+def archive_shipments_command(older_than_days, batch_size, max_batches, pause):
+    """Move old delivered/cancelled shipments into the archive tables."""
+    try:
+        count = archive_shipments(older_than_days, batch_size, max_batches, pause)
+        click.echo(f"Archived {count} shipments")
+    except Exception as e:
+        raise click.ClickException(str(e))
+
+@click.command('purge-sync-tombstones')
+@click.option('--days', type=int, default=None, help='Retention in days (defaults to SYNC_TOMBSTONE_DAYS).')
+@with_appcontext
+def purge_sync_tombstones_command(days):
+    """Delete delta sync tombstones older than the retention window."""
+    try:
+        count = purge_tombstones(days)
+        click.echo(f"Purged {count} sync tombstones")
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error purging sync tombstones: {str(e)}", exc_info=True)
+        raise click.ClickException(str(e))
+
+@click.command('purge-idempotency-keys')
+@with_appcontext
+def purge_idempotency_keys_command():
+    """Delete idempotency keys past their expiry."""
+    try:
+        count = purge_idempotency_keys()
+        click.echo(f"Purged {count} idempotency keys")
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error purging idempotency keys: {str(e)}", exc_info=True)
+        raise click.ClickException(str(e))
+
+@click.command('sql-report')
+@click.argument('logfile', type=click.File('r'))
+@click.option('--by', type=click.Choice(['endpoint', 'statement']), default='endpoint', help='Group by endpoint, or by endpoint and statement.')
+@click.option('--top', type=int, default=20, help='Rows to show.')
+def sql_report_command(logfile, by, top):
+    """Add up SQL tagged by SQL_COMMENTS in a PostgreSQL or app log."""
+    rows = summarize(parse_tagged_log(logfile), by)
+    if not rows:
+        raise click.ClickException("No tagged statements found; is SQL_COMMENTS enabled?")
+    click.echo(f"{'origin':<36} {'calls':>8} {'timed':>8} {'total ms':>12} {'mean ms':>9}")
+    for key, entry in rows[:top]:
+        mean = entry['total_ms'] / entry['timed'] if entry['timed'] else 0
+        click.echo(f"{key[0]:<36} {entry['calls']:>8} {entry['timed']:>8} {entry['total_ms']:>12.1f} {mean:>9.2f}")
+        if by == 'statement':
+            click.echo(f"    {entry['statement'][:100]}")
+
+@click.command('profile-token')
+@click.argument('username')
+@with_appcontext
+def profile_token_command(username):
+    """Print an X-Profile header value that profiles requests for an hour."""
+    user = User.query.filter_by(username=username).first()
+    if user is None or not user.is_admin:
+        raise click.ClickException(f"{username} is not an admin")
+    token = profile_token(current_app, user)
+    click.echo(f"{PROFILE_HEADER}: {token}")
+    click.echo(f"Valid for {current_app.config['PROFILE_TOKEN_MAX_AGE']} seconds; "
+               f"profiles are written to {profiles_dir(current_app)}")
+
+@click.command('seed')
+@click.option('--shipments', type=int, default=10000, show_default=True, help='Shipments to generate.')
+@click.option('--users', type=int, default=5, show_default=True, help='Users the shipments are spread over.')
+@click.option('--seed', 'seed_value', type=int, default=42, show_default=True, help='Random seed.')
+@click.option('--max-items', type=int, default=5, show_default=True, help='Items per shipment, at most.')
+@click.option('--image-ratio', type=float, default=0.3, show_default=True, help='Share of items with an image.')
+@click.option('--no-images', is_flag=True, help='Do not write image files to the upload folder.')
+@click.option('--end-date', type=click.DateTime(['%Y-%m-%d']), default='2025-01-01', show_default=True, help='Newest creation date.')
+@click.option('--days', type=int, default=730, show_default=True, help='Days of history before --end-date.')
+@click.option('--processes', type=int, default=None, help='Generator processes (defaults to the CPU count).')
+@click.option('--chunk-size', type=int, default=10000, show_default=True, help='Shipments per process task and transaction.')
+@click.option('--yes', is_flag=True, help='Do not ask for confirmation.')
+@with_appcontext
+def seed_command(shipments, users, seed_value, max_items, image_ratio, no_images, end_date, days,
+                 processes, chunk_size, yes):
+    """Fill the database with synthetic shipments for load and scale tests."""
+    target = db.engine.url.render_as_string(hide_password=True)
+    if not (yes or current_app.debug or current_app.testing):
+        click.confirm(f"Insert {shipments} synthetic shipments into {target}?", abort=True)
+    upload_dir = None if no_images else get_upload_path()
+    try:
+        with click.progressbar(length=shipments, label='Seeding') as bar:
+            seeded = [0]
+
+            def progress(done):
+                bar.update(done - seeded[0])
+                seeded[0] = done
+
+            info = seed_database(shipments, users=users, seed=seed_value, max_items=max_items,
+                                 image_ratio=image_ratio, upload_dir=upload_dir, end=end_date, days=days,
+                                 processes=processes, chunk_size=chunk_size, progress=progress)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error seeding the database: {str(e)}", exc_info=True)
+        raise click.ClickException(str(e))
+    click.echo(f"Inserted {info['shipments']} shipments, {info['items']} items and "
+               f"{info['status_changes']} status changes into {target}")
+    if upload_dir:
+        click.echo(f"Placeholder images are in {upload_dir}")
+    click.echo(f"Users seed0 (admin) to seed{users - 1} log in with '{SEED_PASSWORD}'")
+
+@click.command('revoke-token')
+@click.argument('token')
+@with_appcontext
+def revoke_token_command(token):
+    """Stop accepting an API bearer token in every worker."""
+    if 'api_tokens' not in current_app.extensions:
+        raise click.ClickException("The api blueprint is not enabled (BLUEPRINTS)")
+    try:
+        revoked = current_app.extensions['api_tokens'].revoke(token)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error revoking token: {str(e)}", exc_info=True)
+        raise click.ClickException(str(e))
+    expiry = f"until {revoked.expires_at:%Y-%m-%d %H:%M} UTC" if revoked.expires_at else "for good, it has no expiry"
+    click.echo(f"Revoked token {revoked.token_id} of user {revoked.user_id} {expiry}")
+
+@click.command('warm-up')
+@with_appcontext
+def warm_up_command():
+    """Run the worker warm-up and print how long each step took."""
+    report = warm_up(current_app)
+    click.echo(f"Templates:  {report['templates']:>4} in {report['templates_ms']:>8.1f} ms "
+               f"({report['templates_failed']} failed, cache in {template_cache_dir(current_app)})")
+    click.echo(f"Database:   {report['connections']:>4} connections in {report['database_ms']:>8.1f} ms")
+    click.echo(f"Lookups:         in {report['lookups_ms']:>8.1f} ms")
+    click.echo(f"Waybills:   {report['waybills']:>4} in {report['tracking_ms']:>8.1f} ms")
+    click.echo(f"Total:           in {report['total_ms']:>8.1f} ms")
+
+def register_commands(app):
+    """Attach the maintenance commands to ``flask``"""
+    app.cli.add_command(reconcile_user_stats_command)
+    app.cli.add_command(archive_shipments_command)
+    app.cli.add_command(purge_sync_tombstones_command)
+    app.cli.add_command(purge_idempotency_keys_command)
+    app.cli.add_command(sql_report_command)
+    app.cli.add_command(profile_token_command)
+    app.cli.add_command(seed_command)
+    app.cli.add_command(revoke_token_command)
+    app.cli.add_command(warm_up_command)
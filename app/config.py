@@ -12,6 +12,121 @@ class Config:
     USE_NAS_STORAGE = os.environ.get('USE_NAS_STORAGE', 'False').lower() == 'true'
     NAS_UPLOAD_FOLDER = os.environ.get('NAS_UPLOAD_FOLDER', '\\\\NAS_SERVER\\sgk_export_share\\uploads')
     
+    # Logging: root level, per-logger overrides ("app.routes=DEBUG,sqlalchemy.engine=INFO")
+    # and output format ("text" or "json", one object per line)
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    LOG_LEVELS = os.environ.get('LOG_LEVELS', '')
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+    # Under gunicorn, records are sent to one writer process; each worker buffers
+    # up to this many bytes while the writer is behind, then drops records
+    LOG_BUFFER_BYTES = int(os.environ.get('LOG_BUFFER_BYTES', 1024 * 1024))
+
+    # Request metrics served at /admin/metrics. Under gunicorn each worker writes
+    # its values to METRICS_DIR (set in gunicorn.conf.py) so they can be summed.
+    # Prometheus authenticates with "Authorization: Bearer <METRICS_TOKEN>".
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'True').lower() == 'true'
+    METRICS_DIR = os.environ.get('METRICS_DIR', '')
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+    METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', 1))
+
+    # Opt-in SQL inspection for development and staging: logs statements repeated
+    # QUERY_REPEAT_THRESHOLD times in one request (N+1), statements slower than
+    # SLOW_QUERY_MS with their plan, and routes over their @query_budget;
+    # QUERY_BUDGET_STRICT raises instead of logging
+    QUERY_INSPECTION = os.environ.get('QUERY_INSPECTION', 'False').lower() == 'true'
+    SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+    QUERY_REPEAT_THRESHOLD = int(os.environ.get('QUERY_REPEAT_THRESHOLD', 5))
+    QUERY_BUDGET_STRICT = os.environ.get('QUERY_BUDGET_STRICT', 'False').lower() == 'true'
+    # Reading a column a loader profile leaves out raises instead of loading it
+    LOADER_PROFILES_STRICT = os.environ.get('LOADER_PROFILES_STRICT', 'False').lower() == 'true'
+
+    # Append /*endpoint=...,request_id=...,pid=...*/ to every SQL statement so the
+    # database logs show where it came from (see flask sql-report)
+    SQL_COMMENTS = os.environ.get('SQL_COMMENTS', 'False').lower() == 'true'
+
+    # Per-request cProfile: requests with an admin's signed X-Profile header (or
+    # ?_profile=) are profiled to PROFILE_DIR (logs/profiles); see flask profile-token
+    PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'True').lower() == 'true'
+    PROFILE_DIR = os.environ.get('PROFILE_DIR', '')
+    PROFILE_TOKEN_MAX_AGE = int(os.environ.get('PROFILE_TOKEN_MAX_AGE', 3600))
+
+    # Each worker logs the stack, endpoint and running SQL of requests slower than
+    # this, again every SLOW_REQUEST_SECONDS, well before the gunicorn timeout (120s)
+    WATCHDOG_ENABLED = os.environ.get('WATCHDOG_ENABLED', 'True').lower() == 'true'
+    SLOW_REQUEST_SECONDS = float(os.environ.get('SLOW_REQUEST_SECONDS', 30))
+
+    # Warm-up of a new gunicorn worker before it takes requests (flask warm-up runs
+    # it by hand): compile the templates into TEMPLATE_CACHE_DIR (instance/template-cache
+    # by default, private to the app's user), open DB_POOL_MIN database connections and
+    # configure the ORM
+    WARMUP_ENABLED = os.environ.get('WARMUP_ENABLED', 'True').lower() == 'true'
+    TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR', '')
+    DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', 2))
+
+    # Each worker keeps snapshots of up to USER_CACHE_SIZE logged-in users for
+    # USER_CACHE_SECONDS (0 loads the user on every request). Changing a user
+    # touches USER_CACHE_STAMP (a temporary file by default) so all workers drop theirs.
+    USER_CACHE_SECONDS = int(os.environ.get('USER_CACHE_SECONDS', 60))
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 1024))
+    USER_CACHE_STAMP = os.environ.get('USER_CACHE_STAMP', '')
+
+    # Verified API bearer tokens kept per worker until they expire (0 verifies every
+    # request). Revoking a token (flask revoke-token) touches TOKEN_REVOCATION_STAMP
+    # (a temporary file by default) so every worker reloads the revoked list.
+    # Tokens naming a user (user_id or sub) act as that user, who must still exist;
+    # tokens without one are accepted anonymously unless API_TOKEN_REQUIRE_USER is set.
+    API_TOKEN_CACHE_SIZE = int(os.environ.get('API_TOKEN_CACHE_SIZE', 1024))
+    API_TOKEN_REQUIRE_USER = os.environ.get('API_TOKEN_REQUIRE_USER', 'False').lower() == 'true'
+    TOKEN_REVOCATION_STAMP = os.environ.get('TOKEN_REVOCATION_STAMP', '')
+
+    # Public tracking lookups: a token bucket per client IP (TRACKING_RATE_PER_MINUTE,
+    # bursts of TRACKING_BURST), a larger one per API token or logged-in user, and at
+    # most TRACKING_MAX_CONCURRENT lookups at once (gunicorn.conf.py sets it to half the
+    # worker threads). Workers share the state in RATE_LIMIT_STORE, a SQLite file
+    # (temporary by default). RATE_LIMIT_PROXIES is the number of proxies whose
+    # X-Forwarded-For entries are trusted: 1 for the nginx of conf/nginx, 0 when
+    # clients reach gunicorn directly. X-Forwarded-For is only read from
+    # RATE_LIMIT_TRUSTED_PROXIES (addresses or networks, comma separated), so
+    # clients that bypass nginx cannot pick their own address.
+    RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'True').lower() == 'true'
+    RATE_LIMIT_STORE = os.environ.get('RATE_LIMIT_STORE', '')
+    RATE_LIMIT_PROXIES = int(os.environ.get('RATE_LIMIT_PROXIES', 1))
+    RATE_LIMIT_TRUSTED_PROXIES = os.environ.get('RATE_LIMIT_TRUSTED_PROXIES', '127.0.0.1,::1')
+    TRACKING_RATE_PER_MINUTE = float(os.environ.get('TRACKING_RATE_PER_MINUTE', 30))
+    TRACKING_BURST = int(os.environ.get('TRACKING_BURST', 10))
+    TRACKING_USER_RATE_PER_MINUTE = float(os.environ.get('TRACKING_USER_RATE_PER_MINUTE', 300))
+    TRACKING_USER_BURST = int(os.environ.get('TRACKING_USER_BURST', 50))
+    TRACKING_MAX_CONCURRENT = int(os.environ.get('TRACKING_MAX_CONCURRENT', 8))
+
+    # Each tracking worker keeps a Bloom filter of every waybill, so unknown waybills
+    # are refused without a query, and up to TRACKING_CACHE_SIZE answers for
+    # TRACKING_CACHE_SECONDS (0 turns both off). New shipments and changes to them
+    # touch TRACKING_CACHE_STAMP (a temporary file by default) so all workers catch
+    # up; the filter is rebuilt every TRACKING_INDEX_REBUILD_SECONDS for rows the
+    # app did not write itself (flask seed).
+    TRACKING_CACHE_SECONDS = int(os.environ.get('TRACKING_CACHE_SECONDS', 300))
+    TRACKING_CACHE_SIZE = int(os.environ.get('TRACKING_CACHE_SIZE', 4096))
+    TRACKING_CACHE_STAMP = os.environ.get('TRACKING_CACHE_STAMP', '')
+    TRACKING_INDEX_REBUILD_SECONDS = int(os.environ.get('TRACKING_INDEX_REBUILD_SECONDS', 3600))
+
+    # Comma-separated app.routes modules to serve, e.g. "tracking,api"; empty serves all
+    BLUEPRINTS = os.environ.get('BLUEPRINTS', '')
+
+    # Archiving of delivered/cancelled shipments (flask archive-shipments)
+    ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 180))
+    ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 500))
+
+    # Delta sync feed for offline clients (/api/shipments/changes)
+    SYNC_PAGE_SIZE = int(os.environ.get('SYNC_PAGE_SIZE', 500))
+    # Rows younger than this are held back so slower concurrent commits are not skipped
+    SYNC_SETTLE_SECONDS = int(os.environ.get('SYNC_SETTLE_SECONDS', 2))
+    SYNC_TOMBSTONE_DAYS = int(os.environ.get('SYNC_TOMBSTONE_DAYS', 30))
+    # Offline queue uploads (/api/sync/batch): requests per transaction
+    SYNC_BATCH_CHUNK_SIZE = int(os.environ.get('SYNC_BATCH_CHUNK_SIZE', 25))
+    SYNC_BATCH_MAX_REQUESTS = int(os.environ.get('SYNC_BATCH_MAX_REQUESTS', 200))
+    # How long the outcome of a request made under an idempotency key is kept
+    IDEMPOTENCY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_TTL_HOURS', 24))
+
     # Database configuration
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
     if SQLALCHEMY_DATABASE_URI and SQLALCHEMY_DATABASE_URI.startswith('postgres://'):
@@ -22,8 +137,9 @@ class Config:
         'pool_pre_ping': True,
         'pool_recycle': 300,
         'pool_timeout': 30,
-        'pool_size': 10,
-        'max_overflow': 5,
+        # Per process; gunicorn.conf.py sets both from the worker class, threads and DB_MAX_CONNECTIONS
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 5)),
         'connect_args': {
             'connect_timeout': 10,
             'keepalives': 1,
@@ -32,10 +148,14 @@ class Config:
             'keepalives_count': 5
         }
     }
+    if SQLALCHEMY_DATABASE_URI and SQLALCHEMY_DATABASE_URI.startswith('sqlite'):
+        # A local SQLite file (benchmarks): the options above are for psycopg2
+        SQLALCHEMY_ENGINE_OPTIONS = {}
 
 class DevelopmentConfig(Config):
     """Development configuration."""
     DEBUG = True
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'DEBUG')
     TEMPLATES_AUTO_RELOAD = True
 
 class ProductionConfig(Config):
@@ -47,6 +167,14 @@ class TestingConfig(Config):
     """Testing configuration."""
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    # Tests fail when a route goes over its query budget
+    QUERY_INSPECTION = os.environ.get('QUERY_INSPECTION', 'True').lower() == 'true'
+    QUERY_BUDGET_STRICT = True
+    LOADER_PROFILES_STRICT = True
+    # Benchmarks and tests request the tracking routes from one address
+    RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'False').lower() == 'true'
+    # The base pool and connect_args are PostgreSQL specific
+    SQLALCHEMY_ENGINE_OPTIONS = {}
 
 config = {
     'development': DevelopmentConfig,
@@ -1,19 +1,29 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
-from flask_migrate import Migrate
 from flask_wtf.csrf import CSRFProtect
 
 # Initialize extensions
 db = SQLAlchemy()
-migrate = Migrate()
 login_manager = LoginManager()
 login_manager.login_view = 'auth.login'
 csrf = CSRFProtect()
 
 # Configure CSRF to accept tokens from both forms and headers
 def configure_csrf(app):
-    csrf.exempt(app.blueprints.get('api'))
+    if 'api' in app.blueprints:
+        csrf.exempt(app.blueprints['api'])
     
     # Configure CSRF to accept X-CSRF-TOKEN header
     app.config['WTF_CSRF_CHECK_DEFAULT'] = False
-    app.config['WTF_CSRF_HEADERS'] = ['X-CSRF-TOKEN'] 
\ No newline at end of file
+    app.config['WTF_CSRF_HEADERS'] = ['X-CSRF-TOKEN']
+
+
+def dispose_engines(app):
+    """Forget the pooled connections a forked worker inherited from its parent.
+
+    close=False leaves the sockets to the parent instead of closing them
+    under it; the worker opens its own connections on first use.
+    """
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
@@ -8,7 +8,7 @@ logger = logging.getLogger(__name__)
 
 def run_migration():
     """Run the migration within Flask application context"""
-    app = create_app()
+    app = create_app(blueprints=())
     with app.app_context():
         logger.info("Starting migration within application context")
         success = migrate_user_ids()
@@ -23,5 +23,5 @@ def run_migration(app):
 
 if __name__ == '__main__':
     from .. import create_app
-    app = create_app()
+    app = create_app(blueprints=())
     run_migration(app) 
\ No newline at end of file
@@ -1,4 +1,13 @@
 from .shipment import Shipment as ExportRequest
 from .user import User
+from .archive import ArchivedShipment, ArchivedShipmentItem, ArchivedShipmentStatusHistory
+from .stats import PeriodStats, UserShipmentStats
+from .sync import SyncTombstone
+from .idempotency import IdempotencyKey
+from .api_token import RevokedToken
 
-__all__ = ['ExportRequest', 'User'] 
\ No newline at end of file
+__all__ = [
+    'ExportRequest', 'User', 'ArchivedShipment', 'ArchivedShipmentItem',
+    'ArchivedShipmentStatusHistory', 'PeriodStats', 'UserShipmentStats', 'SyncTombstone',
+    'IdempotencyKey', 'RevokedToken'
+]
@@ -0,0 +1,20 @@
+import logging
+from datetime import datetime
+from ..extensions import db
+from .shipment import GUID
+
+logger = logging.getLogger(__name__)
+
+class RevokedToken(db.Model):
+    """An API bearer token that must no longer be accepted.
+
+    ``token_id`` is the token's ``jti`` claim, or the SHA-256 hex digest of
+    the token when it has none. Rows can go once ``expires_at`` has passed,
+    since the signature check rejects the token from then on.
+    """
+    __tablename__ = 'revoked_token'
+
+    token_id = db.Column(db.String(64), primary_key=True)
+    user_id = db.Column(GUID(), db.ForeignKey('user.id', ondelete='CASCADE'), index=True)
+    revoked_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = db.Column(db.DateTime, index=True)
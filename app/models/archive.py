@@ -0,0 +1,96 @@
+import logging
+from sqlalchemy import select, union_all
+from ..extensions import db
+from .shipment import Shipment, ShipmentItem, ShipmentStatusHistory
+
+logger = logging.getLogger(__name__)
+
+def _archive_columns(table, foreign_keys=None):
+    """Copy the columns of a hot table for its archive twin.
+
+    ``foreign_keys`` remaps foreign key targets, so archived children point at
+    archived parents instead of the hot table.
+    """
+    foreign_keys = foreign_keys or {}
+    columns = []
+    for column in table.columns:
+        references = [
+            db.ForeignKey(foreign_keys.get(key.target_fullname, key.target_fullname))
+            for key in column.foreign_keys
+        ]
+        columns.append(db.Column(
+            column.name,
+            column.type.copy(),
+            *references,
+            primary_key=column.primary_key,
+            nullable=column.nullable,
+            index=column.index
+        ))
+    return columns
+
+class ArchivedShipment(db.Model):
+    """Terminal shipment moved out of ``export_request`` by the archiver.
+
+    Mirrors the Shipment columns so templates and serializers can render
+    either one. Rows here never change status again.
+    """
+    __table__ = db.Table(
+        'export_request_archive',
+        *_archive_columns(Shipment.__table__),
+        db.Column('archived_at', db.DateTime, default=db.func.current_timestamp()),
+        db.Index('ix_export_request_archive_waybill_number', 'waybill_number')
+    )
+
+    is_archived = True
+
+    creator = db.relationship('User', foreign_keys=lambda: [ArchivedShipment.created_by])
+    status_changer = db.relationship('User', foreign_keys=lambda: [ArchivedShipment.status_changed_by])
+    items = db.relationship('ArchivedShipmentItem', backref='shipment', lazy=True)
+    status_history = db.relationship('ArchivedShipmentStatusHistory', backref='shipment', lazy='dynamic',
+                                     order_by='ArchivedShipmentStatusHistory.changed_at')
+
+    calculated_total = Shipment.calculated_total
+
+class ArchivedShipmentItem(db.Model):
+    __table__ = db.Table(
+        'item_detail_archive',
+        *_archive_columns(ShipmentItem.__table__, {'export_request.id': 'export_request_archive.id'}),
+        db.Index('ix_item_detail_archive_export_request_id', 'export_request_id')
+    )
+
+class ArchivedShipmentStatusHistory(db.Model):
+    __table__ = db.Table(
+        'shipment_status_history_archive',
+        *_archive_columns(ShipmentStatusHistory.__table__, {'export_request.id': 'export_request_archive.id'}),
+        db.Index('ix_shipment_status_history_archive_shipment_id', 'shipment_id')
+    )
+
+    user = db.relationship('User')
+
+# Hot models report the flag too, so callers can branch without isinstance checks
+Shipment.is_archived = False
+
+# Hot table -> archive table, in the order rows have to be copied
+ARCHIVE_TABLES = (
+    (Shipment.__table__, ArchivedShipment.__table__),
+    (ShipmentItem.__table__, ArchivedShipmentItem.__table__),
+    (ShipmentStatusHistory.__table__, ArchivedShipmentStatusHistory.__table__)
+)
+
+def all_shipments(*names, start=None, end=None):
+    """UNION ALL of the named shipment columns across the hot and archive tables.
+
+    Used by the statistics so archiving a shipment never changes a total.
+    ``start`` (inclusive) and ``end`` (exclusive) bound created_at on both
+    sides, so stats of recent periods only probe the archive's created_at
+    index instead of scanning every archived shipment.
+    """
+    selects = []
+    for table in (Shipment.__table__, ArchivedShipment.__table__):
+        query = select(*[table.c[name] for name in names])
+        if start is not None:
+            query = query.where(table.c.created_at >= start)
+        if end is not None:
+            query = query.where(table.c.created_at < end)
+        selects.append(query)
+    return union_all(*selects).subquery('all_shipments')
@@ -0,0 +1,41 @@
+import logging
+import uuid
+from datetime import datetime
+from ..extensions import db
+from .shipment import GUID
+
+logger = logging.getLogger(__name__)
+
+class IdempotencyKey(db.Model):
+    """Outcome of a request made under a client-generated idempotency key.
+
+    A retry with the same key gets the stored response back instead of
+    running the work again. Keys are scoped per user and expire after
+    IDEMPOTENCY_TTL_HOURS.
+    """
+    __tablename__ = 'idempotency_key'
+
+    STATUS_PROCESSING = 'processing'
+    STATUS_COMPLETED = 'completed'
+
+    user_id = db.Column(GUID(), db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    key = db.Column(db.String(100), primary_key=True)
+    endpoint = db.Column(db.String(100), nullable=False)
+    request_hash = db.Column(db.String(64))
+    status = db.Column(db.String(20), nullable=False, default=STATUS_PROCESSING)
+    response_status = db.Column(db.Integer)
+    response_body = db.Column(db.JSON)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # Set by the request that claimed the key, which finalizes or drops only its own row
+    claim_token = db.Column(GUID(), default=uuid.uuid4)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    @property
+    def is_completed(self):
+        return self.status == self.STATUS_COMPLETED
+
+    def record(self, status_code, body):
+        """Store the response to replay for later duplicates"""
+        self.status = self.STATUS_COMPLETED
+        self.response_status = status_code
+        self.response_body = body
@@ -26,8 +26,8 @@ class GUID(TypeDecorator):
         return uuid.UUID
 
     def load_dialect_impl(self, dialect):
-        logger.debug(f"\n=== GUID load_dialect_impl ===")
-        logger.debug(f"Dialect name: {dialect.name}")
+        logger.debug("\n=== GUID load_dialect_impl ===")
+        logger.debug("Dialect name: %s", dialect.name)
         if dialect.name == 'postgresql':
             logger.debug("Using PostgreSQL UUID type")
             impl = dialect.type_descriptor(UUID(as_uuid=True))
@@ -44,76 +44,49 @@ class GUID(TypeDecorator):
         """Process a value being bound as a parameter.
         Handles UUID conversion based on dialect type.
         """
-        logger.debug(f"\n=== GUID BIND PARAM ===")
-        logger.debug(f"Input value: {value}")
-        logger.debug(f"Input type: {type(value)}")
-        logger.debug(f"Dialect: {dialect.__class__.__name__ if dialect else 'None'}")
-        
+        # Runs for every bound GUID, so one lazily formatted record at most
         if value is None:
-            logger.debug("Returning None value")
             return value
             
         try:
             # Convert to UUID if not already
             if not isinstance(value, uuid.UUID):
                 value = uuid.UUID(str(value))
-                logger.debug(f"Converted to UUID: {value}")
             
-            if dialect.name == 'postgresql':
-                # For PostgreSQL, return UUID object directly
-                logger.debug(f"PostgreSQL: Returning UUID object: {value}")
-                return value
-            else:
-                # For other dialects, convert to string
-                result = str(value)
-                logger.debug(f"Other dialect: Converting to string: {result}")
-                return result
+            # PostgreSQL takes the UUID object, other dialects the string
+            result = value if dialect.name == 'postgresql' else str(value)
+            logger.debug("GUID bind %r -> %r (%s)", value, result, dialect.name)
+            return result
         except Exception as e:
             logger.error(f"Error in process_bind_param: {str(e)}")
             raise
 
     def process_result_value(self, value, dialect):
-        logger.debug(f"\n=== GUID RESULT VALUE ===")
-        logger.debug(f"Input value: {value}")
-        logger.debug(f"Input type: {type(value)}")
-        logger.debug(f"Dialect: {dialect.name}")
-        
-        if value is None:
-            logger.debug("Returning None value")
+        if value is None or isinstance(value, uuid.UUID):
+            return value
+            
+        # PostgreSQL may return UUID or string, other dialects a string
+        if dialect.name == 'postgresql' and not isinstance(value, str):
             return value
             
         try:
-            if isinstance(value, uuid.UUID):
-                logger.debug(f"Returning existing UUID: {value}")
-                return value
-                
-            if dialect.name == 'postgresql':
-                # PostgreSQL may return UUID or string
-                if isinstance(value, str):
-                    result = uuid.UUID(value)
-                    logger.debug(f"PostgreSQL: Converted string to UUID: {result}")
-                    return result
-                return value
-            else:
-                # Other dialects will return string
-                result = uuid.UUID(value)
-                logger.debug(f"Other dialect: Converted to UUID: {result}")
-                return result
+            result = uuid.UUID(value)
+            logger.debug("GUID result %r -> %r (%s)", value, result, dialect.name)
+            return result
         except Exception as e:
             logger.error(f"Error in process_result_value: {str(e)}")
             raise
 
     def coerce_compared_value(self, op, value):
         """Handle comparison operations between UUID types"""
-        logger.debug(f"\n=== GUID coerce_compared_value ===")
-        logger.debug(f"Operator: {op}, Value: {value}, Value type: {type(value)}")
+        logger.debug("GUID coerce_compared_value: %s %r", op, value)
         
         if value is None:
             return None
             
         # Get dialect if available
         dialect = getattr(op, 'dialect', None)
-        logger.debug(f"Coercion dialect: {dialect.__class__.__name__ if dialect else 'None'}")
+        logger.debug("Coercion dialect: %s", dialect.__class__.__name__ if dialect else 'None')
             
         try:
             # Return a new GUID type instance for proper comparison
@@ -130,8 +103,7 @@ class GUID(TypeDecorator):
 
     def compare_values(self, x, y):
         """Implement comparison logic for UUID values"""
-        logger.debug(f"\n=== GUID compare_values ===")
-        logger.debug(f"Comparing x: {x} ({type(x)}) with y: {y} ({type(y)})")
+        logger.debug("GUID compare_values: %r with %r", x, y)
         
         if x is None or y is None:
             return x is y
@@ -162,6 +134,7 @@ class ShipmentItem(db.Model):
     weight = db.Column(db.Float)
     image_filename = db.Column(db.String(255))
     image_file_id = db.Column(db.String(255))
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
 class ShipmentStatusHistory(db.Model):
     __tablename__ = 'shipment_status_history'
@@ -172,6 +145,7 @@ class ShipmentStatusHistory(db.Model):
     new_status = db.Column(db.String(50), nullable=False)
     changed_by = db.Column(GUID(), db.ForeignKey('user.id'), nullable=False)
     changed_at = db.Column(db.DateTime(timezone=True), default=db.func.current_timestamp())
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     
     # Relationships
     shipment = db.relationship('Shipment', backref=db.backref('status_history', lazy='dynamic', order_by='ShipmentStatusHistory.changed_at', cascade='all, delete-orphan'))
@@ -211,7 +185,9 @@ class Shipment(db.Model):
     
     id = db.Column(GUID(), primary_key=True, default=uuid.uuid4)
     waybill_number = db.Column(db.String(50), nullable=False)
-    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+    created_at = db.Column(db.DateTime, default=db.func.current_timestamp(), index=True)
+    # Set in Python (UTC, microseconds) so the sync cursor compares reliably on every backend
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     delivery_date = db.Column(db.DateTime)
     qr_code = db.Column(db.Text)
     
@@ -282,7 +258,8 @@ class Shipment(db.Model):
     def generate_waybill_number(cls):
         """Generate the next waybill number in sequence"""
         try:
-            last_request = cls.query.order_by(cls.created_at.desc()).first()
+            # Waybills sort as text; breaks ties between rows created in the same instant
+            last_request = cls.query.order_by(cls.created_at.desc(), cls.waybill_number.desc()).first()
             if not last_request:
                 return 'EX000001'
             
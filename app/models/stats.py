@@ -0,0 +1,270 @@
+import logging
+import uuid
+from datetime import datetime
+from sqlalchemy import event, inspect, or_, and_, select, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from ..extensions import db
+from .shipment import Shipment, GUID
+from .archive import all_shipments
+
+logger = logging.getLogger(__name__)
+
+class PeriodStats(db.Model):
+    """Memoized shipment totals for one fully closed day or month.
+
+    Rows are only written once their period has ended and are deleted again
+    whenever a shipment created inside that period is inserted, edited or
+    removed, so the next read recomputes them.
+    """
+    __tablename__ = 'period_stats'
+
+    GRANULARITIES = ('day', 'month')
+
+    granularity = db.Column(db.String(10), primary_key=True)
+    period_start = db.Column(db.Date, primary_key=True)
+    shipment_count = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+    status_counts = db.Column(db.JSON, nullable=False, default=dict)
+    computed_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+
+class UserShipmentStats(db.Model):
+    """Running shipment counters for one user.
+
+    Kept current by delta updates from the Shipment mapper events below and
+    rebuilt from ``export_request`` by :func:`reconcile_user_stats`.
+    """
+    __tablename__ = 'user_shipment_stats'
+
+    user_id = db.Column(GUID(), db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    total_shipments = db.Column(db.Integer, nullable=False, default=0)
+    total_revenue = db.Column(db.Float, nullable=False, default=0)
+    pending_count = db.Column(db.Integer, nullable=False, default=0)
+    confirmed_count = db.Column(db.Integer, nullable=False, default=0)
+    processing_count = db.Column(db.Integer, nullable=False, default=0)
+    in_transit_count = db.Column(db.Integer, nullable=False, default=0)
+    delivered_count = db.Column(db.Integer, nullable=False, default=0)
+    cancelled_count = db.Column(db.Integer, nullable=False, default=0)
+    saved_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
+
+    @staticmethod
+    def status_column(status):
+        """Name of the counter column for a status, or None if it has none"""
+        if status in Shipment.VALID_STATUSES:
+            return f'{status}_count'
+        return None
+
+    @property
+    def active_shipments(self):
+        return self.processing_count + self.in_transit_count
+
+    @property
+    def delivered_shipments(self):
+        return self.delivered_count
+
+    def status_distribution(self):
+        return {status: getattr(self, f'{status}_count') for status in Shipment.VALID_STATUSES}
+
+COUNTER_COLUMNS = ['total_shipments', 'total_revenue'] + [f'{status}_count' for status in Shipment.VALID_STATUSES]
+
+# Shipment attributes that feed the memoized totals
+STATS_ATTRIBUTES = ('created_at', 'status', 'total')
+
+def period_keys(created_at):
+    """Return the (granularity, period_start) keys a creation timestamp falls in"""
+    day = created_at.date() if isinstance(created_at, datetime) else created_at
+    return [('day', day), ('month', day.replace(day=1))]
+
+def invalidate_period_stats(connection, timestamps):
+    """Delete memoized rows for the periods containing any of ``timestamps``"""
+    keys = set()
+    for value in timestamps:
+        if value is not None:
+            keys.update(period_keys(value))
+    if not keys:
+        return
+
+    logger.debug("Invalidating period stats: %s", sorted(keys))
+    table = PeriodStats.__table__
+    connection.execute(table.delete().where(or_(*[
+        and_(table.c.granularity == granularity, table.c.period_start == start)
+        for granularity, start in keys
+    ])))
+
+def _shipment_timestamps(target, include_history=False):
+    """Loaded created_at values of a shipment without triggering a refresh"""
+    state = inspect(target)
+    values = [state.dict.get('created_at')]
+    if include_history:
+        values.extend(state.attrs.created_at.history.deleted or [])
+    return [value for value in values if isinstance(value, datetime)]
+
+@event.listens_for(Shipment, 'after_insert')
+def _invalidate_on_insert(mapper, connection, target):
+    # New shipments normally land in the open period, which is never memoized;
+    # back-dated inserts (imports, offline sync) still need the closed row cleared.
+    invalidate_period_stats(connection, _shipment_timestamps(target))
+
+@event.listens_for(Shipment, 'after_update')
+def _invalidate_on_update(mapper, connection, target):
+    state = inspect(target)
+    if not any(state.attrs[name].history.has_changes() for name in STATS_ATTRIBUTES):
+        return
+    invalidate_period_stats(connection, _shipment_timestamps(target, include_history=True))
+
+@event.listens_for(Shipment, 'after_delete')
+def _invalidate_on_delete(mapper, connection, target):
+    invalidate_period_stats(connection, _shipment_timestamps(target, include_history=True))
+
+
+def reconcile_user_stats(connection, user_id=None):
+    """Rebuild user_shipment_stats rows from export_request and its archive.
+
+    Rebuilds a single user's row when ``user_id`` is given, otherwise every
+    row. Returns the number of rows written.
+    """
+    table = UserShipmentStats.__table__
+    shipments = all_shipments('id', 'created_by', 'status', 'total')
+    query = select(
+        shipments.c.created_by,
+        shipments.c.status,
+        func.count(shipments.c.id),
+        func.sum(func.coalesce(shipments.c.total, 0))
+    ).group_by(shipments.c.created_by, shipments.c.status)
+    if user_id is not None:
+        query = query.where(shipments.c.created_by == user_id)
+    # Key by UUID so string ids from the session match the loaded column values
+    rows = {}
+    if user_id is not None:
+        user_id = uuid.UUID(str(user_id))
+        rows[user_id] = {'user_id': user_id}
+    for created_by, status, count, revenue in connection.execute(query):
+        created_by = uuid.UUID(str(created_by))
+        row = rows.setdefault(created_by, {'user_id': created_by})
+        row['total_shipments'] = row.get('total_shipments', 0) + count
+        row['total_revenue'] = row.get('total_revenue', 0.0) + float(revenue or 0)
+        column = UserShipmentStats.status_column(status)
+        if column:
+            row[column] = row.get(column, 0) + count
+
+    # Explicit zeros since Core inserts do not apply the ORM defaults per row
+    values = [{**{name: 0 for name in COUNTER_COLUMNS}, **row} for row in rows.values()]
+
+    delete = table.delete()
+    if user_id is not None:
+        delete = delete.where(table.c.user_id == user_id)
+    connection.execute(delete)
+    if values:
+        connection.execute(table.insert(), values)
+    logger.debug("Reconciled shipment stats for %d users", len(values))
+    return len(values)
+
+def apply_user_stats_delta(connection, user_id, shipments=0, revenue=0.0, statuses=None):
+    """Add deltas to a user's counters, creating the row on first use.
+
+    ``statuses`` maps a status to the change in its count.
+    """
+    if user_id is None:
+        return
+    table = UserShipmentStats.__table__
+    values = {}
+    if shipments:
+        values['total_shipments'] = table.c.total_shipments + shipments
+    if revenue:
+        values['total_revenue'] = table.c.total_revenue + revenue
+    for status, delta in (statuses or {}).items():
+        column = UserShipmentStats.status_column(status)
+        if column and delta:
+            values[column] = table.c[column] + delta
+    if not values:
+        return
+
+    values['updated_at'] = func.current_timestamp()
+    update = table.update().where(table.c.user_id == user_id).values(**values)
+    if connection.execute(update).rowcount:
+        return
+
+    # First shipment for this user: start from zero. Existing shipments were
+    # backfilled by the migration, and a reconcile rebuilds any drift.
+    try:
+        with connection.begin_nested():
+            connection.execute(table.insert().values(user_id=user_id, **{name: 0 for name in COUNTER_COLUMNS}))
+    except IntegrityError:
+        # A concurrent request created the row first
+        pass
+    connection.execute(update)
+
+def _reconcile_after_flush(connection, user_id):
+    """Queue a full rebuild of a user's counters for the end of the flush.
+
+    Mapper events run after the whole batch of statements, so rebuilding
+    inside one of them would double count the deltas applied by the rest.
+    """
+    if user_id is not None:
+        connection.info.setdefault('user_stats_reconcile', set()).add(user_id)
+
+@event.listens_for(Session, 'after_flush')
+def _run_queued_reconciles(session, flush_context):
+    connection = session.connection()
+    for user_id in connection.info.pop('user_stats_reconcile', set()):
+        reconcile_user_stats(connection, user_id)
+
+def _loaded(target, name):
+    """Loaded value of an attribute, or None without triggering a refresh"""
+    return inspect(target).dict.get(name)
+
+@event.listens_for(Shipment, 'after_insert')
+def _count_inserted_shipment(mapper, connection, target):
+    status = _loaded(target, 'status')
+    apply_user_stats_delta(
+        connection,
+        _loaded(target, 'created_by'),
+        shipments=1,
+        revenue=_loaded(target, 'total') or 0,
+        statuses={status: 1}
+    )
+
+@event.listens_for(Shipment, 'after_update')
+def _count_updated_shipment(mapper, connection, target):
+    state = inspect(target)
+    owner = state.attrs.created_by.history
+    if owner.has_changes():
+        # Moved between users: rebuild both rows rather than guessing deltas
+        for user_id in set(owner.deleted or []) | set(owner.added or []):
+            _reconcile_after_flush(connection, user_id)
+        return
+
+    status = state.attrs.status.history
+    total = state.attrs.total.history
+    if not status.has_changes() and not total.has_changes():
+        return
+    if (status.has_changes() and not status.deleted) or (total.has_changes() and not total.deleted):
+        # The previous value was never loaded, so the delta is unknown
+        _reconcile_after_flush(connection, _loaded(target, 'created_by'))
+        return
+
+    statuses = {}
+    if status.has_changes():
+        statuses = {status.deleted[0]: -1, status.added[0]: 1}
+    revenue = 0.0
+    if total.has_changes():
+        revenue = (total.added[0] or 0) - (total.deleted[0] or 0)
+    apply_user_stats_delta(connection, _loaded(target, 'created_by'), revenue=revenue, statuses=statuses)
+
+@event.listens_for(Shipment, 'after_delete')
+def _count_deleted_shipment(mapper, connection, target):
+    user_id = _loaded(target, 'created_by')
+    if user_id is None:
+        logger.warning("Deleted shipment %s had no loaded owner; user stats need reconciling", target.id)
+        return
+    if 'status' not in inspect(target).dict or 'total' not in inspect(target).dict:
+        _reconcile_after_flush(connection, user_id)
+        return
+    apply_user_stats_delta(
+        connection,
+        user_id,
+        shipments=-1,
+        revenue=-(_loaded(target, 'total') or 0),
+        statuses={_loaded(target, 'status'): -1}
+    )
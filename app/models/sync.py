@@ -0,0 +1,53 @@
+import logging
+import uuid
+from datetime import datetime
+from sqlalchemy import event, inspect
+from ..extensions import db
+from .shipment import Shipment, ShipmentItem, ShipmentStatusHistory, GUID
+
+logger = logging.getLogger(__name__)
+
+class SyncTombstone(db.Model):
+    """Marker left behind when a synced row is deleted or archived.
+
+    Offline clients read these from ``/api/shipments/changes`` to drop rows
+    they still hold locally. Purged after SYNC_TOMBSTONE_DAYS.
+    """
+    __tablename__ = 'sync_tombstone'
+
+    id = db.Column(GUID(), primary_key=True, default=uuid.uuid4)
+    entity = db.Column(db.String(30), nullable=False)
+    entity_id = db.Column(GUID(), nullable=False)
+    shipment_id = db.Column(GUID())
+    deleted_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+# Entity name used in the changes feed for each synced model, with the
+# attribute holding the owning shipment id
+SYNCED_MODELS = {
+    Shipment: ('shipment', 'id'),
+    ShipmentItem: ('item', 'export_request_id'),
+    ShipmentStatusHistory: ('status_history', 'shipment_id')
+}
+
+def record_tombstones(connection, entity, rows, deleted_at=None):
+    """Insert tombstones for ``rows`` of ``(entity_id, shipment_id)`` pairs"""
+    if not rows:
+        return
+    deleted_at = deleted_at or datetime.utcnow()
+    connection.execute(SyncTombstone.__table__.insert(), [
+        {
+            'id': uuid.uuid4(),
+            'entity': entity,
+            'entity_id': entity_id,
+            'shipment_id': shipment_id,
+            'deleted_at': deleted_at
+        }
+        for entity_id, shipment_id in rows
+    ])
+
+def _record_deleted(mapper, connection, target):
+    entity, shipment_key = SYNCED_MODELS[mapper.class_]
+    record_tombstones(connection, entity, [(target.id, inspect(target).dict.get(shipment_key))])
+
+for _model in SYNCED_MODELS:
+    event.listen(_model, 'after_delete', _record_deleted)
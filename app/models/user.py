@@ -53,7 +53,7 @@ class User(UserMixin, db.Model):
         if not self.id:
             self.id = str(uuid.uuid4())
         elif not self.is_valid_uuid(self.id):
-            logger.warning(f"Invalid UUID format for user ID: {self.id}, generating new UUID")
+            logger.warning("Invalid UUID format for user ID: %s, generating new UUID", self.id)
             self.id = str(uuid.uuid4())
     
     @staticmethod
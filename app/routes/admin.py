@@ -1,7 +1,8 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, Response
 from flask_login import login_required, current_user
 from ..models.user import User
 from ..extensions import db
+from ..utils.metrics import CONTENT_TYPE, metrics_access, render_metrics
 import logging
 
 bp = Blueprint('admin', __name__, url_prefix='/admin')
@@ -13,18 +14,15 @@ logger = logging.getLogger(__name__)
 def manage_users():
     try:
         logger.debug('Accessing manage_users route')
-        logger.debug(f'Current user: {current_user.username} (ID: {current_user.id})')
+        logger.debug('Current user: %s (ID: %s)', current_user.username, current_user.id)
         
         if not current_user.is_admin:
-            logger.warning(f'Access denied for user {current_user.id} - not an admin')
+            logger.warning('Access denied for user %s - not an admin', current_user.id)
             flash('Access denied', 'danger')
             return redirect(url_for('shipments.new_shipment'))
         
-        # Log available endpoints after verifying admin access
-        logger.debug(f'Available endpoints: {[rule.endpoint for rule in current_app.url_map.iter_rules()]}')
-        
         users = User.query.all()
-        logger.debug(f'Found {len(users)} users')
+        logger.debug('Found %s users', len(users))
         return render_template('manage_users.html', users=users)
     except Exception as e:
         logger.error(f'Error in manage_users: {str(e)}', exc_info=True)
@@ -58,10 +56,10 @@ def create_user():
 @bp.route('/reset-password/<string:user_id>', methods=['POST'])
 @login_required
 def reset_user_password(user_id):
-    logger.debug(f'Password reset attempt for user {user_id} by {current_user.id}')
+    logger.debug('Password reset attempt for user %s by %s', user_id, current_user.id)
     
     if not current_user.is_admin:
-        logger.warning(f'Unauthorized password reset attempt by non-admin user {current_user.id}')
+        logger.warning('Unauthorized password reset attempt by non-admin user %s', current_user.id)
         flash('Access denied. Administrator privileges required.', 'error')
         return redirect(url_for('shipments.new_shipment'))
     
@@ -69,7 +67,7 @@ def reset_user_password(user_id):
     
     # Prevent admin users from resetting superuser passwords
     if user.is_superuser:
-        logger.warning(f'Attempt to reset superuser password by admin user {current_user.id}')
+        logger.warning('Attempt to reset superuser password by admin user %s', current_user.id)
         flash('Access denied. Superuser passwords can only be reset through the recovery process.', 'error')
         return redirect(url_for('admin.manage_users'))
     
@@ -81,7 +79,7 @@ def reset_user_password(user_id):
     
     try:
         # Log password reset attempt
-        logger.info(f'Password reset successful for user {user_id} by admin {current_user.id}')
+        logger.info('Password reset successful for user %s by admin %s', user_id, current_user.id)
         
         user.set_password(new_password)
         db.session.commit()
@@ -99,7 +97,7 @@ def reset_user_password(user_id):
 def superuser_recovery():
     """Emergency recovery process for superuser accounts"""
     if not current_user.is_superuser:
-        logger.warning(f'Unauthorized access to superuser recovery by user {current_user.id}')
+        logger.warning('Unauthorized access to superuser recovery by user %s', current_user.id)
         flash('Access denied. This process is only available to superusers.', 'error')
         return redirect(url_for('main.dashboard'))
         
@@ -125,7 +123,7 @@ def superuser_recovery():
             # This would typically involve checking against securely stored recovery codes
             # and implementing additional security measures
             
-            logger.info(f'Superuser recovery process completed for user {current_user.id}')
+            logger.info('Superuser recovery process completed for user %s', current_user.id)
             flash('Recovery process completed successfully', 'success')
             return redirect(url_for('main.dashboard'))
             
@@ -167,16 +165,16 @@ def delete_user(user_id):
 def manage_admins():
     try:
         logger.debug('Accessing manage_admins route')
-        logger.debug(f'Current user: {current_user.username} (ID: {current_user.id})')
+        logger.debug('Current user: %s (ID: %s)', current_user.username, current_user.id)
         
         if not current_user.is_superuser:
-            logger.warning(f'Access denied for user {current_user.id} - not a superuser')
+            logger.warning('Access denied for user %s - not a superuser', current_user.id)
             flash('Access denied. Superuser privileges required.', 'error')
             return redirect(url_for('main.dashboard'))
         
         users = User.query.all()
-        logger.debug(f'Found {len(users)} users')
-        logger.debug(f'Admin users: {[user.username for user in users if user.is_admin]}')
+        logger.debug('Found %s users', len(users))
+        logger.debug('Admin users: %s', [user.username for user in users if user.is_admin])
         
         return render_template('manage_admins.html', users=users)
     except Exception as e:
@@ -290,4 +288,13 @@ def delete_admin(user_id):
         db.session.rollback()
         flash('Error deleting administrator.', 'error')
     
-    return redirect(url_for('admin.manage_admins')) 
\ No newline at end of file
+    return redirect(url_for('admin.manage_admins')) 
+
+@bp.route('/metrics')
+def metrics():
+    """Request and SQL metrics of all workers, in Prometheus text format"""
+    status = metrics_access()
+    if status is not None:
+        logger.warning('Metrics access denied (%s) from %s', status, request.remote_addr)
+        return Response('Access denied\n', status=status, mimetype='text/plain')
+    return Response(render_metrics(), content_type=CONTENT_TYPE)
@@ -2,8 +2,13 @@ from flask import Blueprint, jsonify, request, current_app
 from flask_login import login_required, current_user
 from ..models.shipment import Shipment, ShipmentItem
 from ..utils.helpers import calculate_subtotal, calculate_vat
-from ..extensions import db
-from sqlalchemy import func, case, and_
+from ..utils.archive import get_shipment_or_404
+from ..utils.sync import collect_changes, InvalidCursor
+from ..utils.batch_sync import process_batch
+from ..utils.idempotency import idempotent
+from ..utils.api_tokens import request_token_claims, token_user_id
+from ..utils.stats import collect_stats, count_statuses, daily_overview, status_distribution
+from ..extensions import db, csrf
 import logging
 from datetime import datetime, timedelta
 from functools import wraps
@@ -13,28 +18,35 @@ logger = logging.getLogger(__name__)
 
 bp = Blueprint('api', __name__, url_prefix='/api')
 
+# Statuses reported as "active" by the stats API (anything not yet delivered or cancelled)
+OPEN_STATUSES = ('pending', 'confirmed', 'processing', 'in_transit')
+
 def token_required(f):
+    """Require a valid bearer token; its claims are g.token_payload and its user current_user.
+
+    Tokens without a user claim are accepted with current_user anonymous,
+    unless API_TOKEN_REQUIRE_USER is set.
+    """
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = request.headers.get('Authorization')
-        
-        if not token:
+        if not request.headers.get('Authorization'):
             return jsonify({'message': 'Token is missing'}), 401
         
         try:
-            if not token.startswith('Bearer '):
-                raise jwt.InvalidTokenError('Invalid token format')
-            
-            token = token.split(' ')[1]
-            data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])
-            
-            # Add additional token validation if needed
-            
+            claims = request_token_claims()
         except jwt.ExpiredSignatureError:
             return jsonify({'message': 'Token has expired'}), 401
         except jwt.InvalidTokenError:
             return jsonify({'message': 'Invalid token'}), 401
         
+        user_id = token_user_id(claims)
+        if user_id is None:
+            if current_app.config.get('API_TOKEN_REQUIRE_USER', False):
+                return jsonify({'message': 'Invalid token'}), 401
+        # The token's user must still exist, and win over a session cookie for someone else
+        elif not current_user.is_authenticated or current_user.get_id() != str(user_id):
+            return jsonify({'message': 'Invalid token'}), 401
+        
         return f(*args, **kwargs)
     return decorated
 
@@ -80,13 +92,56 @@ def list_shipments():
         logger.error(f'API Error in list_shipments: {str(e)}')
         return jsonify({'error': 'Internal server error'}), 500
 
+@bp.route('/shipments/changes', methods=['GET'])
+@login_required
+def get_shipment_changes():
+    """Delta feed for offline clients: rows changed or deleted since a cursor."""
+    try:
+        since = request.args.get('since')
+        limit = request.args.get('limit', type=int)
+        if limit is not None:
+            limit = max(1, min(limit, current_app.config['SYNC_PAGE_SIZE']))
+        return jsonify(collect_changes(since, limit))
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f'API Error in get_shipment_changes: {str(e)}', exc_info=True)
+        return jsonify({'error': 'Internal server error'}), 500
+
+@bp.route('/sync/batch', methods=['POST'])
+@login_required
+def sync_batch():
+    """Replay a batch of requests queued by the offline form manager.
+
+    Each entry is ``{"key", "url", "method", "data"}``; ``key`` is the
+    client-generated idempotency key, so resending a batch is safe.
+    """
+    # The API blueprint is exempt, but this endpoint is driven by the session cookie
+    if current_app.config.get('WTF_CSRF_ENABLED', True):
+        csrf.protect()
+    try:
+        data = request.get_json(silent=True) or {}
+        entries = data.get('requests')
+        if not isinstance(entries, list) or not all(isinstance(entry, dict) for entry in entries):
+            return jsonify({'error': 'Expected a list of requests'}), 400
+        if len(entries) > current_app.config['SYNC_BATCH_MAX_REQUESTS']:
+            return jsonify({
+                'error': 'Too many requests in one batch',
+                'max_requests': current_app.config['SYNC_BATCH_MAX_REQUESTS']
+            }), 413
+        return jsonify({'results': process_batch(entries, current_user.id)})
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f'API Error in sync_batch: {str(e)}', exc_info=True)
+        return jsonify({'error': 'Internal server error'}), 500
+
 @bp.route('/shipments/<uuid:shipment_id>', methods=['GET'])
 @token_required
 def get_shipment(shipment_id):
-    logger.debug(f'API: Accessing shipment details for ID: {shipment_id}')
+    logger.debug('API: Accessing shipment details for ID: %s', shipment_id)
     try:
-        # Query shipment directly with UUID
-        shipment = Shipment.query.get_or_404(shipment_id)
+        # Falls back to the archive for old delivered/cancelled shipments
+        shipment = get_shipment_or_404(shipment_id)
         return jsonify(shipment.to_dict(include_items=True))
     except Exception as e:
         logger.error(f'API Error in get_shipment {shipment_id}: {str(e)}')
@@ -94,6 +149,7 @@ def get_shipment(shipment_id):
 
 @bp.route('/shipments', methods=['POST'])
 @token_required
+@idempotent
 def create_shipment():
     logger.debug('API: Creating new shipment')
     try:
@@ -181,7 +237,7 @@ def create_shipment():
 @bp.route('/shipments/<string:shipment_id>', methods=['PUT'])
 @token_required
 def update_shipment(shipment_id):
-    logger.debug(f'API: Updating shipment {shipment_id}')
+    logger.debug('API: Updating shipment %s', shipment_id)
     try:
         shipment = Shipment.query.get_or_404(shipment_id)
         data = request.get_json()
@@ -248,7 +304,7 @@ def update_shipment(shipment_id):
 @bp.route('/shipments/<string:shipment_id>', methods=['DELETE'])
 @token_required
 def delete_shipment(shipment_id):
-    logger.debug(f'API: Deleting shipment {shipment_id}')
+    logger.debug('API: Deleting shipment %s', shipment_id)
     try:
         shipment = Shipment.query.get_or_404(shipment_id)
         db.session.delete(shipment)
@@ -262,7 +318,7 @@ def delete_shipment(shipment_id):
 @bp.route('/shipments/<int:shipment_id>/status', methods=['PATCH'])
 @token_required
 def update_status(shipment_id):
-    logger.debug(f'API: Updating status for shipment {shipment_id}')
+    logger.debug('API: Updating status for shipment %s', shipment_id)
     try:
         shipment = Shipment.query.get_or_404(shipment_id)
         data = request.get_json()
@@ -306,90 +362,20 @@ def get_stats():
         else:
             end_date = datetime.now().date()
         
-        # Get statistics
-        delivered_case = case(
-            (Shipment.status == 'delivered', 1),
-            else_=0
-        )
-
-        cancelled_case = case(
-            (Shipment.status == 'cancelled', 1),
-            else_=0
+        # Summary, status/customer distribution and daily trend in one pass
+        period_end = end_date + timedelta(days=1)
+        stats = collect_stats(
+            {'period': (start_date, period_end)},
+            trend=('day', start_date, period_end),
+            by_customer_group=True
         )
-
-        # Update case expressions for active shipments
-        active_case = case(
-            (Shipment.status.in_(['pending', 'confirmed', 'processing', 'in_transit']), 1),
-            else_=0
-        )
-
-        stats = db.session.query(
-            func.count(Shipment.id).label('total_shipments'),
-            func.sum(Shipment.total).label('total_revenue'),
-            func.avg(Shipment.total).label('average_revenue'),
-            func.sum(Shipment.vat).label('total_vat'),
-            func.sum(delivered_case).label('delivered_shipments'),
-            func.sum(cancelled_case).label('cancelled_shipments'),
-            func.sum(active_case).label('active_shipments')
-        ).filter(
-            Shipment.created_at.between(start_date, end_date)
-        ).first()
-        
-        logger.debug('=== Detailed Stats Query Debug ===')
-        logger.debug('Individual counts:')
-        logger.debug('- Total shipments: %d', stats.total_shipments or 0)
-        logger.debug('- Active shipments: %d', stats.active_shipments or 0)
-        logger.debug('- Delivered shipments: %d', stats.delivered_shipments or 0)
+        summary = stats['periods']['period']
         
         logger.debug('Stats query result: %s', {
-            'total_shipments': stats.total_shipments or 0,
-            'active_shipments': stats.active_shipments or 0,
-            'delivered_shipments': stats.delivered_shipments or 0
-        })
-        
-        # Get status distribution with debug logging
-        status_counts = db.session.query(
-            Shipment.status,
-            func.count(Shipment.id).label('count')
-        ).filter(
-            Shipment.created_at.between(start_date, end_date)
-        ).group_by(Shipment.status).all()
-        
-        logger.debug('Status distribution raw data: %s', 
-                    [(status, count) for status, count in status_counts])
-        
-        # Validate status counts
-        total_count = sum(count for _, count in status_counts)
-        logger.debug('Total shipments from status distribution: %d', total_count)
-        logger.debug('Status counts validation: %s', {
-            'total_from_query': stats.total_shipments,
-            'total_from_status': total_count,
-            'delivered_count': stats.delivered_shipments,
-            'active_count': stats.active_shipments
+            'total_shipments': summary['total_shipments'],
+            'status_counts': summary['status_counts']
         })
         
-        # Get customer group distribution
-        customer_distribution = db.session.query(
-            Shipment.customer_group,
-            func.count(Shipment.id).label('count'),
-            func.sum(Shipment.total).label('revenue')
-        ).filter(
-            Shipment.created_at.between(start_date, end_date)
-        ).group_by(
-            Shipment.customer_group
-        ).all()
-        
-        # Get trend data
-        trend_data = db.session.query(
-            func.date_trunc('day', Shipment.created_at).label('date'),
-            func.count(Shipment.id).label('count'),
-            func.coalesce(func.sum(Shipment.total), 0).label('revenue')
-        ).filter(
-            Shipment.created_at.between(start_date, end_date)
-        ).group_by(
-            func.date_trunc('day', Shipment.created_at)
-        ).order_by('date').all()
-        
         # Format response
         response_data = {
             'period': {
@@ -397,47 +383,27 @@ def get_stats():
                 'end_date': end_date.isoformat()
             },
             'summary': {
-                'total_shipments': stats.total_shipments or 0,
-                'total_revenue': float(stats.total_revenue or 0),
-                'average_revenue': float(stats.average_revenue or 0),
-                'total_vat': float(stats.total_vat or 0),
-                'delivered_shipments': stats.delivered_shipments or 0,
-                'cancelled_shipments': stats.cancelled_shipments or 0,
-                'active_shipments': stats.active_shipments or 0
-            },
-            'status_distribution': {
-                status: count for status, count in status_counts
+                'total_shipments': summary['total_shipments'],
+                'total_revenue': summary['total_revenue'],
+                'average_revenue': summary['average_revenue'],
+                'total_vat': calculate_vat(summary['total_revenue']),
+                'delivered_shipments': summary['delivered_shipments'],
+                'cancelled_shipments': summary['cancelled_shipments'],
+                'active_shipments': count_statuses(summary, OPEN_STATUSES)
             },
+            'status_distribution': summary['status_counts'],
             'customer_distribution': [{
                 'group': group,
-                'count': count,
-                'revenue': float(revenue or 0)
-            } for group, count, revenue in customer_distribution],
+                'count': totals['count'],
+                'revenue': totals['revenue']
+            } for group, totals in summary['customer_groups'].items()],
             'trends': {
-                'dates': [t.date.strftime('%Y-%m-%d') for t in trend_data],
-                'shipments': [t.count for t in trend_data],
-                'revenue': [float(t.revenue or 0) for t in trend_data]
+                'dates': [t['bucket'] for t in stats['trends']],
+                'shipments': [t['count'] for t in stats['trends']],
+                'revenue': [t['revenue'] for t in stats['trends']]
             }
         }
         
-        # Data validation
-        logger.debug('Validating response data')
-        
-        # Verify counts add up
-        total_by_status = sum(count for _, count in status_counts)
-        if total_by_status != stats.total_shipments:
-            logger.error('Count mismatch: status_distribution total (%d) != total_shipments (%d)',
-                        total_by_status, stats.total_shipments)
-        
-        # Verify active + delivered + cancelled = total
-        status_sum = (stats.active_shipments or 0) + (stats.delivered_shipments or 0)
-        if status_sum != stats.total_shipments:
-            logger.error('Status count mismatch: active (%d) + delivered (%d) != total (%d)',
-                        stats.active_shipments or 0,
-                        stats.delivered_shipments or 0,
-                        stats.total_shipments)
-        
-        logger.debug('Response data validation complete')
         return jsonify(response_data)
     except Exception as e:
         logger.error(f'API Error in get_stats: {str(e)}')
@@ -474,7 +440,7 @@ def get_dashboard_data():
     try:
         # Get time range from query parameters
         time_range = request.args.get('timeRange', '30')
-        current_app.logger.debug(f"Processing timeRange parameter: {time_range}")
+        current_app.logger.debug("Processing timeRange parameter: %s", time_range)
         
         # Calculate date range
         end_date = datetime.now()
@@ -482,108 +448,42 @@ def get_dashboard_data():
         # Handle "all" time range for super users
         if time_range == 'all' and hasattr(current_user, 'is_superuser') and current_user.is_superuser:
             current_app.logger.debug("Super user requested all-time data")
-            # Use a very old start date to get all records
-            start_date = datetime(2000, 1, 1)
+            # No start date covers the whole history
+            start_date = None
         else:
             # Convert time range to days
             days = int(time_range)
-            current_app.logger.debug(f"Converted timeRange to days: {days}")
+            current_app.logger.debug("Converted timeRange to days: %s", days)
             start_date = end_date - timedelta(days=days)
         
-        current_app.logger.debug(f"Date range: {start_date} to {end_date}")
-        
-        # Get status counts with validation - RESTORE DATE FILTER
-        current_app.logger.debug("=== Starting Status Count Query ===")
-        status_counts = db.session.query(
-            Shipment.status,
-            func.count(Shipment.id)
-        ).filter(
-            Shipment.created_at.between(start_date, end_date)
-        ).group_by(Shipment.status).all()
-        
-        current_app.logger.debug(f"Raw status counts: {status_counts}")
-        
-        # Format status counts with defaults
-        formatted_status_counts = {
-            'pending': 0,
-            'processing': 0,
-            'in_transit': 0,
-            'delivered': 0,
-            'cancelled': 0
-        }
-        # Convert status_counts to dict properly
-        current_app.logger.debug(f"Converting status_counts to dict: {[(status.lower(), count) for status, count in status_counts]}")
-        formatted_status_counts.update({status.lower(): count for status, count in status_counts})
-        
-        current_app.logger.debug(f"Formatted status counts: {formatted_status_counts}")
-        
-        # Get aggregated data - RESTORE DATE FILTER
-        stats = db.session.query(
-            func.count(Shipment.id).label('total_shipments'),
-            func.sum(Shipment.total).label('total_revenue'),
-            func.avg(Shipment.total).label('average_revenue'),
-            func.count(case((Shipment.status.in_(['processing', 'in_transit']), 1))).label('active_shipments'),
-            func.count(case((Shipment.status == 'delivered', 1))).label('delivered_shipments')
-        ).filter(
-            Shipment.created_at.between(start_date, end_date)
-        ).first()
-        
-        current_app.logger.debug(f"Stats query result: {stats}")
-        
-        # Get daily trend data - KEEP DATE FILTER FOR TRENDS
-        trend_data = db.session.query(
-            func.date_trunc('day', Shipment.created_at).label('date'),
-            func.count(Shipment.id).label('count'),
-            func.sum(Shipment.total).label('revenue')
-        ).filter(
-            Shipment.created_at.between(start_date, end_date)
-        ).group_by(
-            func.date_trunc('day', Shipment.created_at)
-        ).order_by('date').all()
-        
-        # Generate date range for all days
-        all_dates = []
-        current_date = start_date
-        while current_date <= end_date:
-            all_dates.append(current_date.date())
-            current_date += timedelta(days=1)
-        
-        # Create a mapping of existing data
-        trend_map = {t.date.date(): {'count': t.count, 'revenue': float(t.revenue or 0)} 
-                    for t in trend_data}
-        
-        # Fill in missing dates with zeros
+        current_app.logger.debug("Date range: %s to %s", start_date, end_date)
+        
+        # Today is computed live; closed days come from the period stats cache
+        stats = daily_overview(start_date)
+        summary = stats['periods']['window']
+        daily = stats['trends']
         trends = {
-            'labels': [],
-            'shipments': [],
-            'revenue': []
+            'labels': [t['bucket'] for t in daily],
+            'shipments': [t['count'] for t in daily],
+            'revenue': [t['revenue'] for t in daily]
         }
         
-        for date in all_dates:
-            trends['labels'].append(date.strftime('%Y-%m-%d'))
-            if date in trend_map:
-                trends['shipments'].append(trend_map[date]['count'])
-                trends['revenue'].append(trend_map[date]['revenue'])
-            else:
-                trends['shipments'].append(0)
-                trends['revenue'].append(0)
-        
-        current_app.logger.debug(f"Generated trend data with {len(trends['labels'])} days")
+        current_app.logger.debug("Generated trend data with %s days", len(trends['labels']))
         
         # Format response
         response = {
             'stats': {
-                'total_shipments': stats.total_shipments or 0,
-                'total_revenue': float(stats.total_revenue or 0),
-                'average_revenue': float(stats.average_revenue or 0),
-                'active_shipments': stats.active_shipments or 0,
-                'delivered_shipments': stats.delivered_shipments or 0
+                'total_shipments': summary['total_shipments'],
+                'total_revenue': summary['total_revenue'],
+                'average_revenue': summary['average_revenue'],
+                'active_shipments': summary['active_shipments'],
+                'delivered_shipments': summary['delivered_shipments']
             },
-            'status_distribution': formatted_status_counts,
+            'status_distribution': status_distribution(summary),
             'trends': trends
         }
         
-        current_app.logger.debug(f"Response data: {response}")
+        current_app.logger.debug("Response data: %s", response)
         
         # Validate response structure
         if not all(key in response for key in ['stats', 'status_distribution', 'trends']):
@@ -32,33 +32,35 @@ def logout():
 @login_required
 def change_password():
     logger.debug('Accessing change_password route')
-    logger.debug(f'Current user: {current_user.username} (ID: {current_user.id})')
+    logger.debug('Current user: %s (ID: %s)', current_user.username, current_user.id)
     
     if request.method == 'POST':
         logger.debug('Processing password change request')
         current_password = request.form.get('current_password')
         new_password = request.form.get('new_password')
         confirm_password = request.form.get('confirm_password')
+        # current_user is a cached snapshot without the password hash
+        user = db.session.get(User, current_user.id)
         
-        if not current_user.check_password(current_password):
-            logger.warning(f'Invalid current password attempt for user {current_user.id}')
+        if not user.check_password(current_password):
+            logger.warning('Invalid current password attempt for user %s', current_user.id)
             flash('Current password is incorrect', 'danger')
             return render_template('change_password.html')
         
         if new_password != confirm_password:
-            logger.warning(f'Password mismatch for user {current_user.id}')
+            logger.warning('Password mismatch for user %s', current_user.id)
             flash('New passwords do not match', 'danger')
             return render_template('change_password.html')
         
         if len(new_password) < 8:
-            logger.warning(f'Password too short for user {current_user.id}')
+            logger.warning('Password too short for user %s', current_user.id)
             flash('Password must be at least 8 characters long', 'danger')
             return render_template('change_password.html')
         
         try:
-            current_user.set_password(new_password)
+            user.set_password(new_password)
             db.session.commit()
-            logger.info(f'Password changed successfully for user {current_user.id}')
+            logger.info('Password changed successfully for user %s', current_user.id)
             flash('Password changed successfully', 'success')
             return redirect(url_for('shipments.new_shipment'))
         except Exception as e:
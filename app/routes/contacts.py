@@ -26,11 +26,11 @@ def list_senders():
         ).distinct()
         
         total = senders.count()
-        logger.debug(f'Total senders found: {total}')
+        logger.debug('Total senders found: %s', total)
         
         senders = senders.limit(per_page).offset((page - 1) * per_page).all()
         
-        logger.debug(f'Found {len(senders)} senders for page {page}')
+        logger.debug('Found %s senders for page %s', len(senders), page)
         
         contacts = [{
             'name': s.sender_name,
@@ -88,11 +88,11 @@ def list_receivers():
         ).distinct()
         
         total = receivers.count()
-        logger.debug(f'Total receivers found: {total}')
+        logger.debug('Total receivers found: %s', total)
         
         receivers = receivers.limit(per_page).offset((page - 1) * per_page).all()
         
-        logger.debug(f'Found {len(receivers)} receivers for page {page}')
+        logger.debug('Found %s receivers for page %s', len(receivers), page)
         
         contacts = [{
             'name': r.receiver_name,
@@ -163,11 +163,11 @@ def list_all_contacts():
         all_contacts = senders.union(receivers)
         
         total = all_contacts.count()
-        logger.debug(f'Total contacts found: {total}')
+        logger.debug('Total contacts found: %s', total)
         
         all_contacts = all_contacts.limit(per_page).offset((page - 1) * per_page).all()
         
-        logger.debug(f'Found {len(all_contacts)} contacts for page {page}')
+        logger.debug('Found %s contacts for page %s', len(all_contacts), page)
         
         contacts = [{
             'name': c.name,
@@ -2,12 +2,16 @@ from flask import Blueprint, render_template, redirect, url_for, request, flash,
 from flask_login import login_required, current_user
 from ..models.shipment import Shipment
 from ..extensions import db
-from sqlalchemy import func, case
 import logging
 from datetime import datetime, timedelta
 import os
 import mimetypes
 from ..utils.file_storage import get_upload_path
+from ..utils.helpers import calculate_vat
+from ..utils.archive import find_shipment
+from ..utils.stats import collect_stats, monthly_overview, status_distribution
+from ..utils.query_inspector import query_budget
+from ..utils.loader_profiles import loader_options
 from app.models import ExportRequest
 
 logger = logging.getLogger(__name__)
@@ -45,23 +49,23 @@ def index():
     logger.debug("=== Starting Root Route Handler ===")
     try:
         logger.debug("=== Application State ===")
-        logger.debug(f"Debug mode: {current_app.debug}")
-        logger.debug(f"Testing mode: {current_app.testing}")
-        logger.debug(f"Secret key set: {'SECRET_KEY' in current_app.config}")
+        logger.debug("Debug mode: %s", current_app.debug)
+        logger.debug("Testing mode: %s", current_app.testing)
+        logger.debug("Secret key set: %s", 'SECRET_KEY' in current_app.config)
         
         logger.debug("\n=== Database Configuration ===")
-        logger.debug(f"Database URL configured: {'SQLALCHEMY_DATABASE_URI' in current_app.config}")
-        logger.debug(f"Database connection options: {current_app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})}")
+        logger.debug("Database URL configured: %s", 'SQLALCHEMY_DATABASE_URI' in current_app.config)
+        logger.debug("Database connection options: %s", current_app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
         
         logger.debug("\n=== Authentication State ===")
-        logger.debug(f"Login manager configured: {hasattr(current_app, 'login_manager')}")
-        logger.debug(f"Current user: {current_user}")
-        logger.debug(f"User authenticated: {current_user.is_authenticated if hasattr(current_user, 'is_authenticated') else 'No auth attribute'}")
+        logger.debug("Login manager configured: %s", hasattr(current_app, 'login_manager'))
+        logger.debug("Current user: %s", current_user)
+        logger.debug("User authenticated: %s", current_user.is_authenticated if hasattr(current_user, 'is_authenticated') else 'No auth attribute')
         
         if current_user.is_authenticated:
             logger.debug("\n=== Authenticated User Details ===")
-            logger.debug(f"User ID: {current_user.id}")
-            logger.debug(f"Username: {current_user.username}")
+            logger.debug("User ID: %s", current_user.id)
+            logger.debug("Username: %s", current_user.username)
             logger.debug("Redirecting to dashboard")
             return redirect(url_for('main.dashboard'))
         
@@ -72,7 +76,7 @@ def index():
         logger.error(f"Error type: {type(e).__name__}")
         logger.error(f"Error message: {str(e)}")
         logger.error("Stack trace:", exc_info=True)
-        logger.error(f"Request details: {request.environ}")
+        logger.error("Request details: %s %s", request.method, request.path)
         return render_template('error.html', error=f"An error occurred: {str(e)}"), 500
 
 @bp.route('/terms')
@@ -87,6 +91,7 @@ def terms():
 
 @bp.route('/dashboard')
 @login_required
+@query_budget(10)
 def dashboard():
     try:
         current_app.logger.debug('=== Starting Dashboard Data Generation ===')
@@ -95,54 +100,26 @@ def dashboard():
         current_month_start = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
         previous_month_start = (current_month_start - timedelta(days=1)).replace(day=1)
         
-        current_app.logger.debug(f'Date ranges - Current month: {current_month_start}, Previous month: {previous_month_start}')
+        current_app.logger.debug('Date ranges - Current month: %s, Previous month: %s', current_month_start, previous_month_start)
         
-        # Get current month stats
-        current_app.logger.debug(f'Fetching monthly stats from {current_month_start} to {datetime.now()}')
-        current_stats = db.session.query(
-            func.count(Shipment.id).label('total_shipments'),
-            func.sum(Shipment.total).label('total_revenue'),
-            func.count(case((Shipment.status.in_(['processing', 'in_transit']), 1))).label('active_shipments'),
-            func.count(case((Shipment.status == 'delivered', 1))).label('delivered_shipments')
-        ).filter(
-            Shipment.created_at >= current_month_start
-        ).first()
-        
-        current_app.logger.debug(f'Monthly stats query result: {current_stats}')
+        # Super users may view all-time status data via the URL parameter
+        time_range = request.args.get('timeRange')
+        show_all_time = time_range == 'all' and hasattr(current_user, 'is_superuser') and current_user.is_superuser
+        
+        # Current month is computed live; previous months come from the period stats cache
+        stats = monthly_overview(months=6, all_time=show_all_time)
+        
+        current_stats = stats['periods']['current']
+        previous_month_stats = stats['periods']['previous']
         
         # Format current month stats
         monthly_stats = {
-            'total_shipments': current_stats.total_shipments or 0,
-            'total_revenue': float(current_stats.total_revenue or 0),
-            'active_shipments': current_stats.active_shipments or 0,
-            'delivered_shipments': current_stats.delivered_shipments or 0
+            'total_shipments': current_stats['total_shipments'],
+            'total_revenue': current_stats['total_revenue'],
+            'active_shipments': current_stats['active_shipments'],
+            'delivered_shipments': current_stats['delivered_shipments']
         }
         
-        current_app.logger.debug(f'Validated monthly stats: {monthly_stats}')
-        
-        # Get previous month stats for comparison
-        current_app.logger.debug(f'Fetching monthly stats from {previous_month_start} to {current_month_start}')
-        previous_stats = db.session.query(
-            func.count(Shipment.id).label('total_shipments'),
-            func.sum(Shipment.total).label('total_revenue'),
-            func.count(case((Shipment.status.in_(['processing', 'in_transit']), 1))).label('active_shipments'),
-            func.count(case((Shipment.status == 'delivered', 1))).label('delivered_shipments')
-        ).filter(
-            Shipment.created_at.between(previous_month_start, current_month_start)
-        ).first()
-        
-        current_app.logger.debug(f'Monthly stats query result: {previous_stats}')
-        
-        # Format previous month stats
-        previous_month_stats = {
-            'total_shipments': previous_stats.total_shipments or 0,
-            'total_revenue': float(previous_stats.total_revenue or 0),
-            'active_shipments': previous_stats.active_shipments or 0,
-            'delivered_shipments': previous_stats.delivered_shipments or 0
-        }
-        
-        current_app.logger.debug(f'Validated monthly stats: {previous_month_stats}')
-        
         # Calculate changes
         monthly_stats['shipment_change'] = calculate_percentage_change(
             previous_month_stats['total_shipments'],
@@ -153,81 +130,38 @@ def dashboard():
             monthly_stats['total_revenue']
         )
         
-        current_app.logger.debug(f'Final monthly stats: {monthly_stats}')
-        
-        # Get status distribution - RESTORE DATE FILTER TO SHOW CURRENT MONTH ONLY
-        status_counts = db.session.query(
-            Shipment.status,
-            func.count(Shipment.id).label('count')
-        ).filter(
-            Shipment.created_at >= current_month_start
-        ).group_by(Shipment.status).all()
-        
-        # Format status counts with defaults
-        monthly_stats.update({
-            'pending_count': 0,
-            'processing_count': 0,
-            'in_transit_count': 0,
-            'delivered_count': 0,
-            'cancelled_count': 0,
-            'time_period': f"Current month ({current_month_start.strftime('%b %Y')})"  # Add time period label
-        })
-        
-        # Check if super user is viewing all-time data from the URL parameter
-        time_range = request.args.get('timeRange')
-        if time_range == 'all' and hasattr(current_user, 'is_superuser') and current_user.is_superuser:
+        current_app.logger.debug('Final monthly stats: %s', monthly_stats)
+        
+        # Status distribution for the current month, or all time for super users
+        monthly_stats['time_period'] = f"Current month ({current_month_start.strftime('%b %Y')})"
+        distribution_stats = current_stats
+        if show_all_time:
             current_app.logger.debug("Super user viewing all-time data")
             monthly_stats['time_period'] = "All Time"
-            
-            # Get status counts for all time
-            status_counts = db.session.query(
-                Shipment.status,
-                func.count(Shipment.id).label('count')
-            ).group_by(Shipment.status).all()
-        
-        # Log status counts for debugging
-        current_app.logger.debug(f'Raw status distribution: {status_counts}')
-        
-        # Map status values to their corresponding keys in monthly_stats
-        for status, count in status_counts:
-            status_key = f'{status.lower().replace("-", "_")}_count'
-            current_app.logger.debug(f'Mapping status "{status}" to key "{status_key}" with count {count}')
-            monthly_stats[status_key] = count
-        
-        current_app.logger.debug(f'Final status distribution in monthly_stats: {monthly_stats}')
-        
-        # Get trend data
-        current_app.logger.debug('=== Starting Trend Data Generation ===')
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=180)
-        current_app.logger.debug(f'Date range: {start_date} to {end_date}')
-        
-        trend_data = db.session.query(
-            func.date_trunc('month', Shipment.created_at).label('month'),
-            func.count(Shipment.id).label('count'),
-            func.sum(Shipment.total).label('revenue')
-            ).filter(
-            Shipment.created_at.between(start_date, end_date)
-        ).group_by('month').order_by('month').all()
-            
-        current_app.logger.debug(f'Query successful - Found {len(trend_data)} months of data')
+            distribution_stats = stats['periods']['all']
+        
+        for status, count in status_distribution(distribution_stats).items():
+            monthly_stats[f'{status.replace("-", "_")}_count'] = count
+        
+        current_app.logger.debug('Final status distribution in monthly_stats: %s', monthly_stats)
         
         trends = {
-            'labels': [t.month.strftime('%Y-%m-%d') for t in trend_data],
-            'shipments': [t.count for t in trend_data],
-            'revenue': [float(t.revenue or 0) for t in trend_data]
+            'labels': [t['bucket'] for t in stats['trends']],
+            'shipments': [t['count'] for t in stats['trends']],
+            'revenue': [t['revenue'] for t in stats['trends']]
         }
         
-        current_app.logger.debug(f'Processed trend data: {trends}')
+        current_app.logger.debug('Processed trend data: %s', trends)
         
         # Get recent shipments
-        recent_shipments = Shipment.query.order_by(
+        recent_shipments = Shipment.query.options(*loader_options('list')).order_by(
             Shipment.created_at.desc()
         ).limit(5).all()
         
-        current_app.logger.debug(f'Retrieved {len(recent_shipments)} recent shipments')
-        for shipment in recent_shipments:
-            current_app.logger.debug(f'Shipment {shipment.waybill_number}: Status={shipment.status}, Created by={shipment.created_by}')
+        current_app.logger.debug('Retrieved %s recent shipments', len(recent_shipments))
+        if current_app.logger.isEnabledFor(logging.DEBUG):
+            for shipment in recent_shipments:
+                current_app.logger.debug('Shipment %s: Status=%s, Created by=%s', shipment.waybill_number, shipment.status, shipment.created_by)
         
         # Debug template data
         current_app.logger.debug('=== Template Data Debug ===')
@@ -236,11 +170,11 @@ def dashboard():
             'trends': trends,
             'recent_shipments': recent_shipments
         }
-        current_app.logger.debug(f'Template data type: {type(template_data)}')
-        current_app.logger.debug(f'Monthly stats: {monthly_stats}')
-        current_app.logger.debug(f'Trend data type: {type(trends)}')
-        current_app.logger.debug(f'Trend data: {trends}')
-        current_app.logger.debug(f'Recent shipments count: {len(recent_shipments)}')
+        current_app.logger.debug('Template data type: %s', type(template_data))
+        current_app.logger.debug('Monthly stats: %s', monthly_stats)
+        current_app.logger.debug('Trend data type: %s', type(trends))
+        current_app.logger.debug('Trend data: %s', trends)
+        current_app.logger.debug('Recent shipments count: %s', len(recent_shipments))
         
         return render_template('dashboard.html', **template_data)
             
@@ -262,18 +196,14 @@ def profile():
     try:
         # Get recent shipments (no user filtering)
         logger.debug('Fetching recent shipments')
-        recent_shipments = Shipment.query.order_by(
+        recent_shipments = Shipment.query.options(*loader_options('list')).order_by(
             Shipment.created_at.desc()
         ).limit(10).all()
-        logger.debug(f'Found {len(recent_shipments)} recent shipments')
+        logger.debug('Found %s recent shipments', len(recent_shipments))
         
         # Get overall statistics
         logger.debug('Calculating shipment statistics')
-        shipment_stats = db.session.query(
-            func.count(Shipment.id).label('total_shipments'),
-            func.sum(Shipment.total).label('total_revenue'),
-            func.count(case((Shipment.status == 'delivered', 1))).label('delivered_shipments')
-        ).first()
+        shipment_stats = collect_stats({'all': (None, None)})['periods']['all']
         logger.debug('Statistics calculated successfully')
         
         return render_template('profile.html',
@@ -286,20 +216,21 @@ def profile():
 
 @bp.route('/print_form_template')
 @login_required
+@query_budget(8)
 def print_form_template():
     """Render the print form template."""
     try:
         current_app.logger.debug("Accessing print form template")
-        current_app.logger.debug(f"Current user ID: {current_user.id}")
+        current_app.logger.debug("Current user ID: %s", current_user.id)
         
         current_app.logger.debug("Attempting to query all shipments")
-        shipments = Shipment.query.all()
-        current_app.logger.debug(f"Found {len(shipments)} shipments")
+        shipments = Shipment.query.options(*loader_options('list')).all()
+        current_app.logger.debug("Found %s shipments", len(shipments))
         
         selected_shipment = None
         shipment_id = request.args.get('shipment_id')
         if shipment_id:
-            selected_shipment = Shipment.query.get(shipment_id)
+            selected_shipment = find_shipment(shipment_id, profile='print')
         
         current_app.logger.debug("Rendering template print_form_template.html")
         return render_template('shipments/print_form_template.html', 
@@ -331,34 +262,22 @@ def reports():
         else:
             end_date = datetime.now().date()
         
-        # Get shipment statistics
-        shipment_stats = db.session.query(
-            func.count(Shipment.id).label('total_shipments'),
-            func.sum(Shipment.total).label('total_revenue'),
-            func.avg(Shipment.total).label('average_revenue'),
-            func.sum(Shipment.vat).label('total_vat'),
-            func.count(case((Shipment.status == 'delivered', 1))).label('delivered_shipments'),
-            func.count(case((Shipment.status == 'cancelled', 1))).label('cancelled_shipments')
-        ).filter(
-            Shipment.created_at.between(start_date, end_date + timedelta(days=1))
-        ).first()
-        
-        # Get daily revenue
-        daily_revenue = db.session.query(
-            func.date(Shipment.created_at).label('date'),
-            func.sum(Shipment.total).label('revenue')
-        ).filter(
-            Shipment.created_at.between(start_date, end_date + timedelta(days=1))
-        ).group_by(
-            func.date(Shipment.created_at)
-        ).all()
+        # Summary, daily revenue and customer groups in one pass
+        period_end = end_date + timedelta(days=1)
+        stats = collect_stats(
+            {'report': (start_date, period_end)},
+            trend=('day', start_date, period_end),
+            by_customer_group=True
+        )
+        shipment_stats = stats['periods']['report']
+        shipment_stats['total_vat'] = calculate_vat(shipment_stats['total_revenue'])
         
         # Format daily revenue for chart
         dates = [(start_date + timedelta(days=x)).strftime('%Y-%m-%d')
                 for x in range((end_date - start_date).days + 1)]
         revenues = {date: 0 for date in dates}
-        for date, revenue in daily_revenue:
-            revenues[date.strftime('%Y-%m-%d')] = float(revenue)
+        for bucket in stats['trends']:
+            revenues[bucket['bucket']] = bucket['revenue']
         
         revenue_chart = {
             'labels': dates,
@@ -366,15 +285,10 @@ def reports():
         }
         
         # Get customer group distribution
-        customer_stats = db.session.query(
-            Shipment.customer_group,
-            func.count(Shipment.id).label('shipment_count'),
-            func.sum(Shipment.total).label('total_revenue')
-        ).filter(
-            Shipment.created_at.between(start_date, end_date + timedelta(days=1))
-        ).group_by(
-            Shipment.customer_group
-        ).all()
+        customer_stats = [
+            (group, totals['count'], totals['revenue'])
+            for group, totals in shipment_stats['customer_groups'].items()
+        ]
         
         return render_template('reports.html',
                              start_date=start_date,
@@ -389,24 +303,24 @@ def reports():
 @bp.route('/uploads/<path:file_id>')
 def serve_image(file_id):
     """Serve uploaded images from local storage"""
-    logger.debug(f'Attempting to serve image with file_id: {file_id}')
+    logger.debug('Attempting to serve image with file_id: %s', file_id)
     try:
         # Get upload folder path
         upload_path = get_upload_path()
-        logger.debug(f'Upload path: {upload_path}')
+        logger.debug('Upload path: %s', upload_path)
         
         # Find the file with the given file_id (could have different extensions)
         for filename in os.listdir(upload_path):
             if filename.startswith(file_id):
                 file_path = os.path.join(upload_path, filename)
-                logger.debug(f'Found file: {file_path}')
+                logger.debug('Found file: %s', file_path)
                 
                 # Determine content type
                 content_type, _ = mimetypes.guess_type(file_path)
                 if not content_type:
                     content_type = 'application/octet-stream'
                 
-                logger.debug(f'Serving file with content type: {content_type}')
+                logger.debug('Serving file with content type: %s', content_type)
                 
                 # Return the file with proper mimetype
                 return send_from_directory(
@@ -425,7 +339,7 @@ def serve_image(file_id):
         return 'Error serving image', 500
 
 def calculate_avg_delivery_time(start_date, end_date):
-    logger.debug(f"Calculating average delivery time between {start_date} and {end_date}")
+    logger.debug("Calculating average delivery time between %s and %s", start_date, end_date)
     try:
         delivered_shipments = Shipment.query.filter(
             Shipment.status == 'delivered',
@@ -447,7 +361,7 @@ def calculate_avg_delivery_time(start_date, end_date):
                     valid_shipments += 1
         
         avg_days = total_days / valid_shipments if valid_shipments > 0 else 0
-        logger.debug(f"Calculated average delivery time: {avg_days:.1f} days")
+        logger.debug("Calculated average delivery time: %.1f days", avg_days)
         return avg_days
     except Exception as e:
         logger.error(f"Error calculating average delivery time: {str(e)}")
@@ -486,7 +400,7 @@ def calculate_monthly_stats():
             'revenue_change': revenue_change
         }
         
-        logger.debug(f"Final monthly stats: {monthly_stats}")
+        logger.debug("Final monthly stats: %s", monthly_stats)
         return monthly_stats
         
     except Exception as e:
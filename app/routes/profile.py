@@ -2,10 +2,11 @@ from flask import Blueprint, render_template, jsonify, request, current_app
 from flask_login import login_required, current_user
 from ..models.shipment import Shipment
 from ..extensions import db
+from ..utils.stats import user_stats
+from ..utils.loader_profiles import loader_options
+from ..utils.query_inspector import query_budget
 from sqlalchemy import desc
 import logging
-from sqlalchemy import case
-from sqlalchemy import func
 
 logger = logging.getLogger(__name__)
 
@@ -13,111 +14,27 @@ bp = Blueprint('profile', __name__, url_prefix='/profile')
 
 @bp.route('/')
 @login_required
+@query_budget(6)
 def index():
     """Display user profile and shipment overview."""
     try:
         logger.debug("\n=== PROFILE PAGE ACCESS ===")
-        logger.debug("User Authentication Info:")
-        logger.debug(f"Authenticated User ID: {current_user.id}")
-        logger.debug(f"User ID Type: {type(current_user.id)}")
-        logger.debug(f"User Object Type: {type(current_user)}")
-        logger.debug(f"User Dict: {current_user.__dict__}")
+        logger.debug("Loading profile for user %s", current_user.id)
         
-        # Verify database connection and get a sample shipment
-        logger.debug("\n=== DATABASE VERIFICATION ===")
-        try:
-            sample_shipment = Shipment.query.first()
-            if sample_shipment:
-                logger.debug(f"Sample Shipment ID: {sample_shipment.id}")
-                logger.debug(f"Sample Shipment created_by: {sample_shipment.created_by}")
-                logger.debug(f"Sample Shipment created_by type: {type(sample_shipment.created_by)}")
-            else:
-                logger.debug("No shipments found in database")
-        except Exception as e:
-            logger.error(f"Database verification error: {str(e)}")
-
-        # Debug raw shipment count
-        logger.debug("\n=== USER SHIPMENTS QUERY ===")
-        logger.debug(f"Querying with user_id: {current_user.id}")
-        
-        # Query shipments directly with UUID
-        shipment_count = db.session.query(Shipment).filter(
-            Shipment.created_by == current_user.id
-        ).count()
-        
-        logger.debug(f"Direct shipment count: {shipment_count}")
-        
-        # Get all shipments for debugging
-        logger.debug("\n=== ALL SHIPMENTS CHECK ===")
-        all_shipments = Shipment.query.all()
-        logger.debug(f"Total shipments in database: {len(all_shipments)}")
-        for ship in all_shipments:
-            logger.debug(f"Shipment ID: {ship.id}, created_by: {ship.created_by}, created_by type: {type(ship.created_by)}")
-        
-        # Stats query with enhanced logging
-        logger.debug("\n=== STATS QUERY ===")
-        active_case = case(
-            (Shipment.status.in_(['processing', 'in_transit']), 1),
-            else_=0
-        )
-        
-        stats_query = db.session.query(
-            func.count(Shipment.id).label('total_shipments'),
-            func.sum(Shipment.total).label('total_revenue'),
-            func.sum(active_case).label('active_shipments'),
-            func.sum(
-                case(
-                    (Shipment.status == 'delivered', 1),
-                    else_=0
-                )
-            ).label('delivered_shipments')
-        ).filter(Shipment.created_by == current_user.id)
-        
-        # Log the generated SQL
-        logger.debug(f"Stats Query SQL: {stats_query.statement.compile(compile_kwargs={'literal_binds': True})}")
-        
-        stats = stats_query.first()
-        logger.debug(f"Stats Query Result: {stats}")
-        
-        # Get status distribution with debug logging
-        logger.debug("Querying status distribution")
-        status_counts = db.session.query(
-            Shipment.status,
-            db.func.count(Shipment.id).label('count')
-        ).filter(
-            Shipment.created_by == current_user.id
-        ).group_by(Shipment.status).all()
-        
-        logger.debug(f"Raw status counts: {status_counts}")
-
-        # Format status counts with defaults
-        status_distribution = {
-            'pending': 0,
-            'processing': 0,
-            'in_transit': 0,
-            'delivered': 0,
-            'cancelled': 0
-        }
-        status_distribution.update({status: count for status, count in status_counts})
-        
-        logger.debug(f"Formatted status distribution: {status_distribution}")
-        
-        # Verify total counts match
-        total_by_status = sum(status_distribution.values())
-        logger.debug(f"Total by status distribution: {total_by_status}")
-        logger.debug(f"Total by direct count: {shipment_count}")
-        if total_by_status != shipment_count:
-            logger.warning(f"Count mismatch: status distribution total ({total_by_status}) != direct count ({shipment_count})")
+        # Counters are maintained incrementally, so this is a primary-key lookup
+        stats = user_stats(current_user.id)
+        status_distribution = stats.status_distribution()
+        logger.debug("User stats: total=%s, distribution=%s", stats.total_shipments, status_distribution)
         
         # Get recent shipments with debug logging
         logger.debug("Querying recent shipments")
-        recent_shipments = Shipment.query.filter(
+        recent_shipments = Shipment.query.options(*loader_options('list')).filter(
             Shipment.created_by == current_user.id
         ).order_by(db.desc(Shipment.created_at)).limit(5).all()
         
-        logger.debug(f"Retrieved {len(recent_shipments)} recent shipments")
+        logger.debug("Retrieved %s recent shipments", len(recent_shipments))
         for shipment in recent_shipments:
-            logger.debug(f"Shipment {shipment.waybill_number}: Status={shipment.status}, Created by={shipment.created_by}")
+            logger.debug("Shipment %s: Status=%s, Created by=%s", shipment.waybill_number, shipment.status, shipment.created_by)
 
         return render_template('profile/index.html',
                              user=current_user,
@@ -130,6 +47,7 @@ def index():
 
 @bp.route('/shipments')
 @login_required
+@query_budget(6)
 def shipments():
     """Display user's shipments with filtering and pagination."""
     try:
@@ -139,7 +57,7 @@ def shipments():
         search = request.args.get('search')
 
         # Base query
-        query = Shipment.query.filter_by(created_by=current_user.id)
+        query = Shipment.query.options(*loader_options('list')).filter_by(created_by=current_user.id)
 
         # Apply filters
         if status:
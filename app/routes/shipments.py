@@ -1,13 +1,17 @@
 from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify, current_app
 from flask_login import login_required, current_user
-from ..models.shipment import Shipment, ShipmentItem, ShipmentStatusHistory
-from ..utils.file_storage import upload_file, delete_file
+from ..models.shipment import Shipment
+from ..utils.file_storage import delete_file
 from ..utils.helpers import calculate_subtotal, calculate_vat, generate_qr_code
+from ..utils.archive import get_shipment_or_404
+from ..utils.shipment_forms import shipment_from_form, add_items_from_form
+from ..utils.idempotency import idempotent
+from ..utils.query_inspector import query_budget
+from ..utils.loader_profiles import loader_options, load_status_history
+from ..utils.logging_config import lazy
 from ..extensions import db, csrf
 import logging
 from datetime import datetime
-from werkzeug.utils import secure_filename
-import os
 import time
 import uuid
 
@@ -17,16 +21,14 @@ bp = Blueprint('shipments', __name__, url_prefix='/shipments')
 
 @bp.route('/list')
 @login_required
+@query_budget(4)
 def list_shipments():
     """List all shipments"""
     try:
         logger.debug("Accessing shipments list")
-        logger.debug("Checking registered endpoints")
-        logger.debug(f"Available URL endpoints: {[rule.endpoint for rule in current_app.url_map.iter_rules()]}")
-        logger.debug(f"Current blueprint routes: {[f'{bp.name}.{route}' for route in bp.deferred_functions]}")
         
-        shipments = Shipment.query.order_by(Shipment.created_at.desc()).all()
-        logger.debug(f"Found {len(shipments)} shipments")
+        shipments = Shipment.query.options(*loader_options('list')).order_by(Shipment.created_at.desc()).all()
+        logger.debug("Found %s shipments", len(shipments))
         logger.debug("Attempting to render template: shipments/list.html")
         return render_template('shipments/list.html', shipments=shipments)
     except Exception as e:
@@ -40,11 +42,12 @@ def new_shipment():
     """Render new shipment form"""
     try:
         logger.debug("Attempting to render new shipment template")
-        logger.debug(f"Template search paths: {current_app.jinja_loader.searchpath}")
-        logger.debug(f"Available templates: {os.listdir(current_app.template_folder)}")
+        logger.debug("Template search paths: %s", current_app.jinja_loader.searchpath)
         
         contact_data = {}
-        return render_template('shipments/form.html', contact_data=contact_data)
+        # A fresh key per rendered form makes double submits replay the first
+        return render_template('shipments/form.html', contact_data=contact_data,
+                               idempotency_key=str(uuid.uuid4()))
     except Exception as e:
         logger.error(f"Error in new_shipment: {str(e)}", exc_info=True)
         flash('An error occurred while loading the new shipment form.', 'error')
@@ -52,69 +55,40 @@ def new_shipment():
 
 @bp.route('/submit', methods=['POST'])
 @login_required
+@idempotent
 def submit_shipment():
     try:
         logger.debug("\n=== SHIPMENT SUBMISSION START ===")
         logger.debug("=== USER INFORMATION ===")
-        logger.debug(f"Current User ID: {current_user.id}")
-        logger.debug(f"User ID Type: {type(current_user.id)}")
-        logger.debug(f"User Object: {current_user.__dict__}")
+        logger.debug("Current User ID: %s", current_user.id)
+        logger.debug("User ID Type: %s", type(current_user.id))
         
         form_data = request.form.to_dict()
         logger.debug("\n=== FORM DATA ===")
-        logger.debug(f"Received form data: {form_data}")
-        logger.debug(f"Files in request: {list(request.files.keys())}")
+        logger.debug("Received form data: %s", form_data)
+        logger.debug("Files in request: %s", list(request.files.keys()))
         
         # Create shipment object with enhanced debug logging
         logger.debug("\n=== SHIPMENT CREATION ===")
         created_by_value = current_user.id  # Remove string conversion
-        logger.debug(f"Created By - Value: {created_by_value}")
-        logger.debug(f"Created By - Type: {type(created_by_value)}")
+        logger.debug("Created By - Value: %s", created_by_value)
+        logger.debug("Created By - Type: %s", type(created_by_value))
         
         # Verify user exists in database
         logger.debug("\n=== USER VERIFICATION ===")
         from ..models.user import User
         user = User.query.get(current_user.id)
         if user:
-            logger.debug(f"Found user in database - ID: {user.id}")
-            logger.debug(f"User database ID type: {type(user.id)}")
+            logger.debug("Found user in database - ID: %s", user.id)
+            logger.debug("User database ID type: %s", type(user.id))
         else:
             logger.error(f"User not found in database: {current_user.id}")
             raise ValueError("Invalid user ID")
         
-        shipment = Shipment(
-            waybill_number=Shipment.generate_waybill_number(),
-            sender_name=form_data.get('sender_name'),
-            sender_email=form_data.get('sender_email'),
-            sender_address=form_data.get('sender_address'),
-            sender_business=form_data.get('sender_business'),
-            sender_mobile=form_data.get('sender_mobile'),
-            receiver_name=form_data.get('receiver_name'),
-            receiver_email=form_data.get('receiver_email'),
-            receiver_address=form_data.get('receiver_address'),
-            receiver_business=form_data.get('receiver_business'),
-            receiver_mobile=form_data.get('receiver_mobile'),
-            destination_address=form_data.get('destination_address'),
-            destination_country=form_data.get('destination_country'),
-            destination_postcode=form_data.get('destination_postcode'),
-            freight_pricing=float(form_data.get('freight', 0)),
-            additional_charges=float(form_data.get('additional', 0)),
-            pickup_charge=float(form_data.get('pickup', 0)),
-            handling_fees=float(form_data.get('handling', 0)),
-            crating=float(form_data.get('crating', 0)),
-            insurance_charge=float(form_data.get('insurance', 0)),
-            is_collection=bool(form_data.get('is_collection')),
-            customer_group=form_data.get('customer_group'),
-            order_booked_by=form_data.get('order_booked_by'),
-            sender_signature=form_data.get('sender_signature'),
-            status='pending',
-            created_by=created_by_value
-        )
+        shipment = shipment_from_form(form_data, created_by_value)
         
         logger.debug("\n=== SHIPMENT OBJECT CREATED ===")
-        logger.debug(f"Waybill Number: {shipment.waybill_number}")
-        logger.debug(f"Created By (before save): {shipment.created_by}")
-        logger.debug(f"Created By Type (before save): {type(shipment.created_by)}")
+        logger.debug("Waybill Number: %s", shipment.waybill_number)
         
         # Before database operations
         logger.debug("\n=== PRE-DATABASE OPERATIONS ===")
@@ -126,9 +100,9 @@ def submit_shipment():
             logger.debug("Attempting to flush session")
             db.session.flush()
             logger.debug("Session flush successful")
-            logger.debug(f"Shipment ID after flush: {shipment.id}")
-            logger.debug(f"Created By after flush: {shipment.created_by}")
-            logger.debug(f"Created By Type after flush: {type(shipment.created_by)}")
+            logger.debug("Shipment ID after flush: %s", shipment.id)
+            logger.debug("Created By after flush: %s", shipment.created_by)
+            logger.debug("Created By Type after flush: %s", type(shipment.created_by))
         except Exception as e:
             logger.error(f"Session flush error: {str(e)}")
             db.session.rollback()
@@ -137,56 +111,19 @@ def submit_shipment():
         # Process items with enhanced logging
         logger.debug("\n=== PROCESSING ITEMS ===")
         descriptions = request.form.getlist('description[]')
-        values = request.form.getlist('value[]')
-        quantities = request.form.getlist('quantity[]')
-        weights = request.form.getlist('weight[]')
         images = request.files.getlist('item_image[]')
+        logger.debug("Number of items to process: %s", len(descriptions))
+        logger.debug("Number of images received: %s", len(images))
         
-        logger.debug(f"Number of items to process: {len(descriptions)}")
-        logger.debug(f"Number of images received: {len(images)}")
-        
-        for i in range(len(descriptions)):
-            if descriptions[i]:  # Only create item if description exists
-                try:
-                    logger.debug(f"Processing item {i+1}: {descriptions[i]}")
-                    item = ShipmentItem(
-                        description=descriptions[i],
-                        value=float(values[i]) if values[i] else 0,
-                        quantity=int(quantities[i]) if quantities[i] else 0,
-                        weight=float(weights[i]) if weights[i] else 0
-                    )
-                    
-                    # Handle image upload
-                    if i < len(images) and images[i].filename:
-                        try:
-                            logger.debug(f"Processing image for item {i+1}: {images[i].filename}")
-                            logger.debug(f"File object type: {type(images[i])}")
-                            logger.debug(f"File content type: {images[i].content_type}")
-                            
-                            filename = secure_filename(images[i].filename)
-                            file_data = images[i].read()
-                            logger.debug(f"Read file data of size: {len(file_data)} bytes")
-                            
-                            file_id = upload_file(file_data, filename)
-                            if file_id:
-                                logger.debug(f"Image uploaded successfully with file_id: {file_id}")
-                                item.image_filename = filename
-                                item.image_file_id = file_id
-                                logger.debug(f"Updated item with image details - filename: {item.image_filename}, file_id: {item.image_file_id}")
-                            else:
-                                logger.error(f"Failed to upload image for item {i+1}")
-                        except Exception as img_error:
-                            logger.error(f"Error uploading image for item {i+1}: {str(img_error)}", exc_info=True)
-                    
-                    shipment.items.append(item)
-                    logger.debug(f"Added item: {item.description} with value: {item.value}, quantity: {item.quantity}, weight: {item.weight}, image_file_id: {item.image_file_id if hasattr(item, 'image_file_id') else None}")
-                except Exception as item_error:
-                    logger.error(f"Error processing item {i+1}: {str(item_error)}")
-                    raise
-        
-        # Calculate total
-        shipment.total = shipment.calculated_total
-        logger.debug(f"Calculated total: {shipment.total}")
+        add_items_from_form(
+            shipment,
+            descriptions,
+            request.form.getlist('value[]'),
+            request.form.getlist('quantity[]'),
+            request.form.getlist('weight[]'),
+            images
+        )
+        logger.debug("Calculated total: %s", shipment.total)
         
         # Final commit with verification
         logger.debug("\n=== FINAL COMMIT ===")
@@ -194,14 +131,15 @@ def submit_shipment():
             db.session.commit()
             logger.debug("Database commit successful")
             
-            # Verify shipment was saved correctly
-            saved_shipment = Shipment.query.get(shipment.id)
-            if saved_shipment:
-                logger.debug(f"Verification - Found saved shipment")
-                logger.debug(f"Saved shipment created_by: {saved_shipment.created_by}")
-                logger.debug(f"Saved shipment created_by type: {type(saved_shipment.created_by)}")
-            else:
-                logger.error("Verification failed - Could not find saved shipment")
+            # Verify shipment was saved correctly (costs a query, so debug only)
+            if logger.isEnabledFor(logging.DEBUG):
+                saved_shipment = Shipment.query.get(shipment.id)
+                if saved_shipment:
+                    logger.debug("Verification - Found saved shipment")
+                    logger.debug("Saved shipment created_by: %s", saved_shipment.created_by)
+                    logger.debug("Saved shipment created_by type: %s", type(saved_shipment.created_by))
+                else:
+                    logger.error("Verification failed - Could not find saved shipment")
                 
         except Exception as e:
             logger.error(f"Commit error: {str(e)}")
@@ -219,29 +157,31 @@ def submit_shipment():
         return render_template('error.html', error=str(e)), 500
 
 @bp.route('/view/<uuid:shipment_id>')
+@query_budget(8)
 def view_shipment(shipment_id):
     """View a specific shipment"""
-    logger.debug(f'Accessing shipment details for ID: {shipment_id}')
+    logger.debug('Accessing shipment details for ID: %s', shipment_id)
     try:
-        # Query shipment directly with UUID
-        shipment = Shipment.query.get_or_404(shipment_id)
-        logger.debug(f'Found shipment with waybill: {shipment.waybill_number}')
+        # Hot table first, then the archive for old delivered/cancelled shipments
+        shipment = get_shipment_or_404(shipment_id, profile='preview')
+        logger.debug('Found shipment with waybill: %s', shipment.waybill_number)
         
         # Debug items relationship
         items = shipment.items
-        logger.debug(f'Found {len(items)} items for shipment')
-        logger.debug(f'Items relationship type: {type(items)}')
-        logger.debug(f'Items data: {[{"id": item.id, "description": item.description} for item in items]}')
+        logger.debug('Found %s items for shipment', len(items))
+        logger.debug('Items relationship type: %s', type(items))
+        logger.debug('Items data: %s', lazy(lambda: [{"id": item.id, "description": item.description} for item in items]))
         
         # Get ordered status history
-        status_history = shipment.status_history.order_by(ShipmentStatusHistory.changed_at.asc()).all()
+        # Both history relationships are ordered by changed_at
+        status_history = load_status_history(shipment)
         
         # Calculate financial values
         logger.debug('Calculating financial values')
         subtotal = calculate_subtotal(shipment)
         vat = calculate_vat(subtotal)
         total = subtotal + vat
-        logger.debug(f'Financial calculations - Subtotal: {subtotal}, VAT: {vat}, Total: {total}')
+        logger.debug('Financial calculations - Subtotal: %s, VAT: %s, Total: %s', subtotal, vat, total)
         
         # Ensure QR code exists
         if not shipment.qr_code:
@@ -256,7 +196,7 @@ def view_shipment(shipment_id):
                 'total': str(total),
                 'order_booked_by': shipment.order_booked_by
             }
-            logger.debug(f'QR code data prepared: {qr_data}')
+            logger.debug('QR code data prepared: %s', qr_data)
             shipment.qr_code = generate_qr_code(qr_data, shipment.sender_mobile, shipment.receiver_mobile, shipment.order_booked_by)
             logger.debug('QR code generated and assigned to shipment')
             db.session.commit()
@@ -277,24 +217,24 @@ def view_shipment(shipment_id):
 @bp.route('/<uuid:shipment_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_shipment(shipment_id):
-    logger.debug(f'Accessing edit form for shipment {shipment_id}')
+    logger.debug('Accessing edit form for shipment %s', shipment_id)
     
     # Check if user is a super user
     if not current_user.is_superuser:
-        logger.warning(f'Unauthorized edit attempt by user {current_user.id}')
+        logger.warning('Unauthorized edit attempt by user %s', current_user.id)
         flash('Access denied. Only super users can edit shipments.', 'error')
         return redirect(url_for('shipments.list_shipments'))
         
     try:
         # Query shipment directly with UUID
         shipment = Shipment.query.get_or_404(shipment_id)
-        logger.debug(f'Found shipment with waybill: {shipment.waybill_number}')
+        logger.debug('Found shipment with waybill: %s', shipment.waybill_number)
         
         if request.method == 'POST':
-            logger.debug(f'Processing edit submission for shipment {shipment_id}')
+            logger.debug('Processing edit submission for shipment %s', shipment_id)
             try:
                 data = request.form.to_dict()
-                logger.debug(f'Received form data: {data}')
+                logger.debug('Received form data: %s', data)
                 
                 # Update shipment details
                 shipment.sender_name = data['sender_name']
@@ -331,24 +271,24 @@ def delete_shipment(shipment_id):
     
     # Check if user is a super user
     if not current_user.is_superuser:
-        logger.warning(f'Unauthorized delete attempt by user {current_user.id}')
+        logger.warning('Unauthorized delete attempt by user %s', current_user.id)
         flash('Access denied. Only super users can delete shipments.', 'error')
         return redirect(url_for('shipments.list_shipments'))
         
     try:
-        logger.debug(f'=== Starting Shipment Deletion Process ===')
-        logger.debug(f'Shipment ID: {shipment_id}, Type: {type(shipment_id)}')
+        logger.debug('=== Starting Shipment Deletion Process ===')
+        logger.debug('Shipment ID: %s, Type: %s', shipment_id, type(shipment_id))
         
         # Convert shipment_id to UUID if needed
         if not isinstance(shipment_id, uuid.UUID):
             shipment_id = uuid.UUID(str(shipment_id))
-            logger.debug(f'Converted shipment_id to UUID: {shipment_id}')
+            logger.debug('Converted shipment_id to UUID: %s', shipment_id)
         
         # Get shipment with items
         shipment = Shipment.query.options(
             db.joinedload(Shipment.items)
         ).get_or_404(shipment_id)
-        logger.debug(f'Found shipment with {len(shipment.items)} items')
+        logger.debug('Found shipment with %s items', len(shipment.items))
         
         try:
             # Start a nested transaction
@@ -356,37 +296,37 @@ def delete_shipment(shipment_id):
                 # First delete all associated items
                 logger.debug('=== Deleting Associated Items ===')
                 for item in shipment.items:
-                    logger.debug(f'Processing item {item.id} (Type: {type(item.id)})')
+                    logger.debug('Processing item %s (Type: %s)', item.id, type(item.id))
                     
                     # Delete associated files if they exist
                     if item.image_file_id:
                         try:
                             delete_file(item.image_file_id)
-                            logger.debug(f'Deleted file {item.image_file_id}')
+                            logger.debug('Deleted file %s', item.image_file_id)
                         except Exception as e:
                             logger.error(f'Error deleting file: {str(e)}')
                             # Continue with item deletion even if file deletion fails
                     
                     # Log item details before deletion
-                    logger.debug(f'Item details before deletion:')
-                    logger.debug(f'- ID: {item.id} (Type: {type(item.id)})')
-                    logger.debug(f'- Export Request ID: {item.export_request_id} (Type: {type(item.export_request_id)})')
+                    logger.debug('Item details before deletion:')
+                    logger.debug('- ID: %s (Type: %s)', item.id, type(item.id))
+                    logger.debug('- Export Request ID: %s (Type: %s)', item.export_request_id, type(item.export_request_id))
                     
                     # Delete the item
                     db.session.delete(item)
-                    logger.debug(f'Deleted item {item.id}')
+                    logger.debug('Deleted item %s', item.id)
                 
                 logger.debug('All items deleted successfully')
                 
                 # Log shipment details before deletion
-                logger.debug(f'Shipment details before deletion:')
-                logger.debug(f'- ID: {shipment.id} (Type: {type(shipment.id)})')
-                logger.debug(f'- Created By: {shipment.created_by} (Type: {type(shipment.created_by)})')
+                logger.debug('Shipment details before deletion:')
+                logger.debug('- ID: %s (Type: %s)', shipment.id, type(shipment.id))
+                logger.debug('- Created By: %s (Type: %s)', shipment.created_by, type(shipment.created_by))
                 
                 # Then delete the shipment
                 logger.debug('=== Deleting Shipment ===')
                 db.session.delete(shipment)
-                logger.debug(f'Deleted shipment {shipment.id}')
+                logger.debug('Deleted shipment %s', shipment.id)
             
             # Commit the transaction
             db.session.commit()
@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, jsonify, request
-from ..models.shipment import Shipment
-from ..extensions import db
+from ..utils.tracking_index import find_tracking
+from ..utils.query_inspector import query_budget
+from ..utils.rate_limit import rate_limited
 import logging
 
 logger = logging.getLogger(__name__)
@@ -13,40 +14,26 @@ def tracking_page():
     return render_template('tracking/search.html')
 
 @bp.route('/<waybill>', methods=['GET'])
+@rate_limited('tracking', html=True)
+@query_budget(4)
 def track_shipment(waybill):
     """Display tracking information for a shipment."""
-    logger.debug(f'Tracking shipment with waybill: {waybill}')
+    logger.debug('Tracking shipment with waybill: %s', waybill)
     try:
-        shipment = Shipment.query.filter_by(waybill_number=waybill).first_or_404()
+        payload = find_tracking(waybill)
+        if payload is None:
+            return render_template('tracking/error.html', waybill=waybill)
         
         # Get limited shipment details for public viewing
-        tracking_info = {
-            'waybill_number': shipment.waybill_number,
-            'status': shipment.status,
-            'created_at': shipment.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-            'destination': shipment.destination,
-            'sender': {
-                'name': shipment.sender_name,
-                'business': shipment.sender_business
-            },
-            'receiver': {
-                'name': shipment.receiver_name,
-                'business': shipment.receiver_business
-            },
-            'items': [{
-                'description': item.description,
-                'quantity': item.quantity
-            } for item in shipment.items]
-        }
+        tracking_info = dict(payload, created_at=payload['created_at'].strftime('%Y-%m-%d %H:%M:%S'))
         
-        return render_template('tracking/details.html', 
-                             tracking_info=tracking_info,
-                             shipment=shipment)
+        return render_template('tracking/details.html', tracking_info=tracking_info)
     except Exception as e:
         logger.error(f'Error tracking shipment {waybill}: {str(e)}')
         return render_template('tracking/error.html', waybill=waybill)
 
 @bp.route('/api/search', methods=['POST'])
+@rate_limited('tracking')
 def search_shipment():
     """API endpoint for tracking search."""
     logger.debug('Processing tracking search request')
@@ -56,9 +43,8 @@ def search_shipment():
             return jsonify({'error': 'Waybill number not provided'}), 400
             
         waybill = data['waybill']
-        shipment = Shipment.query.filter_by(waybill_number=waybill).first()
-        
-        if not shipment:
+        # Also caches the answer for the tracking page the client opens next
+        if find_tracking(waybill) is None:
             return jsonify({
                 'found': False,
                 'message': 'Shipment not found'
@@ -73,33 +59,17 @@ def search_shipment():
         return jsonify({'error': 'Internal server error'}), 500
 
 @bp.route('/api/<waybill>', methods=['GET'])
+@rate_limited('tracking')
+@query_budget(4)
 def get_tracking_info(waybill):
     """API endpoint for tracking information."""
-    logger.debug(f'API: Tracking shipment with waybill: {waybill}')
+    logger.debug('API: Tracking shipment with waybill: %s', waybill)
     try:
-        shipment = Shipment.query.filter_by(waybill_number=waybill).first_or_404()
-        
-        tracking_info = {
-            'waybill_number': shipment.waybill_number,
-            'status': shipment.status,
-            'created_at': shipment.created_at.isoformat(),
-            'destination': shipment.destination,
-            'sender': {
-                'name': shipment.sender_name,
-                'business': shipment.sender_business
-            },
-            'receiver': {
-                'name': shipment.receiver_name,
-                'business': shipment.receiver_business
-            },
-            'items': [{
-                'description': item.description,
-                'quantity': item.quantity
-            } for item in shipment.items],
-            'qr_code': shipment.qr_code if shipment.qr_code else None
-        }
+        payload = find_tracking(waybill)
+        if payload is None:
+            return jsonify({'error': 'Shipment not found'}), 404
         
-        return jsonify(tracking_info)
+        return jsonify(dict(payload, created_at=payload['created_at'].isoformat()))
     except Exception as e:
         logger.error(f'API Error in tracking info {waybill}: {str(e)}')
         return jsonify({'error': 'Internal server error'}), 500 
\ No newline at end of file
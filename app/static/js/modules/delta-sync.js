@@ -0,0 +1,236 @@
+// Delta Sync Module - Keeps a local copy of shipments up to date from /api/shipments/changes
+import { OfflineManager, isOffline } from './offline.js';
+
+const CHANGES_URL = '/api/shipments/changes';
+
+// Feed section -> IndexedDB object store
+const SECTION_STORES = {
+    shipments: 'shipments',
+    items: 'items',
+    status_history: 'statusHistory'
+};
+
+// Tombstone type -> IndexedDB object store
+const TOMBSTONE_STORES = {
+    shipment: 'shipments',
+    item: 'items',
+    status_history: 'statusHistory'
+};
+
+export class DeltaSyncManager {
+    constructor() {
+        this.dbName = 'sgkSyncDB';
+        this.dbVersion = 1;
+        this.metaStore = 'meta';
+        this.db = null;
+        this.initialized = false;
+        this.syncing = null;
+    }
+
+    /**
+     * Open the local database
+     * @returns {Promise<IDBDatabase>}
+     */
+    async init() {
+        if (this.initialized) return this.db;
+
+        return new Promise((resolve, reject) => {
+            const request = indexedDB.open(this.dbName, this.dbVersion);
+
+            request.onerror = (event) => {
+                console.error('DeltaSyncManager: IndexedDB error:', event.target.error);
+                reject(event.target.error);
+            };
+
+            request.onsuccess = (event) => {
+                this.db = event.target.result;
+                this.initialized = true;
+
+                OfflineManager.onOnline(() => this.sync());
+                resolve(this.db);
+            };
+
+            request.onupgradeneeded = (event) => {
+                const db = event.target.result;
+
+                if (!db.objectStoreNames.contains('shipments')) {
+                    const store = db.createObjectStore('shipments', { keyPath: 'id' });
+                    store.createIndex('created_at', 'created_at', { unique: false });
+                }
+                if (!db.objectStoreNames.contains('items')) {
+                    const store = db.createObjectStore('items', { keyPath: 'id' });
+                    store.createIndex('shipment_id', 'export_request_id', { unique: false });
+                }
+                if (!db.objectStoreNames.contains('statusHistory')) {
+                    const store = db.createObjectStore('statusHistory', { keyPath: 'id' });
+                    store.createIndex('shipment_id', 'shipment_id', { unique: false });
+                }
+                if (!db.objectStoreNames.contains(this.metaStore)) {
+                    db.createObjectStore(this.metaStore, { keyPath: 'key' });
+                }
+            };
+        });
+    }
+
+    /**
+     * Read the stored sync cursor
+     * @returns {Promise<string|null>}
+     */
+    async getCursor() {
+        await this.init();
+        return new Promise((resolve, reject) => {
+            const request = this.db.transaction(this.metaStore, 'readonly')
+                .objectStore(this.metaStore)
+                .get('cursor');
+            request.onsuccess = () => resolve(request.result ? request.result.value : null);
+            request.onerror = () => reject(request.error);
+        });
+    }
+
+    /**
+     * Pull every page of changes since the stored cursor.
+     * Concurrent calls share the same run.
+     * @returns {Promise<number>} - Number of rows applied
+     */
+    sync() {
+        if (this.syncing) return this.syncing;
+        if (isOffline()) return Promise.resolve(0);
+
+        this.syncing = this._pullChanges()
+            .catch(error => {
+                console.error('DeltaSyncManager: sync failed:', error);
+                return 0;
+            })
+            .finally(() => {
+                this.syncing = null;
+            });
+        return this.syncing;
+    }
+
+    async _pullChanges() {
+        await this.init();
+        let cursor = await this.getCursor();
+        let applied = 0;
+        let hasMore = true;
+
+        while (hasMore) {
+            const url = cursor ? `${CHANGES_URL}?since=${encodeURIComponent(cursor)}` : CHANGES_URL;
+            const response = await fetch(url, {
+                credentials: 'same-origin',
+                headers: { 'Accept': 'application/json' }
+            });
+
+            // Logged out: the login redirect is HTML, nothing to sync
+            const contentType = response.headers.get('Content-Type') || '';
+            if (!response.ok || !contentType.includes('application/json')) {
+                if (response.status === 400) {
+                    // The server no longer understands our cursor: start over
+                    await this._applyPage({ reset: true, cursor: null });
+                }
+                break;
+            }
+
+            const page = await response.json();
+            applied += await this._applyPage(page);
+            cursor = page.cursor;
+            hasMore = page.has_more;
+        }
+
+        if (applied) {
+            console.log(`DeltaSyncManager: applied ${applied} changes`);
+            window.dispatchEvent(new CustomEvent('sgk:data-synced', { detail: { applied } }));
+        }
+        return applied;
+    }
+
+    /**
+     * Apply one page of the feed and advance the cursor in the same transaction
+     * @param {Object} page - Response of the changes endpoint
+     * @returns {Promise<number>}
+     */
+    _applyPage(page) {
+        const storeNames = [...Object.values(SECTION_STORES), this.metaStore];
+
+        return new Promise((resolve, reject) => {
+            const tx = this.db.transaction(storeNames, 'readwrite');
+            let applied = 0;
+
+            if (page.reset) {
+                Object.values(SECTION_STORES).forEach(name => tx.objectStore(name).clear());
+            }
+
+            Object.entries(SECTION_STORES).forEach(([section, name]) => {
+                const store = tx.objectStore(name);
+                (page[section] || []).forEach(row => {
+                    store.put(row);
+                    applied++;
+                });
+            });
+
+            (page.deleted || []).forEach(tombstone => {
+                const name = TOMBSTONE_STORES[tombstone.type];
+                if (!name) return;
+                tx.objectStore(name).delete(tombstone.id);
+                if (tombstone.type === 'shipment') {
+                    this._deleteChildren(tx, tombstone.id);
+                }
+                applied++;
+            });
+
+            tx.objectStore(this.metaStore).put({ key: 'cursor', value: page.cursor });
+
+            tx.oncomplete = () => resolve(applied);
+            tx.onerror = () => reject(tx.error);
+        });
+    }
+
+    /**
+     * Remove the items and history of a deleted or archived shipment
+     */
+    _deleteChildren(tx, shipmentId) {
+        ['items', 'statusHistory'].forEach(name => {
+            const request = tx.objectStore(name).index('shipment_id').openKeyCursor(IDBKeyRange.only(shipmentId));
+            request.onsuccess = () => {
+                const cursor = request.result;
+                if (cursor) {
+                    tx.objectStore(name).delete(cursor.primaryKey);
+                    cursor.continue();
+                }
+            };
+        });
+    }
+
+    /**
+     * Read all locally synced shipments, newest first
+     * @returns {Promise<Array>}
+     */
+    async getShipments() {
+        await this.init();
+        return new Promise((resolve, reject) => {
+            const request = this.db.transaction('shipments', 'readonly').objectStore('shipments').getAll();
+            request.onsuccess = () => resolve(
+                request.result.sort((a, b) => (b.created_at || '').localeCompare(a.created_at || ''))
+            );
+            request.onerror = () => reject(request.error);
+        });
+    }
+}
+
+// Create singleton instance
+const deltaSyncManager = new DeltaSyncManager();
+
+// Sync once the page is ready, and whenever the service worker asks for it
+document.addEventListener('DOMContentLoaded', () => {
+    if (!('indexedDB' in window)) return;
+    deltaSyncManager.sync();
+});
+
+if ('serviceWorker' in navigator) {
+    navigator.serviceWorker.addEventListener('message', event => {
+        if (event.data && event.data.type === 'SYNC_CHANGES') {
+            deltaSyncManager.sync();
+        }
+    });
+}
+
+export default deltaSyncManager;
@@ -1,6 +1,22 @@
 // Offline Form Module - Handles storing and submitting forms when offline
 import { OfflineManager, isOffline } from './offline.js';
 
+const BATCH_SYNC_URL = '/api/sync/batch';
+
+// Requests sent per batch call; the server commits them in smaller chunks
+const BATCH_SIZE = 50;
+
+/**
+ * Generate a client-side idempotency key for a queued request
+ * @returns {string}
+ */
+export function generateIdempotencyKey() {
+    if (window.crypto && typeof window.crypto.randomUUID === 'function') {
+        return window.crypto.randomUUID();
+    }
+    return `${Date.now().toString(36)}-${Math.random().toString(36).substr(2, 12)}-${Math.random().toString(36).substr(2, 12)}`;
+}
+
 // IndexedDB setup for offline form storage
 export class OfflineFormManager {
     constructor() {
@@ -74,6 +90,9 @@ export class OfflineFormManager {
                     method,
                     data,
                     formId,
+                    // Reuse the key rendered into the form so a submit that
+                    // already reached the server is replayed, not repeated
+                    idempotencyKey: (data && data.idempotency_key) || generateIdempotencyKey(),
                     timestamp: new Date().getTime(),
                     synced: false,
                     attempts: 0
@@ -234,7 +253,72 @@ export class OfflineFormManager {
     }
 
     /**
-     * Sync all pending requests
+     * Give requests queued before idempotency keys existed a key of their own
+     * @param {Array} requests - Pending requests
+     * @returns {Promise<Array>} - The same requests, all with a key
+     */
+    async assignIdempotencyKeys(requests) {
+        const missing = requests.filter(request => !request.idempotencyKey);
+        if (missing.length === 0) return requests;
+
+        await new Promise((resolve, reject) => {
+            const transaction = this.db.transaction([this.storeName], 'readwrite');
+            const store = transaction.objectStore(this.storeName);
+            missing.forEach(request => {
+                request.idempotencyKey = generateIdempotencyKey();
+                store.put(request);
+            });
+            transaction.oncomplete = () => resolve();
+            transaction.onerror = (event) => reject(event.target.error);
+        });
+        return requests;
+    }
+
+    /**
+     * Send one request on its own, for endpoints the batch endpoint cannot replay
+     * @param {Object} request - Pending request
+     * @returns {Promise<Response>}
+     */
+    async sendSingleRequest(request) {
+        const csrfToken = document.querySelector('meta[name="csrf-token"]')?.content;
+
+        return fetch(request.url, {
+            method: request.method,
+            headers: {
+                'Content-Type': 'application/json',
+                'X-Was-Offline': 'true',
+                'X-CSRF-TOKEN': csrfToken,
+                'Idempotency-Key': request.idempotencyKey
+            },
+            body: JSON.stringify(request.data)
+        });
+    }
+
+    /**
+     * Settle a pending request from the status the server returned for it
+     * @param {Object} request - Pending request
+     * @param {number} status - HTTP status of the request's outcome
+     * @param {string} [error] - Error the server gave for it
+     * @returns {Promise<boolean>} - Whether it succeeded
+     */
+    async settleRequest(request, status, error = null) {
+        if (status >= 200 && status < 300) {
+            await this.markRequestSynced(request.id);
+            return true;
+        }
+
+        console.error(`OfflineFormManager: Failed to sync request ${request.id}: ${status}`, error || '');
+        // Unrecoverable client errors are dropped; 409 means the server is still working on it
+        if (status >= 400 && status < 500 && status !== 409) {
+            await this.markRequestSynced(request.id);
+        }
+        return false;
+    }
+
+    /**
+     * Sync all pending requests through the batch endpoint.
+     * Each request carries its idempotency key, so resending after a
+     * timeout never creates duplicates.
      * @returns {Promise} - Promise that resolves when all requests are synced
      */
     async syncPendingRequests() {
@@ -244,7 +328,7 @@ export class OfflineFormManager {
             this.syncing = true;
             console.log('OfflineFormManager: Starting to sync pending requests');
             
-            const pendingRequests = await this.getPendingRequests();
+            const pendingRequests = await this.assignIdempotencyKeys(await this.getPendingRequests());
             console.log(`OfflineFormManager: Found ${pendingRequests.length} pending requests`);
             
             if (pendingRequests.length === 0) {
@@ -255,39 +339,56 @@ export class OfflineFormManager {
             // Show syncing notification
             this.showSyncingNotification(pendingRequests.length);
             
-            // Process requests in sequence
+            const csrfToken = document.querySelector('meta[name="csrf-token"]')?.content;
             let successCount = 0;
-            for (const request of pendingRequests) {
+            
+            for (let start = 0; start < pendingRequests.length; start += BATCH_SIZE) {
+                const batch = pendingRequests.slice(start, start + BATCH_SIZE);
+                const byKey = new Map(batch.map(request => [request.idempotencyKey, request]));
+                
                 try {
-                    await this.updateRequestAttempt(request.id);
-                    
-                    // Get CSRF token
-                    const csrfToken = document.querySelector('meta[name="csrf-token"]')?.content;
+                    await Promise.all(batch.map(request => this.updateRequestAttempt(request.id)));
                     
-                    const response = await fetch(request.url, {
-                        method: request.method,
+                    const response = await fetch(BATCH_SYNC_URL, {
+                        method: 'POST',
                         headers: {
                             'Content-Type': 'application/json',
                             'X-Was-Offline': 'true',
                             'X-CSRF-TOKEN': csrfToken
                         },
-                        body: JSON.stringify(request.data)
+                        body: JSON.stringify({
+                            requests: batch.map(request => ({
+                                key: request.idempotencyKey,
+                                url: request.url,
+                                method: request.method,
+                                data: request.data
+                            }))
+                        })
                     });
                     
-                    if (response.ok) {
-                        await this.markRequestSynced(request.id);
-                        successCount++;
-                        this.updateSyncingNotification(pendingRequests.length, successCount);
-                    } else {
-                        console.error(`OfflineFormManager: Failed to sync request ${request.id}: ${response.status} ${response.statusText}`);
+                    if (!response.ok) {
+                        console.error(`OfflineFormManager: Batch sync failed: ${response.status} ${response.statusText}`);
+                        continue;
+                    }
+                    
+                    const { results } = await response.json();
+                    for (const result of results) {
+                        const request = byKey.get(result.key);
+                        if (!request) continue;
                         
-                        // If server returns an unrecoverable error, mark as synced to prevent further attempts
-                        if (response.status >= 400 && response.status < 500) {
-                            await this.markRequestSynced(request.id);
+                        let status = result.status;
+                        if (status === 501) {
+                            // Not replayable in a batch: send it the old way
+                            status = (await this.sendSingleRequest(request)).status;
+                        }
+                        
+                        if (await this.settleRequest(request, status, result.body && result.body.error)) {
+                            successCount++;
+                            this.updateSyncingNotification(pendingRequests.length, successCount);
                         }
                     }
                 } catch (error) {
-                    console.error(`OfflineFormManager: Error syncing request ${request.id}:`, error);
+                    console.error('OfflineFormManager: Error syncing batch:', error);
                 }
             }
             
@@ -529,6 +630,12 @@ export function enhanceFormWithOfflineSupport(form, options = {}) {
         // Transform data if needed
         let data = {};
         formData.forEach((value, key) => {
+            if (value instanceof File) {
+                // Files do not survive JSON: keep a marker so the server can refuse the
+                // request instead of dropping the file; empty file inputs are left out
+                if (value.name) data[key] = { filename: value.name, size: value.size };
+                return;
+            }
             data[key] = value;
         });
         
@@ -1,6 +1,6 @@
 // Service Worker for SGK Export Application
 
-const CACHE_NAME = 'sgk-cache-v2';
+const CACHE_NAME = 'sgk-cache-v4';
 const API_CACHE_NAME = 'sgk-api-cache-v1';
 const OFFLINE_FALLBACK_PAGE = '/offline.html';
 
@@ -23,6 +23,7 @@ const APP_SHELL = [
   '/static/js/modules/offline-form.js',
   '/static/js/modules/offline-navigation.js',
   '/static/js/modules/api-service.js',
+  '/static/js/modules/delta-sync.js',
   '/static/manifest.json',
   '/static/images/SGKlogo.png',
   '/static/images/icons/icon-72x72.png',
@@ -276,6 +277,18 @@ self.addEventListener('fetch', event => {
     return;
   }
   
+  // Delta sync feed - never cached, a replayed page would rewind the client's cursor
+  if (url.pathname === '/api/shipments/changes') {
+    event.respondWith(fetch(request).catch(() => new Response(JSON.stringify({
+      error: 'You are currently offline.',
+      offline: true
+    }), {
+      headers: { 'Content-Type': 'application/json', 'X-Is-Offline': 'true' },
+      status: 503
+    })));
+    return;
+  }
+  
   // API requests - special handling with cache fallback and offline JSON response
   if (url.pathname.includes('/api/')) {
     event.respondWith(apiStrategy(request));
@@ -415,4 +428,17 @@ self.addEventListener('sync', event => {
       })
     );
   }
+  
+  // Periodic/background refresh of the local shipment copy
+  if (event.tag === 'delta-sync') {
+    event.waitUntil(
+      clients.matchAll().then(clients => {
+        clients.forEach(client => {
+          client.postMessage({
+            type: 'SYNC_CHANGES'
+          });
+        });
+      })
+    );
+  }
 }); 
\ No newline at end of file
@@ -0,0 +1,136 @@
+import os
+import time
+import uuid
+import hashlib
+import logging
+import tempfile
+import threading
+from types import MappingProxyType
+from collections import OrderedDict
+from datetime import datetime
+import jwt
+from flask import current_app, g, request
+from sqlalchemy import select, delete, or_
+from ..extensions import db
+from ..models.api_token import RevokedToken
+from .change_stamp import ChangeStamp
+
+logger = logging.getLogger(__name__)
+
+ALGORITHMS = ['HS256']
+
+
+def token_digest(token):
+    """SHA-256 hex digest of a token, its cache key and revocation id without a jti"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def token_id(claims, digest):
+    return str(claims.get('jti') or digest)
+
+def token_user_id(claims):
+    """User a token was issued to (``user_id``, or ``sub``), None when missing or malformed"""
+    try:
+        return uuid.UUID(str(claims.get('user_id') or claims.get('sub')))
+    except ValueError:
+        return None
+
+
+class ApiTokens:
+    """Verified bearer tokens and the revocation list of one app, per worker.
+
+    Verified claims are kept in an LRU of ``maxsize`` entries keyed by the
+    token digest, each until the token's ``exp`` (tokens without one are
+    verified every time), so a repeated token costs a hash instead of an
+    HMAC check and a decode. Revoked token ids are held in a set loaded
+    from the revoked_token table and reloaded when ``stamp_path`` changes.
+    """
+
+    def __init__(self, secret_key, maxsize=1024, stamp_path=None):
+        self.secret_key = secret_key
+        self.maxsize = maxsize
+        self.stamp = ChangeStamp(stamp_path or os.path.join(tempfile.gettempdir(), 'sgk_export-revoked-tokens.stamp'))
+        self._verified = OrderedDict()
+        self._revoked = None
+        self._revoked_stamp = None
+        self._lock = threading.Lock()
+
+    def _revoked_ids(self):
+        stamp = self.stamp.read()
+        if self._revoked is None or stamp != self._revoked_stamp:
+            rows = db.session.execute(select(RevokedToken.token_id).where(or_(
+                RevokedToken.expires_at.is_(None), RevokedToken.expires_at > datetime.utcnow())))
+            self._revoked = frozenset(rows.scalars())
+            self._revoked_stamp = stamp
+            logger.debug("Loaded %d revoked API tokens", len(self._revoked))
+        return self._revoked
+
+    def verify(self, token):
+        """Read-only claims of ``token``.
+
+        Raises jwt.ExpiredSignatureError when it expired and
+        jwt.InvalidTokenError when it is malformed, badly signed or revoked.
+        """
+        digest = token_digest(token)
+        now = time.time()
+        with self._lock:
+            entry = self._verified.get(digest)
+            if entry is not None:
+                if entry[1] > now:
+                    self._verified.move_to_end(digest)
+                else:
+                    del self._verified[digest]
+                    entry = None
+
+        if entry is not None:
+            claims = entry[0]
+        else:
+            claims = MappingProxyType(jwt.decode(token, self.secret_key, algorithms=ALGORITHMS))
+            if self.maxsize > 0 and 'exp' in claims:
+                with self._lock:
+                    self._verified[digest] = (claims, float(claims['exp']))
+                    while len(self._verified) > self.maxsize:
+                        self._verified.popitem(last=False)
+
+        if token_id(claims, digest) in self._revoked_ids():
+            raise jwt.InvalidTokenError('Token has been revoked')
+        return claims
+
+    def revoke(self, token):
+        """Stop accepting ``token`` in every worker, even when it is expired or signed with another key"""
+        claims = jwt.decode(token, options={'verify_signature': False})
+        digest = token_digest(token)
+        revoked = db.session.get(RevokedToken, token_id(claims, digest))
+        if revoked is None:
+            revoked = RevokedToken(
+                token_id=token_id(claims, digest), user_id=token_user_id(claims),
+                expires_at=datetime.utcfromtimestamp(claims['exp']) if 'exp' in claims else None)
+            db.session.add(revoked)
+        # Once expired the signature check rejects the token anyway
+        db.session.execute(delete(RevokedToken).where(RevokedToken.expires_at <= datetime.utcnow()))
+        db.session.commit()
+        with self._lock:
+            self._verified.pop(digest, None)
+        self._revoked = None
+        self.stamp.touch()
+        return revoked
+
+
+def init_api_tokens(app):
+    """Keep the token verifier of ``app`` in app.extensions (API_TOKEN_CACHE_SIZE, TOKEN_REVOCATION_STAMP)"""
+    app.extensions['api_tokens'] = ApiTokens(app.config['SECRET_KEY'], app.config.get('API_TOKEN_CACHE_SIZE', 1024),
+                                             app.config.get('TOKEN_REVOCATION_STAMP'))
+
+def request_token_claims():
+    """Claims of the request's bearer token, verified once per request and kept as g.token_payload.
+
+    Returns None without an Authorization header; raises like ApiTokens.verify.
+    """
+    if 'token_payload' in g:
+        return g.token_payload
+    header = request.headers.get('Authorization')
+    if not header:
+        return None
+    if not header.startswith('Bearer '):
+        raise jwt.InvalidTokenError('Invalid token format')
+    g.token_payload = current_app.extensions['api_tokens'].verify(header[len('Bearer '):])
+    return g.token_payload
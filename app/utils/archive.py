@@ -0,0 +1,133 @@
+import logging
+import time
+from datetime import datetime, timedelta
+from flask import abort, current_app
+from sqlalchemy import select, literal
+from ..models.shipment import Shipment, ShipmentItem, ShipmentStatusHistory
+from ..models.archive import ArchivedShipment, ARCHIVE_TABLES
+from ..models.sync import record_tombstones
+from .loader_profiles import loader_options
+from ..extensions import db
+
+logger = logging.getLogger(__name__)
+
+# Shipments in these statuses never transition again and can be archived
+TERMINAL_STATUSES = (Shipment.STATUS_DELIVERED, Shipment.STATUS_CANCELLED)
+
+# Column linking each hot table to its shipment
+_SHIPMENT_KEYS = {
+    Shipment.__table__.name: Shipment.__table__.c.id,
+    ShipmentItem.__table__.name: ShipmentItem.__table__.c.export_request_id,
+    ShipmentStatusHistory.__table__.name: ShipmentStatusHistory.__table__.c.shipment_id
+}
+
+def archive_candidates(cutoff, limit):
+    """Ids of the oldest terminal shipments created before ``cutoff``"""
+    query = select(Shipment.id).where(
+        Shipment.status.in_(TERMINAL_STATUSES),
+        Shipment.created_at < cutoff
+    ).order_by(Shipment.created_at).limit(limit)
+    # Lets two archivers run side by side on PostgreSQL; ignored elsewhere
+    query = query.with_for_update(skip_locked=True)
+    return [row[0] for row in db.session.execute(query)]
+
+def archive_batch(shipment_ids, archived_at=None):
+    """Move shipments, their items and status history into the archive tables.
+
+    Runs as plain INSERT ... SELECT / DELETE statements so the ORM delete
+    events never fire: archived shipments keep counting in the period and
+    per-user statistics, which read both tables.
+    """
+    if not shipment_ids:
+        return 0
+    archived_at = archived_at or datetime.now()
+    connection = db.session.connection()
+
+    for hot, archive in ARCHIVE_TABLES:
+        key = _SHIPMENT_KEYS[hot.name]
+        names = [column.name for column in hot.columns]
+        columns = list(hot.columns)
+        if 'archived_at' in archive.c:
+            names.append('archived_at')
+            columns.append(literal(archived_at, db.DateTime))
+        connection.execute(archive.insert().from_select(
+            names,
+            select(*columns).where(key.in_(shipment_ids))
+        ))
+
+    # Offline clients drop the shipment (and its items and history) from their copy
+    record_tombstones(connection, 'shipment', [(shipment_id, shipment_id) for shipment_id in shipment_ids])
+
+    # Children first, the hot tables keep their foreign keys
+    for hot, archive in reversed(ARCHIVE_TABLES):
+        key = _SHIPMENT_KEYS[hot.name]
+        connection.execute(hot.delete().where(key.in_(shipment_ids)))
+
+    return len(shipment_ids)
+
+def archive_shipments(older_than_days=None, batch_size=None, max_batches=None, pause=0, now=None):
+    """Archive terminal shipments older than ``older_than_days`` in batches.
+
+    Every batch is committed on its own, so a long backlog never holds one
+    big transaction open and an interrupted run simply resumes next time.
+
+    Returns:
+        int: Number of shipments archived.
+    """
+    older_than_days = older_than_days if older_than_days is not None else current_app.config['ARCHIVE_AFTER_DAYS']
+    batch_size = batch_size or current_app.config['ARCHIVE_BATCH_SIZE']
+    now = now or datetime.now()
+    cutoff = now - timedelta(days=older_than_days)
+
+    archived = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        try:
+            shipment_ids = archive_candidates(cutoff, batch_size)
+            if not shipment_ids:
+                db.session.commit()
+                break
+            archived += archive_batch(shipment_ids, now)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error archiving shipments: {str(e)}", exc_info=True)
+            raise
+        batches += 1
+        logger.info("Archived batch %d (%d shipments, %d total)", batches, len(shipment_ids), archived)
+        if len(shipment_ids) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+
+    return archived
+
+def find_shipment(shipment_id, profile=None):
+    """Look a shipment up by id in the hot table, then the archive.
+
+    ``profile`` names the loader profile (see loader_profiles) to load
+    the shipment with.
+    """
+    for model in (Shipment, ArchivedShipment):
+        options = loader_options(profile, model) if profile else None
+        shipment = db.session.get(model, shipment_id, options=options)
+        if shipment is not None:
+            return shipment
+    return None
+
+def find_shipment_by_waybill(waybill, profile=None):
+    """Look a shipment up by waybill number in the hot table, then the archive"""
+    for model in (Shipment, ArchivedShipment):
+        query = model.query.filter_by(waybill_number=waybill)
+        if profile:
+            query = query.options(*loader_options(profile, model))
+        shipment = query.first()
+        if shipment is not None:
+            return shipment
+    return None
+
+def get_shipment_or_404(shipment_id, profile=None):
+    return find_shipment(shipment_id, profile) or abort(404)
+
+def get_shipment_by_waybill_or_404(waybill, profile=None):
+    return find_shipment_by_waybill(waybill, profile) or abort(404)
@@ -0,0 +1,178 @@
+import logging
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+from flask import current_app, url_for
+from sqlalchemy import delete
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.exceptions import HTTPException
+from ..models.idempotency import IdempotencyKey
+from ..extensions import db
+from .idempotency import duplicate_refusal, request_hash
+from .shipment_forms import shipment_from_form, add_items_from_form
+
+logger = logging.getLogger(__name__)
+
+# Endpoint -> handler(data, user_id, **view_args) returning (status_code, body).
+# Handlers only flush; the batch commits once per chunk.
+BATCH_HANDLERS = {}
+
+def batch_handler(endpoint):
+    """Register a function that replays queued requests for ``endpoint``"""
+    def decorator(fn):
+        BATCH_HANDLERS[endpoint] = fn
+        return fn
+    return decorator
+
+# Item image fields of the shipment form; queued JSON holds at most a marker per file
+ITEM_IMAGE_FIELDS = ('item_image[]', 'item_image')
+
+@batch_handler('shipments.submit_shipment')
+def _submit_shipment(data, user_id):
+    for field in ITEM_IMAGE_FIELDS:
+        values = data.get(field)
+        values = values if isinstance(values, list) else [values]
+        if any(value not in (None, '') for value in values):
+            # The file contents were never queued: refuse rather than create the items without them
+            raise ValueError('Item images cannot be replayed from the offline queue; '
+                             'submit this shipment again while online')
+    shipment = shipment_from_form(data, user_id)
+    db.session.add(shipment)
+    db.session.flush()
+    add_items_from_form(
+        shipment,
+        data.get('description[]', data.get('description')),
+        data.get('value[]', data.get('value')),
+        data.get('quantity[]', data.get('quantity')),
+        data.get('weight[]', data.get('weight'))
+    )
+    db.session.flush()
+    return 201, {
+        'id': str(shipment.id),
+        'waybill_number': shipment.waybill_number,
+        'redirect': url_for('shipments.view_shipment', shipment_id=shipment.id)
+    }
+
+def resolve_endpoint(url, method):
+    """Map a queued request URL to ``(endpoint, view_args)``, or (None, {})"""
+    adapter = current_app.url_map.bind('localhost')
+    try:
+        return adapter.match(urlsplit(url).path, method=method.upper())
+    except HTTPException:
+        return None, {}
+
+def _result(entry, status_code, body, replayed=False):
+    return {'key': entry.get('key'), 'status': status_code, 'body': body, 'replayed': replayed}
+
+def _entry_hash(entry):
+    return request_hash(entry.get('method') or 'POST', entry.get('url'), entry.get('data'))
+
+def _run_entry(entry, user_id, expires_at):
+    """Replay one queued request inside the chunk transaction.
+
+    Rejected data, whether by the handler or by the database at flush, is
+    stored as the key's outcome so retries stop; only errors that leave the
+    chunk transaction unusable reach the caller.
+    """
+    method = entry.get('method') or 'POST'
+    endpoint, view_args = resolve_endpoint(entry.get('url') or '', method)
+    handler = BATCH_HANDLERS.get(endpoint)
+    if handler is None:
+        # The client falls back to sending this request on its own
+        return _result(entry, 501, {'error': 'Endpoint not supported in batch', 'endpoint': endpoint})
+
+    key = IdempotencyKey(
+        user_id=user_id,
+        key=entry['key'],
+        endpoint=endpoint,
+        request_hash=_entry_hash(entry),
+        expires_at=expires_at
+    )
+    try:
+        with db.session.begin_nested():
+            status_code, body = handler(entry.get('data') or {}, user_id, **view_args)
+            key.record(status_code, body)
+            db.session.add(key)
+    except (ValueError, TypeError, KeyError) as e:
+        # Bad data will never succeed: remember the rejection so retries stop
+        logger.warning("Rejected queued request %s for %s: %s", entry['key'], endpoint, str(e))
+        key.record(400, {'error': str(e)})
+        with db.session.begin_nested():
+            db.session.add(key)
+    except SQLAlchemyError as e:
+        # A constraint or bad value at flush: only this entry's savepoint is rolled back.
+        # If the transaction is broken, storing the rejection fails and the chunk is retried.
+        logger.warning("Database rejected queued request %s for %s: %s", entry['key'], endpoint, str(e))
+        key.record(422, {'error': 'Request data was rejected'})
+        with db.session.begin_nested():
+            db.session.add(key)
+    except Exception as e:
+        # Unexpected failure: nothing is stored, so a retry runs it again
+        logger.error(f"Error replaying queued request {entry['key']} for {endpoint}: {str(e)}", exc_info=True)
+        return _result(entry, 500, {'error': 'Internal server error'})
+    return _result(entry, key.response_status, key.response_body)
+
+def process_batch(entries, user_id, chunk_size=None):
+    """Replay queued offline requests, deduplicated by idempotency key.
+
+    Keys already seen for this user get their stored outcome back without
+    running anything, unless the entry differs from the stored request
+    (422); expired keys count as new. New entries of a chunk run in
+    savepoints of a single transaction, so one bad entry does not undo the
+    others, and the chunk is committed together with its keys.
+
+    Returns:
+        list: One result per entry, in request order.
+    """
+    chunk_size = chunk_size or current_app.config['SYNC_BATCH_CHUNK_SIZE']
+    now = datetime.utcnow()
+    expires_at = now + timedelta(hours=current_app.config['IDEMPOTENCY_TTL_HOURS'])
+    results = []
+
+    for start in range(0, len(entries), chunk_size):
+        chunk = entries[start:start + chunk_size]
+        keys = [entry.get('key') for entry in chunk if entry.get('key')]
+
+        chunk_results = []
+        seen = set()
+        try:
+            stored = {}
+            if keys:
+                # Expired keys are dropped in the chunk transaction, their entries run again
+                db.session.execute(delete(IdempotencyKey).where(
+                    IdempotencyKey.user_id == user_id,
+                    IdempotencyKey.key.in_(keys),
+                    IdempotencyKey.expires_at <= now
+                ))
+                stored = {
+                    row.key: row
+                    for row in IdempotencyKey.query.filter(
+                        IdempotencyKey.user_id == user_id,
+                        IdempotencyKey.key.in_(keys)
+                    )
+                }
+            for entry in chunk:
+                key = entry.get('key')
+                if not key:
+                    chunk_results.append(_result(entry, 400, {'error': 'Missing idempotency key'}))
+                elif key in stored:
+                    row = stored[key]
+                    refusal = duplicate_refusal(row, _entry_hash(entry))
+                    if refusal is not None:
+                        chunk_results.append(_result(entry, refusal[0], {'error': refusal[1]}))
+                    else:
+                        chunk_results.append(_result(entry, row.response_status, row.response_body, replayed=True))
+                elif key in seen:
+                    chunk_results.append(_result(entry, 409, {'error': 'Request with this key is in progress'}))
+                else:
+                    seen.add(key)
+                    chunk_results.append(_run_entry(entry, user_id, expires_at))
+            db.session.commit()
+        except SQLAlchemyError as e:
+            # Typically a concurrent upload of the same keys; the retry will replay them
+            db.session.rollback()
+            logger.error(f"Error committing sync batch chunk: {str(e)}", exc_info=True)
+            chunk_results = [_result(entry, 503, {'error': 'Batch chunk failed, retry later'}) for entry in chunk]
+        results.extend(chunk_results)
+
+    logger.info("Processed sync batch of %d requests for user %s", len(entries), user_id)
+    return results
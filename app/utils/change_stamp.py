@@ -0,0 +1,30 @@
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeStamp:
+    """A file the workers watch to learn that data they keep in memory changed.
+
+    ``touch`` appends a byte, so every call changes the file's size;
+    ``read`` is a single stat, cheap enough to run on every request.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def read(self):
+        """Current (mtime, size) of the file, None while it does not exist"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def touch(self):
+        try:
+            with open(self.path, 'ab') as f:
+                f.write(b'.')
+        except OSError as e:
+            logger.error(f"Cannot touch change stamp {self.path}: {str(e)}")
@@ -11,14 +11,14 @@ def get_upload_path():
     # Check if we're using local or NAS storage
     if current_app.config.get('USE_NAS_STORAGE', False):
         upload_folder = current_app.config['NAS_UPLOAD_FOLDER']
-        logger.debug(f"Using NAS storage path: {upload_folder}")
+        logger.debug("Using NAS storage path: %s", upload_folder)
     else:
         upload_folder = current_app.config['UPLOAD_FOLDER']
-        logger.debug(f"Using local storage path: {upload_folder}")
+        logger.debug("Using local storage path: %s", upload_folder)
         
     if not os.path.exists(upload_folder):
         try:
-            logger.debug(f"Creating upload directory: {upload_folder}")
+            logger.debug("Creating upload directory: %s", upload_folder)
             os.makedirs(upload_folder)
         except Exception as e:
             logger.error(f"Failed to create upload directory: {str(e)}")
@@ -42,11 +42,11 @@ def upload_file(file_bytes, filename):
         str: The file ID if successful, None if failed
     """
     try:
-        logger.debug(f"Starting file upload process for filename: {filename}")
+        logger.debug("Starting file upload process for filename: %s", filename)
         
         # Generate a unique file ID
         file_id = str(uuid.uuid4())
-        logger.debug(f"Generated file ID: {file_id}")
+        logger.debug("Generated file ID: %s", file_id)
         
         # Secure the filename
         secure_name = secure_filename(filename)
@@ -63,7 +63,7 @@ def upload_file(file_bytes, filename):
         with open(file_path, 'wb') as f:
             f.write(file_bytes)
         
-        logger.info(f"Successfully uploaded file. ID: {file_id}")
+        logger.info("Successfully uploaded file. ID: %s", file_id)
         return file_id
     except Exception as e:
         logger.error(f"Error uploading file {filename}: {str(e)}", exc_info=True)
@@ -80,10 +80,10 @@ def delete_file(file_id):
             if filename.startswith(file_id):
                 file_path = os.path.join(upload_path, filename)
                 os.remove(file_path)
-                logger.info(f"Deleted file: {file_path}")
+                logger.info("Deleted file: %s", file_path)
                 return True
         
-        logger.warning(f"No file found with ID: {file_id}")
+        logger.warning("No file found with ID: %s", file_id)
         return False
     except Exception as e:
         logger.error(f"Error deleting file: {str(e)}")
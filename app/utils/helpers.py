@@ -1,4 +1,3 @@
-import qrcode
 import io
 import json
 import logging
@@ -25,6 +24,9 @@ def calculate_vat(subtotal):
 def generate_qr_code(data, sender_mobile, receiver_mobile, order_booked_by):
     """Generate QR code and return as base64 string"""
     try:
+        # qrcode pulls in PIL; only pay for it when a code is drawn
+        import qrcode
+        
         # Create QR code instance
         qr = qrcode.QRCode(
             version=1,
@@ -0,0 +1,233 @@
+import hashlib
+import json
+import logging
+import uuid
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import current_app, g, jsonify, request
+from flask_login import current_user
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
+from ..models.idempotency import IdempotencyKey
+from ..extensions import db
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_FIELD = 'idempotency_key'
+
+# Response headers worth replaying; everything else is rebuilt by Flask
+REPLAYED_HEADERS = ('Location', 'Content-Type')
+
+# Form fields that differ between otherwise identical submissions
+_UNHASHED_FIELDS = ('csrf_token', IDEMPOTENCY_FIELD)
+
+def request_hash(method, url, data):
+    """Fingerprint of a request, to catch a key reused for different data"""
+    payload = json.dumps([method.upper(), url, data], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def _current_request_hash():
+    if request.is_json:
+        data = request.get_json(silent=True)
+    else:
+        data = {k: v for k, v in request.form.to_dict(flat=False).items() if k not in _UNHASHED_FIELDS}
+        data['__files__'] = sorted(f.filename for f in request.files.values() if f.filename)
+    return request_hash(request.method, request.path, data)
+
+def _request_user_id():
+    """User the key is scoped to: the session user, else the token subject"""
+    if current_user.is_authenticated:
+        return current_user.id
+    payload = g.get('token_payload') or {}
+    return payload.get('user_id') or payload.get('sub')
+
+def _replay(row):
+    """Rebuild the stored response of ``row``"""
+    body = row.response_body
+    stored = body if isinstance(body, dict) and '__response__' in body else None
+    if stored is not None:
+        response = current_app.response_class(stored['data'], status=row.response_status)
+        for name, value in stored.get('headers', {}).items():
+            response.headers[name] = value
+    else:
+        response = jsonify(body)
+        response.status_code = row.response_status
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def _stored_body(response):
+    """JSON responses are stored as-is, anything else as text plus headers"""
+    if response.is_json:
+        return response.get_json()
+    return {
+        '__response__': True,
+        'data': response.get_data(as_text=True),
+        'headers': {name: response.headers[name] for name in REPLAYED_HEADERS if name in response.headers}
+    }
+
+def _conflict(message, status_code):
+    return jsonify({'error': message}), status_code
+
+def duplicate_refusal(row, fingerprint):
+    """Status and error for a duplicate of an unexpired key, None when its outcome can be replayed"""
+    if row.request_hash != fingerprint:
+        return 422, 'Idempotency key was already used for a different request'
+    if not row.is_completed:
+        return 409, 'A request with this idempotency key is in progress'
+    return None
+
+def _check_existing(row, fingerprint):
+    """Response for a duplicate of an existing, unexpired key"""
+    refusal = duplicate_refusal(row, fingerprint)
+    if refusal is not None:
+        return _conflict(refusal[1], refusal[0])
+    logger.info("Replaying %s for idempotency key %s", row.endpoint, row.key)
+    return _replay(row)
+
+def _run_locked(view, args, kwargs, user_id, key, fingerprint, expires_at):
+    """Take the key row in the request's own transaction (PostgreSQL).
+
+    The row is inserted before the view runs, so the view's commit stores
+    it together with the work, on the one connection the request uses. A
+    concurrent duplicate inserting the same key waits on the primary key
+    until that commit, then finds the row; it replays the outcome once it
+    is recorded, and gets 409 before. If the view fails without
+    committing, the row is rolled back with its work and the duplicate
+    runs instead. A worker lost between the view's commit and recording
+    the response leaves the key ``processing``: duplicates get 409 until
+    it expires, but the work never runs twice.
+    """
+    table = IdempotencyKey.__table__
+    pk = (table.c.user_id == user_id) & (table.c.key == key)
+    now = datetime.utcnow()
+    token = uuid.uuid4()
+    # A duplicate may have taken the key once the view rolled back; its row is left alone
+    ours = pk & (table.c.claim_token == token)
+
+    def forget():
+        db.session.rollback()
+        db.session.execute(delete(table).where(ours))
+        db.session.commit()
+
+    db.session.execute(delete(table).where(pk, table.c.expires_at <= now))
+    inserted = db.session.execute(pg_insert(table).values(
+        user_id=user_id, key=key, endpoint=request.endpoint,
+        request_hash=fingerprint, status=IdempotencyKey.STATUS_PROCESSING,
+        created_at=now, expires_at=expires_at, claim_token=token
+    ).on_conflict_do_nothing(index_elements=[table.c.user_id, table.c.key]))
+    if inserted.rowcount == 0:
+        row = db.session.execute(select(table).where(pk).with_for_update()).first()
+        existing = IdempotencyKey(**row._mapping) if row else None
+        db.session.rollback()
+        if existing is None:
+            # The holder gave up and its row went with it; the client retries
+            return _conflict('A request with this idempotency key is in progress', 409)
+        return _check_existing(existing, fingerprint)
+
+    try:
+        response = current_app.make_response(view(*args, **kwargs))
+    except Exception:
+        forget()
+        raise
+
+    if response.status_code >= 500:
+        forget()
+        return response
+    # Views that rolled back took the row with them, so it may have to be inserted again
+    outcome = {
+        'status': IdempotencyKey.STATUS_COMPLETED,
+        'response_status': response.status_code,
+        'response_body': _stored_body(response)
+    }
+    db.session.execute(pg_insert(table).values(
+        user_id=user_id, key=key, endpoint=request.endpoint, request_hash=fingerprint,
+        created_at=now, expires_at=expires_at, claim_token=token, **outcome
+    ).on_conflict_do_update(index_elements=[table.c.user_id, table.c.key], set_=outcome,
+                            where=table.c.claim_token == token))
+    db.session.commit()
+    return response
+
+def _run_marked(view, args, kwargs, user_id, key, fingerprint, expires_at):
+    """Fallback for databases without row locks (SQLite).
+
+    The key is committed as ``processing`` before the work runs, so a
+    concurrent duplicate is refused with 409 instead of waiting.
+    """
+    existing = db.session.get(IdempotencyKey, (user_id, key))
+    if existing is not None and existing.expires_at <= datetime.utcnow():
+        db.session.delete(existing)
+        db.session.commit()
+        existing = None
+    if existing is not None:
+        return _check_existing(existing, fingerprint)
+
+    token = uuid.uuid4()
+    try:
+        db.session.add(IdempotencyKey(
+            user_id=user_id, key=key, endpoint=request.endpoint,
+            request_hash=fingerprint, expires_at=expires_at, claim_token=token
+        ))
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return _check_existing(db.session.get(IdempotencyKey, (user_id, key)), fingerprint)
+
+    try:
+        response = current_app.make_response(view(*args, **kwargs))
+    except Exception:
+        db.session.rollback()
+        _forget(user_id, key, token)
+        raise
+
+    if response.status_code >= 500:
+        _forget(user_id, key, token)
+        return response
+    row = db.session.get(IdempotencyKey, (user_id, key))
+    row.record(response.status_code, _stored_body(response))
+    db.session.commit()
+    return response
+
+def _forget(user_id, key, token):
+    """Drop the key claimed with ``token`` when its request failed, so a retry runs it again"""
+    db.session.execute(delete(IdempotencyKey).where(
+        IdempotencyKey.user_id == user_id, IdempotencyKey.key == key, IdempotencyKey.claim_token == token
+    ))
+    db.session.commit()
+
+def idempotent(view):
+    """Run ``view`` at most once per ``Idempotency-Key`` and user.
+
+    The key comes from the ``Idempotency-Key`` header or the
+    ``idempotency_key`` form field. The first response below 500 is stored
+    for IDEMPOTENCY_TTL_HOURS and replayed to duplicates without calling the
+    view again; server errors are not stored so the client can retry.
+    Requests without a key run as before.
+    """
+    @wraps(view)
+    def decorated(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER) or request.form.get(IDEMPOTENCY_FIELD)
+        user_id = _request_user_id()
+        if not key or user_id is None:
+            return view(*args, **kwargs)
+        if len(key) > IdempotencyKey.key.type.length:
+            return _conflict('Idempotency key is too long', 400)
+
+        fingerprint = _current_request_hash()
+        expires_at = datetime.utcnow() + timedelta(hours=current_app.config['IDEMPOTENCY_TTL_HOURS'])
+        run = _run_locked if db.engine.dialect.name == 'postgresql' else _run_marked
+        return run(view, args, kwargs, user_id, key, fingerprint, expires_at)
+    return decorated
+
+def purge_idempotency_keys(now=None):
+    """Delete expired idempotency keys.
+
+    Returns:
+        int: Number of keys deleted.
+    """
+    now = now or datetime.utcnow()
+    result = db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at <= now))
+    db.session.commit()
+    logger.info("Purged %d expired idempotency keys", result.rowcount)
+    return result.rowcount
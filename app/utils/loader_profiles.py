@@ -0,0 +1,88 @@
+"""Named eager-loading profiles for shipment queries.
+
+Each view states up front what it renders, so the relationships it walks
+are loaded with a fixed number of queries, whatever the number of rows or
+items. Profiles work for Shipment and ArchivedShipment alike, since
+lookups fall back to the archive.
+
+With LOADER_PROFILES_STRICT (testing), reading a column a profile left
+out raises instead of loading it with one more query per row, so a
+template that outgrows its profile fails benchmarks/bench_queries.py.
+
+Usage:
+    Shipment.query.options(*loader_options('list')).all()
+    find_shipment(shipment_id, profile='preview')
+"""
+from flask import current_app, has_app_context
+from sqlalchemy.orm import load_only, selectinload
+from ..models.shipment import Shipment
+
+# Shipment columns shown in tables (shipment list, dashboard, profile pages)
+LIST_COLUMNS = (
+    'id', 'waybill_number', 'status', 'created_at', 'created_by', 'delivery_date',
+    'sender_name', 'sender_address', 'receiver_name', 'receiver_address'
+)
+
+# What the public tracking page and API show
+TRACKING_COLUMNS = (
+    'id', 'waybill_number', 'status', 'created_at', 'destination_address', 'qr_code',
+    'sender_name', 'sender_business', 'receiver_name', 'receiver_business'
+)
+TRACKING_ITEM_COLUMNS = ('id', 'export_request_id', 'description', 'quantity')
+
+
+def _columns(model, names):
+    return [getattr(model, name) for name in names]
+
+def _item_model(model):
+    return model.items.property.mapper.class_
+
+def _strict():
+    return has_app_context() and current_app.config.get('LOADER_PROFILES_STRICT', False)
+
+def _list(model):
+    return [
+        load_only(*_columns(model, LIST_COLUMNS), raiseload=_strict()),
+        selectinload(model.creator)
+    ]
+
+def _preview(model):
+    # status_history is a dynamic relationship: see load_status_history()
+    return [
+        selectinload(model.items),
+        selectinload(model.creator),
+        selectinload(model.status_changer)
+    ]
+
+def _tracking(model):
+    item = _item_model(model)
+    return [
+        load_only(*_columns(model, TRACKING_COLUMNS), raiseload=_strict()),
+        selectinload(model.items).load_only(*_columns(item, TRACKING_ITEM_COLUMNS), raiseload=_strict())
+    ]
+
+def _print(model):
+    # The printed waybill shows every shipment column and item, and who booked it
+    return [
+        selectinload(model.items),
+        selectinload(model.creator)
+    ]
+
+PROFILES = {
+    'list': _list,
+    'preview': _preview,
+    'tracking': _tracking,
+    'print': _print
+}
+
+def loader_options(profile, model=Shipment):
+    """Loader options of the named profile for ``model``"""
+    try:
+        return PROFILES[profile](model)
+    except KeyError:
+        raise ValueError(f"Unknown loader profile: {profile}")
+
+def load_status_history(shipment):
+    """Status history of ``shipment`` in order, with the users who made each change"""
+    history = type(shipment).status_history.property.mapper.class_
+    return shipment.status_history.options(selectinload(history.user)).all()
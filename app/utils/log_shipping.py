@@ -0,0 +1,319 @@
+import os
+import queue
+import pickle
+import signal
+import socket
+import struct
+import tempfile
+import selectors
+import threading
+import logging
+import logging.config
+import logging.handlers
+import multiprocessing
+
+# Set in the gunicorn master by start_log_writer() and inherited by the
+# forked workers, which then log through the queue instead of to files.
+_log_queue = None
+_writer = None
+
+STOP = b'STOP'
+_FRAME = struct.Struct('>L')
+
+class SocketQueue:
+    """Queue of log records over a Unix stream socket to the writer process.
+
+    Records are pickled, length-prefixed and sent without blocking; what the
+    socket does not take right away is kept in a per-process buffer and sent
+    with the next record. No lock is shared between processes, so a worker
+    killed in the middle of logging (e.g. by the gunicorn timeout) cannot
+    wedge the others, which a multiprocessing.Queue would. Once the buffer
+    holds ``max_pending`` bytes, put_nowait raises queue.Full.
+    """
+    def __init__(self, path, max_pending=1024 * 1024, max_record_bytes=65536):
+        self.path = path
+        self.max_pending = max_pending
+        self.max_record_bytes = max_record_bytes
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        # A forked child gets its own connection, buffer and lock
+        self._sock = None
+        self._pending = bytearray()
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.path)
+            sock.setblocking(False)
+            self._sock = sock
+        return self._sock
+
+    def put_nowait(self, record):
+        data = pickle.dumps(record.__dict__, pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_record_bytes:
+            record.msg = record.msg[:self.max_record_bytes // 2] + ' [truncated]'
+            data = pickle.dumps(record.__dict__, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            if len(self._pending) + len(data) > self.max_pending:
+                self._send()
+                if len(self._pending) + len(data) > self.max_pending:
+                    raise queue.Full
+            self._pending += _FRAME.pack(len(data)) + data
+            self._send()
+
+    def _send(self):
+        """Send what the socket takes without blocking; caller holds the lock"""
+        try:
+            sent = self._connection().send(self._pending)
+            del self._pending[:sent]
+        except BlockingIOError:
+            pass
+        except OSError:
+            # Writer gone: drop the buffer, reconnect on the next record
+            self._sock = None
+            self._pending.clear()
+            raise queue.Full
+
+    def flush(self, timeout=5.0):
+        """Wait up to ``timeout`` for the buffer to drain (process exit)"""
+        with self._lock:
+            if not self._pending or self._sock is None:
+                return
+            try:
+                self._sock.settimeout(timeout)
+                self._sock.sendall(self._pending)
+                self._pending.clear()
+            except OSError:
+                pass
+            finally:
+                self._sock.setblocking(False)
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full.
+
+    The number of dropped records is reported with the next record that
+    gets through.
+    """
+    def __init__(self, log_queue=None):
+        super().__init__(log_queue if log_queue is not None else _log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            if self.dropped:
+                self.queue.put_nowait(self._dropped_record())
+                self.dropped = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _dropped_record(self):
+        return logging.makeLogRecord({
+            'name': __name__,
+            'levelno': logging.WARNING,
+            'levelname': 'WARNING',
+            'msg': f"Log writer busy, dropped {self.dropped} records in process {os.getpid()}"
+        })
+
+    def close(self):
+        # Process exit: give the writer a moment to take the rest
+        self.queue.flush()
+        if self.dropped:
+            try:
+                self.queue.put_nowait(self._dropped_record())
+                self.queue.flush()
+            except queue.Full:
+                pass
+        super().close()
+
+class BatchRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """RotatingFileHandler that leaves flushing to the writer loop"""
+    def flush(self):
+        pass
+
+    def flush_batch(self):
+        super().flush()
+
+def log_queue():
+    """The shared log queue, or None when logging goes straight to files"""
+    return _log_queue
+
+def queue_logging_config(config):
+    """Turn a file logging config into one that ships every record to the queue.
+
+    Logger levels are kept, so records are still filtered in the worker
+    before anything is formatted or pickled.
+    """
+    config = dict(config)
+    config['handlers'] = {
+        'queue': {
+            '()': 'app.utils.log_shipping.NonBlockingQueueHandler',
+            'filters': ['filter_binary']
+        }
+    }
+    config['loggers'] = {
+        name: dict(settings, handlers=['queue'])
+        for name, settings in config['loggers'].items()
+    }
+    return config
+
+def writer_logging_config(config):
+    """The file handlers of ``config``, flushed once per batch by the writer"""
+    config = dict(config)
+    config['handlers'] = {
+        name: dict(settings, **{'class': 'app.utils.log_shipping.BatchRotatingFileHandler'})
+        if settings.get('class') == 'logging.handlers.RotatingFileHandler' else settings
+        for name, settings in config['handlers'].items()
+    }
+    return config
+
+def _read_frames(buffer):
+    """Split complete frames off the front of ``buffer``"""
+    frames = []
+    offset = 0
+    while len(buffer) - offset >= _FRAME.size:
+        (size,) = _FRAME.unpack_from(buffer, offset)
+        if len(buffer) - offset - _FRAME.size < size:
+            break
+        start = offset + _FRAME.size
+        frames.append(bytes(buffer[start:start + size]))
+        offset = start + size
+    del buffer[:offset]
+    return frames
+
+def _run_writer(server, config):
+    """Writer process: the only one that opens, writes and rotates the log files"""
+    # Signals reach the whole process group; the master stops us with STOP
+    # once the workers are gone, so their last records are still written.
+    # If the master dies without doing so we exit on our own.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    parent = os.getppid()
+    logging.config.dictConfig(config)
+    handlers = set()
+    for logger in [logging.getLogger()] + [logging.getLogger(name) for name in config['loggers']]:
+        handlers.update(logger.handlers)
+
+    selector = selectors.DefaultSelector()
+    selector.register(server, selectors.EVENT_READ)
+    running, stopping = True, False
+    while running:
+        events = selector.select(timeout=0 if stopping else 1)
+        if not events:
+            # Once stopped, exit as soon as every sender is drained
+            running = not stopping and os.getppid() == parent
+            continue
+
+        # Read everything available from every sender, then write it as one batch
+        batch = []
+        for key, _ in events:
+            if key.fileobj is server:
+                connection, _ = server.accept()
+                connection.setblocking(False)
+                selector.register(connection, selectors.EVENT_READ, bytearray())
+                continue
+            try:
+                data = key.fileobj.recv(1 << 20)
+            except BlockingIOError:
+                continue
+            except OSError:
+                data = b''
+            if not data:
+                selector.unregister(key.fileobj)
+                key.fileobj.close()
+                continue
+            key.data.extend(data)
+            batch.extend(_read_frames(key.data))
+
+        for frame in batch:
+            if frame == STOP:
+                stopping = True
+                continue
+            record = logging.makeLogRecord(pickle.loads(frame))
+            # Records were level-filtered in the sender; route by logger name
+            logging.getLogger(record.name).handle(record)
+        for handler in handlers:
+            if isinstance(handler, BatchRotatingFileHandler):
+                handler.flush_batch()
+            else:
+                handler.flush()
+    logging.shutdown()
+
+def start_log_writer(config=None, max_pending=None):
+    """Start the log writer process; call from the gunicorn master (on_starting).
+
+    Args:
+        config: Logging dictConfig for the writer; defaults to the app's file
+            logging config built from LOG_LEVEL/LOG_LEVELS/LOG_FORMAT.
+        max_pending: Bytes each process buffers while the writer is behind,
+            before it starts dropping records.
+    """
+    global _log_queue, _writer
+    if _writer is not None:
+        return _log_queue
+
+    from ..config import Config
+    from .logging_config import build_logging_config
+    if config is None:
+        config = build_logging_config(Config.LOG_LEVEL, Config.LOG_LEVELS, Config.LOG_FORMAT)
+
+    path = os.path.join(tempfile.gettempdir(), f'sgk_export-log-{os.getpid()}.sock')
+    if os.path.exists(path):
+        os.unlink(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(128)
+
+    _writer = multiprocessing.get_context('fork').Process(
+        target=_run_writer,
+        args=(server, writer_logging_config(config)),
+        name='sgk_export-log-writer'
+    )
+    _writer.start()
+    server.close()
+    _log_queue = SocketQueue(path, max_pending or Config.LOG_BUFFER_BYTES)
+    return _log_queue
+
+def stop_log_writer(timeout=10):
+    """Write out what is queued and stop the writer (gunicorn on_exit)"""
+    global _writer
+    if _writer is None:
+        return
+    _log_queue.flush(timeout)
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sender:
+            sender.settimeout(timeout)
+            sender.connect(_log_queue.path)
+            sender.sendall(_FRAME.pack(len(STOP)) + STOP)
+    except OSError:
+        pass
+    _writer.join(timeout)
+    if _writer.is_alive():
+        _writer.kill()
+        _writer.join()
+    if os.path.exists(_log_queue.path):
+        os.unlink(_log_queue.path)
+    _writer = None
+
+def install_queue_handler(*names):
+    """Send the records of the named loggers (root if none) to the writer.
+
+    Used from gunicorn hooks for loggers that gunicorn configures itself,
+    and for the app when it was loaded before the fork (preload_app).
+    """
+    if _log_queue is None:
+        return
+    from .logging_config import BinaryFilter
+    handler = NonBlockingQueueHandler(_log_queue)
+    handler.addFilter(BinaryFilter())
+    for name in names or ('',):
+        logger = logging.getLogger(name)
+        for old in list(logger.handlers):
+            logger.removeHandler(old)
+            old.close()
+        logger.addHandler(handler)
+        if name:
+            logger.propagate = False
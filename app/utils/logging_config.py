@@ -1,4 +1,6 @@
 import os
+import copy
+import json
 import logging.config
 import logging.handlers
 
@@ -23,6 +25,44 @@ class BinaryFilter(logging.Filter):
         except (UnicodeError, AttributeError):
             return False
 
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; fields passed via ``extra=`` are included as-is"""
+    RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, self.datefmt),
+            'level': record.levelname,
+            'logger': record.name,
+            'pid': record.process,
+            'message': record.getMessage()
+        }
+        for key, value in record.__dict__.items():
+            if key not in self.RESERVED:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class LazyRepr:
+    """Log argument that is only computed when the record is formatted.
+
+    Use it for payloads that are expensive to build, e.g.
+    ``logger.debug("Items: %s", lazy(lambda: [i.id for i in items]))``.
+    """
+    __slots__ = ('fn',)
+
+    def __init__(self, fn):
+        self.fn = fn
+
+    def __str__(self):
+        return str(self.fn())
+
+    def __repr__(self):
+        return repr(self.fn())
+
+lazy = LazyRepr
+
 LOGGING_CONFIG = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -38,6 +78,10 @@ LOGGING_CONFIG = {
         'standard': {
             'format': '%(asctime)s [%(levelname)s] [PID:%(process)d] [%(name)s] %(message)s',
             'datefmt': '%Y-%m-%d %H:%M:%S'
+        },
+        'json': {
+            '()': 'app.utils.logging_config.JsonFormatter',
+            'datefmt': '%Y-%m-%dT%H:%M:%S'
         }
     },
     'handlers': {
@@ -91,25 +135,63 @@ LOGGING_CONFIG = {
             'propagate': False
         },
         'gunicorn.error': {
-            'handlers': ['error_file'],
+            'handlers': ['console', 'error_file'],
             'level': 'ERROR',
             'propagate': False
         }
     }
 }
 
-def setup_logging():
-    """Initialize logging configuration"""
+def parse_log_levels(spec):
+    """Parse ``"app.routes=DEBUG,sqlalchemy.engine=INFO"`` into a dict"""
+    if isinstance(spec, dict):
+        return {name: str(level).upper() for name, level in spec.items()}
+    levels = {}
+    for part in (spec or '').split(','):
+        if '=' not in part:
+            continue
+        name, level = part.split('=', 1)
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+def build_logging_config(level='INFO', levels=None, fmt='text'):
+    """LOGGING_CONFIG with the root level, per-logger levels and format applied.
+
+    The console and app.log handlers accept every record, so the logger
+    levels alone decide what is emitted; a record below its logger's level
+    is dropped before its message is formatted.
+    """
+    config = copy.deepcopy(LOGGING_CONFIG)
+    formatter = 'json' if fmt == 'json' else 'standard'
+    for handler in config['handlers'].values():
+        handler['formatter'] = formatter
+    for name in ('console', 'file'):
+        config['handlers'][name]['level'] = 'NOTSET'
+
+    config['loggers']['']['level'] = level.upper()
+    for name, logger_level in parse_log_levels(levels).items():
+        config['loggers'].setdefault(name, {}).update({'level': logger_level})
+    return config
+
+def setup_logging(app=None):
+    """Initialize logging from LOG_LEVEL, LOG_LEVELS and LOG_FORMAT.
+
+    In a gunicorn worker (see app.utils.log_shipping) records go to the
+    writer process through a queue instead of to the files directly.
+    """
     try:
         ensure_log_directory()
-        
-        # Add binary filter to all handlers
-        for handler in LOGGING_CONFIG['handlers'].values():
-            if 'filters' not in handler:
-                handler['filters'] = []
-            handler['filters'].append('filter_binary')
-        
-        logging.config.dictConfig(LOGGING_CONFIG)
+        settings = app.config if app is not None else {}
+        config = build_logging_config(
+            settings.get('LOG_LEVEL', 'DEBUG'),
+            settings.get('LOG_LEVELS'),
+            settings.get('LOG_FORMAT', 'text')
+        )
+        # Under gunicorn the master's writer process owns the files
+        from .log_shipping import log_queue, queue_logging_config
+        if log_queue() is not None:
+            config = queue_logging_config(config)
+        logging.config.dictConfig(config)
         logging.info('Logging setup completed successfully')
     except Exception as e:
         print(f'Error setting up logging: {str(e)}')
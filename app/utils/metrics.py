@@ -0,0 +1,300 @@
+import os
+import json
+import time
+import hmac
+import atexit
+import logging
+import threading
+from flask import g, request, current_app
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    'http_requests_total': ('counter', 'Requests handled, by endpoint, method and status', None),
+    'http_request_duration_seconds': ('histogram', 'Request latency in seconds', LATENCY_BUCKETS),
+    'http_response_size_bytes': ('histogram', 'Response body size in bytes', SIZE_BUCKETS),
+    'http_request_db_queries': ('histogram', 'SQL statements executed per request', QUERY_BUCKETS),
+    'db_queries_total': ('counter', 'SQL statements executed while handling requests', None),
+    'db_query_duration_seconds_total': ('counter', 'Time spent in SQL statements while handling requests', None),
+    'http_requests_in_flight': ('gauge', 'Requests currently being handled', None),
+    'http_requests_shed_total': ('counter', 'Requests refused by rate limits (reason "rate") and '
+                                 'concurrency caps (reason "concurrency"), by endpoint', None),
+    'tracking_lookups_total': ('counter', 'Public tracking lookups answered by the waybill filter ("filtered"), '
+                               'the tracking cache ("cached") or the database ("database")', None),
+}
+
+# Keeps the endpoint label bounded: anything else is counted as "other"
+_METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS')
+
+_store = None
+
+
+class MetricsStore:
+    """Metrics of this process, shared with the other workers through files.
+
+    Each process keeps its values in memory and writes them to
+    ``<directory>/<pid>.json`` at most every ``flush_interval`` seconds.
+    The endpoint adds up the files of every worker, so any worker can
+    answer a scrape. Without a directory only this process is reported.
+    """
+    def __init__(self, directory=None, flush_interval=1.0):
+        self.directory = directory or None
+        self.flush_interval = flush_interval
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            atexit.register(self.flush)
+
+    def _reset(self):
+        # A forked worker starts from zero under its own pid
+        self._values = {}
+        self._lock = threading.Lock()
+        self._flushed = time.monotonic()
+
+    def inc(self, name, labels=(), amount=1):
+        key = (name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        """Add ``value`` to a histogram: one count per bucket plus +Inf, then the sum"""
+        buckets = METRICS[name][2]
+        key = (name, labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(buckets) + 2)
+            index = next((i for i, bound in enumerate(buckets) if value <= bound), len(buckets))
+            counts[index] += 1
+            counts[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return [[name, [list(pair) for pair in labels], value if not isinstance(value, list) else list(value)]
+                    for (name, labels), value in self._values.items()]
+
+    def maybe_flush(self):
+        if self.directory and time.monotonic() - self._flushed >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write this process's values where the other workers can read them"""
+        if not self.directory:
+            return
+        self._flushed = time.monotonic()
+        path = os.path.join(self.directory, f'{os.getpid()}.json')
+        try:
+            _write_json(path, self.snapshot())
+        except OSError as e:
+            logger.warning("Could not write metrics to %s: %s", path, e)
+
+    def collect(self):
+        """Values of every worker, summed by metric and labels"""
+        totals = {}
+        _merge(totals, self.snapshot())
+        if self.directory:
+            own = f'{os.getpid()}.json'
+            for filename in os.listdir(self.directory):
+                if filename.endswith('.json') and filename != own:
+                    _merge(totals, _read_json(os.path.join(self.directory, filename)))
+        return totals
+
+
+def _write_json(path, data):
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        # Gone with its worker, or being replaced right now
+        return []
+
+def _merge(totals, values, gauges=True):
+    for name, labels, value in values:
+        if name not in METRICS or (not gauges and METRICS[name][0] == 'gauge'):
+            continue
+        key = (name, tuple(tuple(pair) for pair in labels))
+        if isinstance(value, list):
+            current = totals.get(key)
+            totals[key] = value if current is None else [a + b for a, b in zip(current, value)]
+        else:
+            totals[key] = totals.get(key, 0) + value
+
+def count_shed(endpoint, reason):
+    """Count a request refused with a 429 by app.utils.rate_limit"""
+    if _store is not None:
+        _store.inc('http_requests_shed_total', (('endpoint', endpoint), ('reason', reason)))
+
+def count_tracking_lookup(result):
+    """Count a waybill lookup of app.utils.tracking_index by where it was answered"""
+    if _store is not None:
+        _store.inc('tracking_lookups_total', (('result', result),))
+
+def prepare_metrics_dir(directory=None):
+    """Start a fresh metrics directory; call from the gunicorn master (on_starting)"""
+    directory = directory or _configured_dir()
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    for filename in os.listdir(directory):
+        if filename.endswith('.json') or filename.endswith('.tmp'):
+            os.remove(os.path.join(directory, filename))
+
+def mark_process_dead(pid, directory=None):
+    """Fold the counters of an exited worker into dead.json (gunicorn child_exit).
+
+    Its gauges are dropped, and the totals stay the same when the worker
+    is replaced. Only the master calls this, so dead.json has one writer.
+    """
+    directory = directory or _configured_dir()
+    if not directory:
+        return
+    path = os.path.join(directory, f'{pid}.json')
+    if not os.path.exists(path):
+        return
+    dead_path = os.path.join(directory, 'dead.json')
+    totals = {}
+    _merge(totals, _read_json(dead_path))
+    _merge(totals, _read_json(path), gauges=False)
+    _write_json(dead_path, [[name, [list(pair) for pair in labels], value]
+                            for (name, labels), value in totals.items()])
+    os.remove(path)
+
+def _configured_dir():
+    from ..config import Config
+    return Config.METRICS_DIR
+
+def _format(value):
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+def render_metrics():
+    """All workers' metrics in the Prometheus text exposition format"""
+    totals = _store.collect() if _store is not None else {}
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for (metric, labels), value in sorted(totals.items()):
+            if metric != name:
+                continue
+            if kind != 'histogram':
+                lines.append(f'{name}{_labels(labels)} {_format(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + ('+Inf',), value):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(labels, [("le", bound)])} {_format(cumulative)}')
+            lines.append(f'{name}_sum{_labels(labels)} {_format(value[-1])}')
+            lines.append(f'{name}_count{_labels(labels)} {_format(cumulative)}')
+    return '\n'.join(lines) + '\n'
+
+def metrics_access():
+    """None if the caller may read the metrics, else the error status code.
+
+    Admins can open the endpoint in the browser; Prometheus authenticates
+    with ``Authorization: Bearer <METRICS_TOKEN>``.
+    """
+    token = current_app.config.get('METRICS_TOKEN')
+    header = request.headers.get('Authorization', '')
+    if token and header.startswith('Bearer ') and hmac.compare_digest(header[7:].encode(), token.encode()):
+        return None
+    if not current_user.is_authenticated:
+        return 401
+    if not current_user.is_admin:
+        return 403
+    return None
+
+def _before_request():
+    g.metrics_started = time.perf_counter()
+    g.db_queries = 0
+    g.db_time = 0.0
+    _store.inc('http_requests_in_flight')
+
+def _after_request(response):
+    g.metrics_status = response.status_code
+    size = response.content_length
+    if size is None and not response.is_streamed:
+        size = response.calculate_content_length()
+    g.metrics_size = size
+    return response
+
+def _teardown_request(exc):
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return
+    _store.inc('http_requests_in_flight', amount=-1)
+    elapsed = time.perf_counter() - started
+
+    endpoint = request.endpoint or 'unmatched'
+    method = request.method if request.method in _METHODS else 'other'
+    status = g.get('metrics_status', 500)
+    _store.inc('http_requests_total', (('endpoint', endpoint), ('method', method), ('status', str(status))))
+    _store.observe('http_request_duration_seconds', (('endpoint', endpoint), ('method', method)), elapsed)
+    size = g.get('metrics_size')
+    if size is not None:
+        _store.observe('http_response_size_bytes', (('endpoint', endpoint),), size)
+    labels = (('endpoint', endpoint),)
+    _store.observe('http_request_db_queries', labels, g.db_queries)
+    if g.db_queries:
+        _store.inc('db_queries_total', labels, g.db_queries)
+        _store.inc('db_query_duration_seconds_total', labels, g.db_time)
+    _store.maybe_flush()
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('metrics_query_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    # Only statements run while handling a request are counted
+    if g and 'metrics_started' in g:
+        g.db_queries += 1
+        g.db_time += elapsed
+
+def _handle_error(context):
+    connection = context.connection
+    if connection is not None and connection.info.get('metrics_query_start'):
+        connection.info['metrics_query_start'].pop()
+
+def init_metrics(app):
+    """Record request and SQL metrics for ``app`` (METRICS_ENABLED)"""
+    global _store
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+    if _store is None:
+        _store = MetricsStore(app.config.get('METRICS_DIR'), app.config.get('METRICS_FLUSH_SECONDS', 1.0))
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    logger.debug("Request metrics enabled (directory: %s)", _store.directory)
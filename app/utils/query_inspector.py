@@ -0,0 +1,193 @@
+import re
+import time
+import hashlib
+import logging
+import traceback
+from contextlib import contextmanager
+from functools import wraps
+from flask import g, request, current_app
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PARAMS = re.compile(r"\(\s*(?:\?|%\([^)]*\)s|%s|:\w+)(?:\s*,\s*(?:\?|%\([^)]*\)s|%s|:\w+))*\s*\)")
+_SPACES = re.compile(r'\s+')
+
+# Frames from these paths are skipped when finding the code that ran a statement
+_LIBRARY_PATHS = ('/sqlalchemy/', '/flask_sqlalchemy/', '/jinja2/', '/werkzeug/', '/flask/', __file__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A route ran more SQL statements than its declared budget"""
+
+
+class QueryLog:
+    """Statements run while it is active, grouped by fingerprint"""
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = {}
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        fingerprint = fingerprint_statement(statement)
+        entry = self.fingerprints.get(fingerprint)
+        if entry is None:
+            entry = self.fingerprints[fingerprint] = {
+                'statement': statement, 'count': 0, 'duration': 0.0, 'location': None
+            }
+        entry['count'] += 1
+        entry['duration'] += duration
+        if entry['count'] == 2:
+            # Only repeated statements need to say where they come from
+            entry['location'] = _caller()
+
+    def repeated(self, threshold):
+        return [entry for entry in self.fingerprints.values() if entry['count'] >= threshold]
+
+
+def fingerprint_statement(statement):
+    """Statement with literals and IN-list lengths normalised, hashed.
+
+    Bound parameters already look the same across calls; literals and
+    expanded IN (...) lists are folded so the same query from a loop
+    always gets the same fingerprint.
+    """
+    normalized = _LITERALS.sub('?', statement)
+    normalized = _PARAMS.sub('(?)', normalized)
+    normalized = _SPACES.sub(' ', normalized).strip().lower()
+    return hashlib.sha1(normalized.encode()).hexdigest()[:12]
+
+def _caller():
+    """Innermost application frame (template or code) that ran the statement"""
+    for frame in reversed(traceback.extract_stack()):
+        if not any(path in frame.filename for path in _LIBRARY_PATHS):
+            return f'{frame.filename}:{frame.lineno} in {frame.name}'
+    return None
+
+@contextmanager
+def track_queries():
+    """Record the statements run inside the block (e.g. in a test or benchmark).
+
+    Usage:
+        with track_queries() as log:
+            client.get('/shipments/list')
+        assert log.count <= 5
+    """
+    listen_for_queries()
+    log = QueryLog()
+    _tracked.append(log)
+    try:
+        yield log
+    finally:
+        _tracked.remove(log)
+
+# Logs of track_queries() blocks; these work outside a request too
+_tracked = []
+
+def query_budget(limit):
+    """Declare the most SQL statements a view may run per request.
+
+    Over budget, a warning is logged; with QUERY_BUDGET_STRICT (testing)
+    QueryBudgetExceeded is raised so the test fails. Only checked while
+    QUERY_INSPECTION is on.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            return view(*args, **kwargs)
+        wrapped.query_budget = limit
+        return wrapped
+    return decorator
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if not conn.info.get('query_inspector_explaining'):
+        conn.info.setdefault('query_inspector_start', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if conn.info.get('query_inspector_explaining'):
+        return
+    starts = conn.info.get('query_inspector_start')
+    if not starts:
+        return
+    duration = time.perf_counter() - starts.pop()
+
+    logs = list(_tracked)
+    if g and g.get('query_log') is not None:
+        logs.append(g.query_log)
+    for log in logs:
+        log.record(statement, duration)
+
+    if g and g.get('query_log') is not None:
+        threshold = current_app.config['SLOW_QUERY_MS'] / 1000
+        if duration >= threshold and not executemany:
+            logger.warning("Slow query (%.1f ms) in %s at %s:\n%s\nPlan:\n%s",
+                           duration * 1000, request.endpoint, _caller(), statement,
+                           explain(conn, statement, parameters))
+
+def _handle_error(context):
+    connection = context.connection
+    if connection is not None and connection.info.get('query_inspector_start'):
+        connection.info['query_inspector_start'].pop()
+
+def explain(conn, statement, parameters):
+    """Plan of a SELECT as the database reports it, one line per row"""
+    if not statement.lstrip().lower().startswith(('select', 'with')):
+        return '(not a SELECT)'
+    prefix = 'EXPLAIN QUERY PLAN ' if conn.dialect.name == 'sqlite' else 'EXPLAIN '
+    conn.info['query_inspector_explaining'] = True
+    try:
+        rows = conn.exec_driver_sql(prefix + statement, parameters).fetchall()
+        return '\n'.join(' | '.join(str(value) for value in row) for row in rows)
+    except Exception as e:
+        return f'(EXPLAIN failed: {e})'
+    finally:
+        conn.info['query_inspector_explaining'] = False
+
+def _before_request():
+    g.query_log = QueryLog()
+
+def _after_request(response):
+    log = g.pop('query_log', None)
+    if log is None:
+        return response
+    endpoint = request.endpoint or 'unmatched'
+    threshold = current_app.config['QUERY_REPEAT_THRESHOLD']
+    for entry in log.repeated(threshold):
+        logger.warning("Possible N+1 in %s: %d x (%.1f ms) at %s:\n%s",
+                       endpoint, entry['count'], entry['duration'] * 1000,
+                       entry['location'], entry['statement'])
+
+    view = current_app.view_functions.get(request.endpoint)
+    budget = getattr(view, 'query_budget', None)
+    if budget is not None and log.count > budget:
+        message = f"{endpoint} ran {log.count} SQL statements, budget is {budget}"
+        if current_app.config['QUERY_BUDGET_STRICT']:
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+    logger.debug("%s ran %d statements in %.1f ms", endpoint, log.count, log.duration * 1000)
+    return response
+
+def _teardown_request(exc):
+    g.pop('query_log', None)
+
+def listen_for_queries():
+    """Time every statement from now on (inspection mode or track_queries)"""
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+
+def init_query_inspector(app):
+    """Per-request N+1, slow query and budget checks (QUERY_INSPECTION)"""
+    if not app.config.get('QUERY_INSPECTION'):
+        return
+    listen_for_queries()
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    logger.info("Query inspection enabled: slow query %s ms, N+1 after %s repeats",
+                app.config['SLOW_QUERY_MS'], app.config['QUERY_REPEAT_THRESHOLD'])
@@ -0,0 +1,292 @@
+import os
+import math
+import time
+import sqlite3
+import logging
+import ipaddress
+import tempfile
+import threading
+from functools import lru_cache, wraps
+from flask import current_app, jsonify, render_template, request
+from flask_login import current_user
+from .metrics import count_shed
+
+logger = logging.getLogger(__name__)
+
+# Buckets idle this long are full again and are deleted
+BUCKET_IDLE_SECONDS = 3600
+# Checks between two deletions of idle buckets, per process
+CLEANUP_EVERY = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS bucket (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS in_flight (scope TEXT NOT NULL, pid INTEGER NOT NULL, count INTEGER NOT NULL,
+                                      PRIMARY KEY (scope, pid));
+"""
+
+
+class RateLimitStore:
+    """Token buckets and in-flight counts shared by the workers of one host.
+
+    The state lives in a SQLite file and every check is one short
+    IMMEDIATE transaction, so workers never overshoot each other's limits.
+    Each thread uses its own connection.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._checks = 0
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            # Losing the limits in a power cut is fine
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.executescript(_SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def _transaction(self, work):
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            result = work(connection)
+            connection.execute('COMMIT')
+            return result
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    @staticmethod
+    def _take(connection, key, rate, burst, now):
+        row = connection.execute('SELECT tokens, updated FROM bucket WHERE key = ?', (key,)).fetchone()
+        tokens = burst if row is None else min(burst, row[0] + max(now - row[1], 0) * rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+        connection.execute('INSERT OR REPLACE INTO bucket (key, tokens, updated) VALUES (?, ?, ?)',
+                           (key, tokens, now))
+        return wait
+
+    @staticmethod
+    def _acquire(connection, scope, limit):
+        running = connection.execute('SELECT COALESCE(SUM(count), 0) FROM in_flight WHERE scope = ?',
+                                     (scope,)).fetchone()[0]
+        if running >= limit:
+            return False
+        connection.execute('INSERT INTO in_flight (scope, pid, count) VALUES (?, ?, 1) '
+                           'ON CONFLICT (scope, pid) DO UPDATE SET count = count + 1', (scope, os.getpid()))
+        return True
+
+    def _cleanup(self, connection, now):
+        # Every CLEANUP_EVERY checks, within the check's own transaction
+        self._checks += 1
+        if self._checks % CLEANUP_EVERY == 0:
+            connection.execute('DELETE FROM bucket WHERE updated < ?', (now - BUCKET_IDLE_SECONDS,))
+
+    def take(self, key, rate, burst, now=None):
+        """Take a token from ``key``'s bucket, refilled at ``rate`` per second up to ``burst``.
+
+        Returns 0 when the request may go ahead, else the seconds until a
+        token is available.
+        """
+        now = time.time() if now is None else now
+
+        def work(connection):
+            wait = self._take(connection, key, rate, burst, now)
+            self._cleanup(connection, now)
+            return wait
+        return self._transaction(work)
+
+    def acquire(self, scope, limit):
+        """Count a request in ``scope`` unless ``limit`` are running on this host already"""
+        return self._transaction(lambda connection: self._acquire(connection, scope, limit))
+
+    def admit(self, key, rate, burst, scope, limit, now=None):
+        """:meth:`take` and then :meth:`acquire` in one transaction.
+
+        Returns ``(None, 0)`` when the request may go ahead, else the reason
+        it may not ('rate' or 'concurrency') and the seconds to wait.
+        """
+        now = time.time() if now is None else now
+
+        def work(connection):
+            wait = self._take(connection, key, rate, burst, now)
+            self._cleanup(connection, now)
+            if wait:
+                return 'rate', wait
+            if not self._acquire(connection, scope, limit):
+                return 'concurrency', 1
+            return None, 0
+        return self._transaction(work)
+
+    def release(self, scope):
+        self._transaction(lambda connection: connection.execute(
+            'UPDATE in_flight SET count = MAX(count - 1, 0) WHERE scope = ? AND pid = ?', (scope, os.getpid())))
+
+    def forget_in_flight(self, pid=None):
+        """Drop the in-flight requests of a worker that exited, or of all workers"""
+        if pid is None:
+            self._transaction(lambda connection: connection.execute('DELETE FROM in_flight'))
+        else:
+            self._transaction(lambda connection: connection.execute('DELETE FROM in_flight WHERE pid = ?', (pid,)))
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+_store = None
+_proxy_warned = False
+
+
+def _reset_after_fork():
+    # Connections must not cross a fork; the worker opens its own
+    global _store
+    _store = None
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def store_path(config):
+    """RATE_LIMIT_STORE of ``config`` (app config or the environment)"""
+    return config.get('RATE_LIMIT_STORE') or os.path.join(tempfile.gettempdir(), 'sgk_export-ratelimit.sqlite')
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = RateLimitStore(store_path(current_app.config))
+    return _store
+
+def forget_in_flight(pid=None):
+    """Release the slots of an exited worker, or of every worker of a previous run.
+
+    For the gunicorn master, which has no app: the store comes from the environment.
+    """
+    store = RateLimitStore(store_path(os.environ))
+    try:
+        store.forget_in_flight(pid)
+    except sqlite3.Error as e:
+        logger.warning("Could not release rate limit slots in %s: %s", store.path, e)
+    finally:
+        store.close()
+
+
+@lru_cache(maxsize=8)
+def _trusted_networks(setting):
+    """RATE_LIMIT_TRUSTED_PROXIES as networks; invalid entries are skipped with a warning"""
+    networks = []
+    for entry in setting.split(','):
+        try:
+            if entry.strip():
+                networks.append(ipaddress.ip_network(entry.strip(), strict=False))
+        except ValueError:
+            logger.warning("Ignoring invalid RATE_LIMIT_TRUSTED_PROXIES entry %r", entry.strip())
+    return tuple(networks)
+
+def _is_trusted_proxy(address):
+    setting = current_app.config.get('RATE_LIMIT_TRUSTED_PROXIES', '127.0.0.1,::1')
+    try:
+        address = ipaddress.ip_address(address or '')
+    except ValueError:
+        return False
+    return any(address in network for network in _trusted_networks(setting))
+
+def client_ip():
+    """The client address, taken from X-Forwarded-For behind RATE_LIMIT_PROXIES proxies.
+
+    X-Forwarded-For is only read from RATE_LIMIT_TRUSTED_PROXIES; anyone
+    else reaching gunicorn directly could otherwise pick a fresh address,
+    and bucket, per request.
+    """
+    global _proxy_warned
+    proxies = current_app.config.get('RATE_LIMIT_PROXIES', 1)
+    if not proxies and not _proxy_warned and 'X-Forwarded-For' in request.headers:
+        # Behind a proxy every client would share its address, and its bucket
+        _proxy_warned = True
+        logger.warning("Request from %s has X-Forwarded-For but RATE_LIMIT_PROXIES=0: "
+                       "all clients behind that proxy share one rate limit", request.remote_addr)
+    if proxies and _is_trusted_proxy(request.remote_addr):
+        forwarded = [part.strip() for part in request.headers.get('X-Forwarded-For', '').split(',') if part.strip()]
+        if len(forwarded) >= proxies:
+            return forwarded[-proxies]
+    return request.remote_addr or 'unknown'
+
+def client_key():
+    """Bucket key and whether the client is authenticated: API token, logged-in user or IP"""
+    tokens = current_app.extensions.get('api_tokens')
+    if tokens is not None and request.headers.get('Authorization', '').startswith('Bearer '):
+        import jwt
+        from .api_tokens import request_token_claims, token_digest
+        try:
+            claims = request_token_claims()
+            return f"token:{claims.get('jti') or token_digest(request.headers['Authorization'][7:])}", True
+        except jwt.InvalidTokenError:
+            # An invalid token gets no bucket of its own
+            pass
+    if current_user.is_authenticated:
+        return f'user:{current_user.get_id()}', True
+    return f'ip:{client_ip()}', False
+
+def _refuse(name, reason, retry_after, html):
+    retry_after = max(1, math.ceil(retry_after))
+    count_shed(request.endpoint or 'unmatched', reason)
+    # Debug only: a scraper would flood the log; http_requests_shed_total counts them
+    logger.debug("Shed %s request to %s from %s (%s), retry after %ds",
+                   name, request.path, client_ip(), reason, retry_after)
+    if html:
+        response = current_app.make_response(
+            (render_template('error.html', error='Too many requests, please try again shortly.'), 429))
+    else:
+        response = jsonify({'error': 'Too many requests', 'retry_after': retry_after})
+        response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def rate_limited(name, html=False):
+    """Limit a public view with the ``<NAME>_*`` settings (RATE_LIMIT_ENABLED).
+
+    Anonymous clients share a token bucket per IP of <NAME>_RATE_PER_MINUTE
+    requests and bursts of <NAME>_BURST; API tokens and logged-in users get
+    their own, larger <NAME>_USER_* bucket. At most <NAME>_MAX_CONCURRENT
+    requests of the group run at once across the workers. Refused requests
+    get a 429 with Retry-After, as JSON or the error page with ``html``.
+    All views of a group share the buckets. If the store fails, requests
+    are let through.
+    """
+    prefix = name.upper()
+
+    def decorator(view):
+        @wraps(view)
+        def limited(*args, **kwargs):
+            config = current_app.config
+            if not config.get('RATE_LIMIT_ENABLED', True):
+                return view(*args, **kwargs)
+            store = get_store()
+            key, authenticated = client_key()
+            suffix = '_USER' if authenticated else ''
+            try:
+                reason, wait = store.admit(f'{name}:{key}', config[f'{prefix}{suffix}_RATE_PER_MINUTE'] / 60,
+                                           config[f'{prefix}{suffix}_BURST'], name,
+                                           config[f'{prefix}_MAX_CONCURRENT'])
+                if reason:
+                    return _refuse(name, reason, wait, html)
+            except sqlite3.Error as e:
+                logger.warning("Rate limit store %s failed, not limiting: %s", store.path, e)
+                return view(*args, **kwargs)
+            try:
+                return view(*args, **kwargs)
+            finally:
+                try:
+                    store.release(name)
+                except sqlite3.Error as e:
+                    logger.warning("Rate limit store %s failed to release a slot: %s", store.path, e)
+        return limited
+    return decorator
@@ -0,0 +1,125 @@
+import os
+import re
+import time
+import uuid
+import cProfile
+import logging
+from datetime import datetime
+from urllib.parse import parse_qs
+from itsdangerous import TimestampSigner, BadSignature
+from werkzeug.exceptions import HTTPException
+from .logging_config import ensure_log_directory
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_PARAM = '_profile'
+PROFILE_ID_HEADER = 'X-Profile-Id'
+
+_ENVIRON_KEY = 'HTTP_' + PROFILE_HEADER.upper().replace('-', '_')
+_UNSAFE = re.compile(r'[^\w.-]')
+
+
+def _signer(secret_key):
+    return TimestampSigner(secret_key, salt='request-profile')
+
+def profile_token(app, user):
+    """Signed value for the X-Profile header (or ?_profile=) of an admin"""
+    return _signer(app.config['SECRET_KEY']).sign(str(user.id)).decode()
+
+def profiles_dir(app):
+    return app.config.get('PROFILE_DIR') or os.path.join(ensure_log_directory(), 'profiles')
+
+
+class RequestProfiler:
+    """WSGI middleware running requests that carry a valid token under cProfile.
+
+    Requests without the header or query flag go straight to the app: the
+    only cost is a lookup in the WSGI environ. The token is signed with the
+    SECRET_KEY, expires after PROFILE_TOKEN_MAX_AGE seconds and names a
+    user who has to still be an admin.
+    """
+    def __init__(self, app):
+        self.app = app
+        self.wsgi_app = app.wsgi_app
+
+    def __call__(self, environ, start_response):
+        token = environ.get(_ENVIRON_KEY)
+        if token is None:
+            query = environ.get('QUERY_STRING', '')
+            if PROFILE_PARAM not in query:
+                return self.wsgi_app(environ, start_response)
+            token = parse_qs(query).get(PROFILE_PARAM, [None])[0]
+        user_id = self._verify(token)
+        if user_id is None:
+            return self.wsgi_app(environ, start_response)
+        return self._profile(environ, start_response, user_id)
+
+    def _verify(self, token):
+        """Admin id in a valid, unexpired token, else None"""
+        from ..models.user import User
+        from ..extensions import db
+        if not token:
+            return None
+        try:
+            user_id = uuid.UUID(_signer(self.app.config['SECRET_KEY']).unsign(
+                token, max_age=self.app.config['PROFILE_TOKEN_MAX_AGE']).decode())
+        except (BadSignature, ValueError):
+            logger.warning("Rejected profiling token")
+            return None
+        with self.app.app_context():
+            user = db.session.get(User, user_id)
+            if user is None or not user.is_admin:
+                logger.warning("Profiling token of %s, who is not an admin", user_id)
+                return None
+        return user_id
+
+    def _endpoint(self, environ):
+        try:
+            endpoint, _ = self.app.url_map.bind_to_environ(environ).match()
+            return endpoint
+        except HTTPException:
+            return 'unmatched'
+
+    def _profile(self, environ, start_response, user_id):
+        profile_id = uuid.uuid4().hex[:12]
+        endpoint = self._endpoint(environ)
+
+        def profiled_start_response(status, headers, exc_info=None):
+            return start_response(status, headers + [(PROFILE_ID_HEADER, profile_id)], exc_info)
+
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            # Read the whole body here so streamed responses are profiled too
+            app_iter = self.wsgi_app(environ, profiled_start_response)
+            try:
+                body = b''.join(app_iter)
+            finally:
+                if hasattr(app_iter, 'close'):
+                    app_iter.close()
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - started
+            path = self._save(profiler, endpoint, profile_id)
+            logger.info("Profiled %s %s for %s in %.1f ms: %s",
+                        environ.get('REQUEST_METHOD'), environ.get('PATH_INFO'), user_id, elapsed * 1000, path)
+        return [body]
+
+    def _save(self, profiler, endpoint, profile_id):
+        directory = profiles_dir(self.app)
+        os.makedirs(directory, exist_ok=True)
+        stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+        path = os.path.join(directory, f'{stamp}-{_UNSAFE.sub("_", endpoint)}-{profile_id}.prof')
+        try:
+            profiler.dump_stats(path)
+        except OSError as e:
+            logger.error(f"Could not write profile {path}: {str(e)}")
+        return path
+
+
+def init_request_profiler(app):
+    """Profile admin-signed requests (PROFILING_ENABLED)"""
+    if app.config.get('PROFILING_ENABLED', True):
+        app.wsgi_app = RequestProfiler(app)
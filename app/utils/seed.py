@@ -0,0 +1,252 @@
+import io
+import os
+import random
+import uuid
+import logging
+import multiprocessing
+from datetime import datetime, timedelta
+from sqlalchemy import insert, select
+from ..extensions import db
+from ..models.user import User
+from ..models.shipment import Shipment, ShipmentItem, ShipmentStatusHistory
+from ..models.stats import PeriodStats, reconcile_user_stats
+
+logger = logging.getLogger(__name__)
+
+CUSTOMER_GROUPS = (('regular', 70), ('corporate', 20), ('vip', 8), ('government', 2))
+DESTINATIONS = ('United Kingdom', 'United States', 'Canada', 'Germany', 'Ghana', 'South Africa', 'China')
+ITEMS = ('Documents', 'Clothing', 'Electronics', 'Food items', 'Books', 'Spare parts', 'Cosmetics')
+
+SEED_PASSWORD = 'seed-password'
+
+# Rows per INSERT statement
+INSERT_SIZE = 1000
+
+# Settings shared by the generator processes, see _init_worker
+_worker = {}
+
+
+def _uuid(rnd):
+    return uuid.UUID(int=rnd.getrandbits(128), version=4)
+
+def _status_path(rnd):
+    """Statuses a shipment went through, following STATUS_TRANSITIONS"""
+    path = [Shipment.STATUS_PENDING]
+    while Shipment.STATUS_TRANSITIONS[path[-1]] and rnd.random() < 0.8:
+        path.append(rnd.choice(Shipment.STATUS_TRANSITIONS[path[-1]]))
+    return path
+
+def _contacts(rnd, count, prefix):
+    return [{
+        'name': f'{prefix} {i}',
+        'mobile': f'080{rnd.randint(10000000, 99999999)}',
+        'email': f'{prefix.lower()}{i}@example.com',
+        'business': f'{prefix} Business {i}' if rnd.random() < 0.4 else None,
+        'address': f'{rnd.randint(1, 200)} Market Road, Lagos'
+    } for i in range(count)]
+
+def placeholder_images():
+    """A small PNG per item description, written for items that get an image"""
+    from PIL import Image, ImageDraw
+    images = {}
+    for i, description in enumerate(ITEMS):
+        image = Image.new('RGB', (320, 240), (60 + 25 * i, 120, 200 - 20 * i))
+        ImageDraw.Draw(image).text((20, 110), description, fill=(255, 255, 255))
+        buffered = io.BytesIO()
+        image.save(buffered, format='PNG')
+        images[description] = buffered.getvalue()
+    return images
+
+def _init_worker(settings):
+    _worker.clear()
+    _worker.update(settings)
+    if settings['image_ratio'] and settings['upload_dir']:
+        _worker['images'] = placeholder_images()
+
+def _generate_chunk(chunk):
+    """Rows of the shipments ``start`` to ``stop``, their items and status history.
+
+    Every chunk has its own random generator derived from the seed and its
+    first waybill number, so the rows do not depend on how many processes
+    generate them and seeding again appends new shipments.
+    """
+    start, stop = chunk
+    settings = _worker
+    rnd = random.Random(f"{settings['seed']}-{start}")
+    senders, receivers, user_ids = settings['senders'], settings['receivers'], settings['user_ids']
+    groups, weights = zip(*CUSTOMER_GROUPS)
+    step = settings['step']
+
+    shipment_rows, item_rows, history_rows = [], [], []
+    for number in range(start, stop):
+        shipment_id = _uuid(rnd)
+        # Evenly spread and in waybill order, as generate_waybill_number expects
+        created_at = settings['start'] + step * (number - settings['first_number'] + rnd.random())
+        # Few senders ship a lot; receivers repeat less
+        sender = senders[min(int(rnd.paretovariate(1.2)) - 1, len(senders) - 1)]
+        receiver = rnd.choice(receivers)
+        path = _status_path(rnd)
+        freight = round(rnd.uniform(5000, 80000), 2)
+        charges = round(rnd.uniform(0, 5000), 2)
+
+        changed_at, changed_by = created_at, None
+        for old, new in zip(path, path[1:]):
+            changed_at += timedelta(hours=rnd.randint(1, 72))
+            changed_by = rnd.choice(user_ids)
+            history_rows.append({
+                'id': _uuid(rnd), 'shipment_id': shipment_id, 'old_status': old, 'new_status': new,
+                'changed_by': changed_by, 'changed_at': changed_at, 'updated_at': changed_at
+            })
+
+        shipment_rows.append({
+            'id': shipment_id,
+            'waybill_number': f'EX{number:06d}',
+            'created_at': created_at,
+            'updated_at': changed_at,
+            'created_by': rnd.choice(user_ids),
+            'sender_name': sender['name'], 'sender_mobile': sender['mobile'],
+            'sender_email': sender['email'], 'sender_business': sender['business'],
+            'sender_address': sender['address'],
+            'receiver_name': receiver['name'], 'receiver_mobile': receiver['mobile'],
+            'receiver_email': receiver['email'], 'receiver_business': receiver['business'],
+            'receiver_address': receiver['address'],
+            'destination_address': receiver['address'],
+            'destination_country': rnd.choice(DESTINATIONS),
+            'freight_pricing': freight, 'additional_charges': charges,
+            'total': round(freight + charges, 2),
+            'customer_group': rnd.choices(groups, weights)[0],
+            'status': path[-1],
+            'status_changed_by': changed_by,
+            'status_changed_at': changed_at,
+            'is_collection': rnd.random() < 0.3
+        })
+
+        for _ in range(rnd.randint(1, settings['max_items'])):
+            description = rnd.choice(ITEMS)
+            item = {
+                'id': _uuid(rnd), 'export_request_id': shipment_id,
+                'description': description, 'value': round(rnd.uniform(1000, 200000), 2),
+                'quantity': rnd.randint(1, 10), 'weight': round(rnd.uniform(0.2, 30), 1),
+                'image_filename': None, 'image_file_id': None,
+                'updated_at': created_at
+            }
+            if rnd.random() < settings['image_ratio']:
+                file_id = str(_uuid(rnd))
+                item['image_filename'] = f"{description.lower().replace(' ', '_')}.png"
+                item['image_file_id'] = file_id
+                if 'images' in _worker:
+                    # Same file name scheme as upload_file
+                    with open(os.path.join(settings['upload_dir'], f'{file_id}.png'), 'wb') as f:
+                        f.write(_worker['images'][description])
+            item_rows.append(item)
+
+    return shipment_rows, item_rows, history_rows
+
+def _insert(model, rows):
+    for start in range(0, len(rows), INSERT_SIZE):
+        db.session.execute(insert(model.__table__), rows[start:start + INSERT_SIZE])
+
+def _seed_users(rnd, count, password_hash):
+    """Ids of the seed users, creating the ones that do not exist yet"""
+    usernames = [f'seed{i}' for i in range(count)]
+    existing = dict(db.session.execute(
+        select(User.username, User.id).where(User.username.in_(usernames))).all())
+    rows = []
+    for i, username in enumerate(usernames):
+        user_id = _uuid(rnd)
+        if username in existing:
+            continue
+        rows.append({
+            'id': user_id, 'username': username, 'name': f'Seed User {i}',
+            'password_hash': password_hash, 'is_admin': i == 0, 'is_superuser': i == 0
+        })
+        existing[username] = user_id
+    _insert(User, rows)
+    return [existing[username] for username in usernames]
+
+def seed_database(shipments, users=5, seed=42, max_items=5, image_ratio=0.3, upload_dir=None,
+                  end=None, days=730, processes=None, chunk_size=10000, progress=None):
+    """Insert a synthetic dataset into the current app's database.
+
+    Shipments are spread over the ``days`` before ``end``, with senders
+    and receivers drawn from pools so contacts repeat, skewed customer
+    groups, 1 to ``max_items`` items each and status histories that follow
+    STATUS_TRANSITIONS. About ``image_ratio`` of the items get a placeholder
+    image, written to ``upload_dir`` when one is given. The same seed,
+    ``end`` and chunk size give the same rows on the same starting data,
+    whatever the number of processes.
+
+    Rows are generated in chunks by ``processes`` worker processes (all
+    CPUs by default, 1 generates in this process) and bulk inserted here,
+    one transaction per chunk. ``progress`` is called with the number of
+    shipments inserted after every chunk.
+
+    Returns the admin user id, the id and waybill of a recent shipment
+    with items and history, and the number of rows inserted.
+    """
+    rnd = random.Random(seed)
+    end = end or datetime(2025, 1, 1)
+    processes = processes or os.cpu_count() or 1
+
+    first_number = int(Shipment.generate_waybill_number()[2:])
+
+    # Hashing is slow on purpose, so all seed users share one
+    template = User(username='seed')
+    template.set_password(SEED_PASSWORD)
+    user_ids = _seed_users(rnd, users, template.password_hash)
+    db.session.commit()
+
+    settings = {
+        'seed': seed, 'first_number': first_number, 'start': end - timedelta(days=days),
+        'step': timedelta(days=days) / max(shipments, 1), 'max_items': max_items,
+        'image_ratio': image_ratio, 'upload_dir': upload_dir, 'user_ids': user_ids,
+        'senders': _contacts(rnd, max(shipments // 20, 1), 'Sender'),
+        'receivers': _contacts(rnd, max(shipments // 5, 1), 'Receiver')
+    }
+    if upload_dir:
+        os.makedirs(upload_dir, exist_ok=True)
+    chunks = [(first_number + start, first_number + min(start + chunk_size, shipments))
+              for start in range(0, shipments, chunk_size)]
+
+    counts = {'shipments': 0, 'items': 0, 'status_changes': 0}
+    sample = None
+
+    def store(rows):
+        nonlocal sample
+        shipment_rows, item_rows, history_rows = rows
+        _insert(Shipment, shipment_rows)
+        _insert(ShipmentItem, item_rows)
+        _insert(ShipmentStatusHistory, history_rows)
+        db.session.commit()
+        counts['shipments'] += len(shipment_rows)
+        counts['items'] += len(item_rows)
+        counts['status_changes'] += len(history_rows)
+        for row in shipment_rows:
+            if row['status'] != Shipment.STATUS_PENDING and (sample is None or row['created_at'] > sample['created_at']):
+                sample = row
+        if progress:
+            progress(counts['shipments'])
+
+    if processes == 1 or len(chunks) == 1:
+        _init_worker(settings)
+        for chunk in chunks:
+            store(_generate_chunk(chunk))
+    else:
+        with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(settings,)) as pool:
+            # imap keeps the chunk order, so rows are inserted in the same order every run
+            for rows in pool.imap(_generate_chunk, chunks):
+                store(rows)
+
+    # Bulk inserts bypass the ORM events that keep the counters and memoized totals
+    reconcile_user_stats(db.session.connection())
+    db.session.execute(PeriodStats.__table__.delete())
+    db.session.commit()
+    logger.info("Seeded %d shipments, %d items and %d status changes",
+                counts['shipments'], counts['items'], counts['status_changes'])
+
+    return {
+        'admin_id': user_ids[0],
+        'shipment_id': sample['id'] if sample else None,
+        'waybill_number': sample['waybill_number'] if sample else None,
+        **counts
+    }
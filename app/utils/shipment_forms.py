@@ -0,0 +1,88 @@
+import logging
+from werkzeug.utils import secure_filename
+from ..models.shipment import Shipment, ShipmentItem
+from .file_storage import upload_file
+
+logger = logging.getLogger(__name__)
+
+def _as_list(value):
+    """Form fields arrive as lists from request.form and as scalars from queued JSON"""
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+def shipment_from_form(form_data, created_by):
+    """Build a pending Shipment from the new shipment form fields.
+
+    The shipment is neither added to the session nor committed.
+    """
+    return Shipment(
+        waybill_number=Shipment.generate_waybill_number(),
+        sender_name=form_data.get('sender_name'),
+        sender_email=form_data.get('sender_email'),
+        sender_address=form_data.get('sender_address'),
+        sender_business=form_data.get('sender_business'),
+        sender_mobile=form_data.get('sender_mobile'),
+        receiver_name=form_data.get('receiver_name'),
+        receiver_email=form_data.get('receiver_email'),
+        receiver_address=form_data.get('receiver_address'),
+        receiver_business=form_data.get('receiver_business'),
+        receiver_mobile=form_data.get('receiver_mobile'),
+        destination_address=form_data.get('destination_address'),
+        destination_country=form_data.get('destination_country'),
+        destination_postcode=form_data.get('destination_postcode'),
+        freight_pricing=float(form_data.get('freight') or 0),
+        additional_charges=float(form_data.get('additional') or 0),
+        pickup_charge=float(form_data.get('pickup') or 0),
+        handling_fees=float(form_data.get('handling') or 0),
+        crating=float(form_data.get('crating') or 0),
+        insurance_charge=float(form_data.get('insurance') or 0),
+        is_collection=bool(form_data.get('is_collection')),
+        customer_group=form_data.get('customer_group'),
+        order_booked_by=form_data.get('order_booked_by'),
+        sender_signature=form_data.get('sender_signature'),
+        status='pending',
+        created_by=created_by
+    )
+
+def add_items_from_form(shipment, descriptions, values, quantities, weights, images=None):
+    """Append the item rows of the form to ``shipment`` and set its total.
+
+    Rows without a description are skipped. ``images`` holds the uploaded
+    files in row order; a failed upload is logged and the item kept.
+    """
+    descriptions, values = _as_list(descriptions), _as_list(values)
+    quantities, weights = _as_list(quantities), _as_list(weights)
+    images = images or []
+
+    for i, description in enumerate(descriptions):
+        if not description:
+            continue
+        value = values[i] if i < len(values) else None
+        quantity = quantities[i] if i < len(quantities) else None
+        weight = weights[i] if i < len(weights) else None
+        item = ShipmentItem(
+            description=description,
+            value=float(value) if value else 0,
+            quantity=int(quantity) if quantity else 0,
+            weight=float(weight) if weight else 0
+        )
+
+        if i < len(images) and images[i].filename:
+            try:
+                filename = secure_filename(images[i].filename)
+                file_id = upload_file(images[i].read(), filename)
+                if file_id:
+                    item.image_filename = filename
+                    item.image_file_id = file_id
+                else:
+                    logger.error(f"Failed to upload image for item {i+1}")
+            except Exception as img_error:
+                logger.error(f"Error uploading image for item {i+1}: {str(img_error)}", exc_info=True)
+
+        shipment.items.append(item)
+
+    shipment.total = shipment.calculated_total
+    return shipment
@@ -0,0 +1,114 @@
+import os
+import re
+import uuid
+import logging
+from collections import defaultdict
+import click
+from flask import g, request, current_app, has_app_context, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from .query_inspector import fingerprint_statement
+
+logger = logging.getLogger(__name__)
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+# Tag values are reduced to these characters instead of being URL encoded as
+# sqlcommenter does: a '%' in the SQL would be taken for a placeholder by
+# psycopg2 whenever the statement has parameters
+_UNSAFE = re.compile(r'[^\w.:-]')
+_COMMENT = re.compile(r"/\*((?:\w+='[\w.:-]*',?)+)\*/")
+_TAG = re.compile(r"(\w+)='([\w.:-]*)'")
+
+# A log record starts with a timestamp; other lines continue the previous one
+_RECORD_START = re.compile(r'^\d{4}-\d{2}-\d{2}[ T]')
+_DURATION = re.compile(r'duration: ([\d.]+) ms|Slow query \(([\d.]+) ms\)')
+_STATEMENT_START = re.compile(r'(?:statement|execute [^:]*): ')
+
+
+def sql_comment(tags):
+    """Tags as a sqlcommenter-style comment: /*key='value',...*/ with sorted keys"""
+    pairs = ','.join(f"{key}='{_UNSAFE.sub('_', str(value))}'"
+                     for key, value in sorted(tags.items()) if value is not None)
+    return f'/*{pairs}*/'
+
+def current_tags():
+    """Where the statement comes from: the endpoint and request, or the CLI command"""
+    tags = {'pid': os.getpid()}
+    if has_request_context():
+        tags['endpoint'] = request.endpoint or 'unmatched'
+        tags['request_id'] = g.get('request_id')
+    else:
+        context = click.get_current_context(silent=True)
+        if context is not None:
+            tags['command'] = context.info_name
+    return tags
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if not has_app_context() or not current_app.config.get('SQL_COMMENTS'):
+        return statement, parameters
+    return f'{statement} {sql_comment(current_tags())}', parameters
+
+def _before_request():
+    # Reuse the id of a proxy in front of us so both logs can be matched up
+    request_id = _UNSAFE.sub('', request.headers.get(REQUEST_ID_HEADER, ''))[:64]
+    g.request_id = request_id or uuid.uuid4().hex
+
+def _after_request(response):
+    if g.get('request_id'):
+        response.headers[REQUEST_ID_HEADER] = g.request_id
+    return response
+
+def init_sql_comments(app):
+    """Tag every SQL statement with its origin (SQL_COMMENTS)"""
+    if not app.config.get('SQL_COMMENTS'):
+        return
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute, retval=True)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    logger.info("SQL statements are tagged with endpoint, request id and pid")
+
+def _records(lines):
+    record = []
+    for line in lines:
+        if _RECORD_START.match(line) and record:
+            yield ' '.join(record)
+            record = []
+        record.append(line.strip())
+    if record:
+        yield ' '.join(record)
+
+def parse_tagged_log(lines):
+    """Tagged statements found in a PostgreSQL or application log.
+
+    Yields (tags, statement, duration in ms or None) for every record with
+    a tag comment. Durations come from log_min_duration_statement lines
+    ("duration: 1.2 ms  statement: ...") or the slow query log.
+    """
+    for record in _records(lines):
+        comments = list(_COMMENT.finditer(record))
+        if not comments:
+            continue
+        comment = comments[-1]
+        tags = dict(_TAG.findall(comment.group(1)))
+        text = record[:comment.start()]
+        start = _STATEMENT_START.search(text)
+        statement = text[start.end():] if start else text
+        match = _DURATION.search(record)
+        duration = float(match.group(1) or match.group(2)) if match else None
+        yield tags, statement.strip(), duration
+
+def summarize(entries, by='endpoint'):
+    """Calls and time per endpoint (or per endpoint and statement), slowest first"""
+    totals = defaultdict(lambda: {'calls': 0, 'timed': 0, 'total_ms': 0.0, 'statement': None})
+    for tags, statement, duration in entries:
+        origin = tags.get('endpoint') or tags.get('command') or 'unknown'
+        key = (origin, fingerprint_statement(statement)) if by == 'statement' else (origin,)
+        entry = totals[key]
+        entry['calls'] += 1
+        entry['statement'] = entry['statement'] or statement
+        if duration is not None:
+            entry['timed'] += 1
+            entry['total_ms'] += duration
+    return sorted(totals.items(), key=lambda item: (item[1]['total_ms'], item[1]['calls']), reverse=True)
@@ -0,0 +1,441 @@
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import func, case, and_, or_, String
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+from ..models.shipment import Shipment
+from ..models.archive import all_shipments
+from ..models.stats import PeriodStats, UserShipmentStats, reconcile_user_stats
+from ..extensions import db
+
+logger = logging.getLogger(__name__)
+
+# Statuses counted as "active" on the dashboard and profile cards
+ACTIVE_STATUSES = ('processing', 'in_transit')
+
+# Status keys that templates expect to always be present
+DEFAULT_STATUSES = ('pending', 'processing', 'in_transit', 'delivered', 'cancelled')
+
+
+class _TimeBucket(FunctionElement):
+    """Truncate a timestamp to the start of its bucket, rendered as 'YYYY-MM-DD' text.
+
+    ``date_trunc`` only exists on PostgreSQL, so each dialect gets its own
+    compilation below. Returning text keeps the result identical everywhere.
+    """
+    type = String()
+    inherit_cache = True
+
+
+class day_bucket(_TimeBucket):
+    name = 'day_bucket'
+    inherit_cache = True
+    unit = 'day'
+    sqlite_format = '%Y-%m-%d'
+
+
+class month_bucket(_TimeBucket):
+    name = 'month_bucket'
+    inherit_cache = True
+    unit = 'month'
+    sqlite_format = '%Y-%m-01'
+
+
+BUCKETS = {
+    'day': day_bucket,
+    'month': month_bucket
+}
+
+
+def _compile_bucket_default(element, compiler, **kw):
+    return "strftime('%s', %s)" % (element.sqlite_format, compiler.process(element.clauses, **kw))
+
+
+def _compile_bucket_postgresql(element, compiler, **kw):
+    return "to_char(date_trunc('%s', %s), 'YYYY-MM-DD')" % (element.unit, compiler.process(element.clauses, **kw))
+
+
+for _bucket in BUCKETS.values():
+    compiles(_bucket)(_compile_bucket_default)
+    compiles(_bucket, 'postgresql')(_compile_bucket_postgresql)
+
+
+def time_bucket(granularity, column):
+    """Return a portable bucketing expression for ``column``"""
+    try:
+        return BUCKETS[granularity](column)
+    except KeyError:
+        raise ValueError(f"Unsupported trend granularity: {granularity}")
+
+
+def bucket_start(granularity, value):
+    """Truncate a datetime to the start of its bucket"""
+    value = value.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == 'month':
+        value = value.replace(day=1)
+    return value
+
+
+def next_bucket(granularity, value):
+    """Start of the bucket following the one starting at ``value``"""
+    if granularity == 'month':
+        return (value + timedelta(days=32)).replace(day=1)
+    return value + timedelta(days=1)
+
+
+def previous_bucket(granularity, value):
+    """Start of the bucket preceding the one starting at ``value``"""
+    return bucket_start(granularity, value - timedelta(days=1))
+
+
+# Columns the aggregations read from the hot and archive tables
+STATS_COLUMNS = ('id', 'status', 'total', 'created_at', 'created_by', 'customer_group')
+
+
+def _within(column, start, end):
+    """Half-open ``[start, end)`` filter on ``column``; None bounds are open"""
+    conditions = []
+    if start is not None:
+        conditions.append(column >= start)
+    if end is not None:
+        conditions.append(column < end)
+    if not conditions:
+        return None
+    return and_(*conditions)
+
+
+def _conditional_sum(condition, value):
+    if condition is None:
+        return func.sum(value)
+    return func.sum(case((condition, value), else_=0))
+
+
+def empty_summary():
+    return {
+        'total_shipments': 0,
+        'total_revenue': 0.0,
+        'average_revenue': 0.0,
+        'active_shipments': 0,
+        'delivered_shipments': 0,
+        'cancelled_shipments': 0,
+        'status_counts': {},
+        'customer_groups': {}
+    }
+
+
+def _finalize(summary):
+    """Fill in the derived fields of a period summary"""
+    if summary['total_shipments']:
+        summary['average_revenue'] = summary['total_revenue'] / summary['total_shipments']
+    summary['active_shipments'] = count_statuses(summary, ACTIVE_STATUSES)
+    summary['delivered_shipments'] = summary['status_counts'].get(Shipment.STATUS_DELIVERED, 0)
+    summary['cancelled_shipments'] = summary['status_counts'].get(Shipment.STATUS_CANCELLED, 0)
+    return summary
+
+
+def count_statuses(summary, statuses):
+    """Sum the status counts of a period summary for the given statuses"""
+    return sum(summary['status_counts'].get(status, 0) for status in statuses)
+
+
+def status_distribution(summary, defaults=DEFAULT_STATUSES):
+    """Status counts of a period summary with zero defaults filled in"""
+    distribution = {status: 0 for status in defaults}
+    for status, count in summary['status_counts'].items():
+        if status:
+            distribution[status.lower()] = distribution.get(status.lower(), 0) + count
+    return distribution
+
+
+def collect_stats(periods, trend=None, created_by=None, by_customer_group=False):
+    """Aggregate shipment statistics for several periods in a single query.
+
+    Every period becomes a pair of conditional aggregates, and the trend is a
+    bucketing expression in the GROUP BY, so the shipments are scanned once no
+    matter how many periods are requested. Archived shipments are included.
+
+    Args:
+        periods: Mapping of period name to a ``(start, end)`` tuple. ``start``
+            is inclusive and ``end`` exclusive; either may be None.
+        trend: Optional ``(granularity, start, end)`` tuple where granularity
+            is 'day' or 'month'.
+        created_by: Restrict the aggregation to shipments created by this user.
+        by_customer_group: Also break each period down by customer group.
+
+    Returns:
+        dict: ``{'periods': {name: summary}, 'trends': [bucket, ...]}``
+    """
+    # Rows outside every period and the trend are never counted: leave them out of both tables
+    ranges = list(periods.values()) + ([trend[1:]] if trend else [])
+    starts = [start for start, _ in ranges]
+    ends = [end for _, end in ranges]
+    shipments = all_shipments(
+        *STATS_COLUMNS,
+        start=min(starts) if ranges and None not in starts else None,
+        end=max(ends) if ranges and None not in ends else None
+    )
+    period_conditions = {name: _within(shipments.c.created_at, start, end) for name, (start, end) in periods.items()}
+
+    columns = []
+    group_by = [shipments.c.status]
+    bucket = None
+    trend_condition = None
+    if trend:
+        granularity, trend_start, trend_end = trend
+        trend_condition = _within(shipments.c.created_at, trend_start, trend_end)
+        bucket_expr = time_bucket(granularity, shipments.c.created_at)
+        if trend_condition is not None:
+            bucket_expr = case((trend_condition, bucket_expr), else_=None)
+        bucket = bucket_expr.label('bucket')
+        group_by.append(bucket)
+    if by_customer_group:
+        group_by.append(shipments.c.customer_group)
+
+    names = list(period_conditions)
+    for index, name in enumerate(names):
+        condition = period_conditions[name]
+        columns.append(_conditional_sum(condition, 1).label(f'period_{index}_count'))
+        columns.append(_conditional_sum(condition, func.coalesce(shipments.c.total, 0)).label(f'period_{index}_revenue'))
+    # Whole-group totals; a non-null bucket only ever holds rows inside the trend window
+    columns.append(func.count(shipments.c.id).label('row_count'))
+    columns.append(func.sum(func.coalesce(shipments.c.total, 0)).label('row_revenue'))
+
+    query = db.session.query(*group_by, *columns)
+
+    filters = list(period_conditions.values())
+    if trend:
+        filters.append(trend_condition)
+    if filters and all(condition is not None for condition in filters):
+        query = query.filter(or_(*filters))
+    if created_by is not None:
+        query = query.filter(shipments.c.created_by == created_by)
+
+    rows = query.group_by(*group_by).all()
+    logger.debug("Stats aggregation returned %d grouped rows", len(rows))
+
+    results = {name: empty_summary() for name in names}
+    trend_totals = {}
+    for row in rows:
+        for index, name in enumerate(names):
+            count = getattr(row, f'period_{index}_count') or 0
+            if not count:
+                continue
+            revenue = float(getattr(row, f'period_{index}_revenue') or 0)
+            summary = results[name]
+            summary['total_shipments'] += count
+            summary['total_revenue'] += revenue
+            summary['status_counts'][row.status] = summary['status_counts'].get(row.status, 0) + count
+            if by_customer_group:
+                group = summary['customer_groups'].setdefault(row.customer_group, {'count': 0, 'revenue': 0.0})
+                group['count'] += count
+                group['revenue'] += revenue
+        if bucket is not None and row.bucket is not None:
+            totals = trend_totals.setdefault(row.bucket, {'count': 0, 'revenue': 0.0})
+            totals['count'] += row.row_count
+            totals['revenue'] += float(row.row_revenue or 0)
+
+    for summary in results.values():
+        _finalize(summary)
+
+    return {
+        'periods': results,
+        'trends': [
+            {'bucket': key, 'count': totals['count'], 'revenue': totals['revenue']}
+            for key, totals in sorted(trend_totals.items())
+        ]
+    }
+
+
+def _summary_bucket(key, summary):
+    """Express a live period summary in the same shape as a memoized bucket"""
+    return {
+        'bucket': key,
+        'count': summary['total_shipments'],
+        'revenue': summary['total_revenue'],
+        'status_counts': dict(summary['status_counts'])
+    }
+
+
+def merge_buckets(buckets):
+    """Combine memoized/live buckets into a single period summary"""
+    summary = empty_summary()
+    for bucket in buckets:
+        summary['total_shipments'] += bucket['count']
+        summary['total_revenue'] += bucket['revenue']
+        for status, count in bucket['status_counts'].items():
+            summary['status_counts'][status] = summary['status_counts'].get(status, 0) + count
+    return _finalize(summary)
+
+
+def _compute_buckets(granularity, start, end):
+    """Aggregate every bucket in ``[start, end)`` with one grouped query"""
+    shipments = all_shipments(*STATS_COLUMNS, start=start, end=end)
+    bucket = time_bucket(granularity, shipments.c.created_at).label('bucket')
+    rows = db.session.query(
+        bucket,
+        shipments.c.status,
+        func.count(shipments.c.id).label('count'),
+        func.sum(func.coalesce(shipments.c.total, 0)).label('revenue')
+    ).filter(
+        shipments.c.created_at >= start,
+        shipments.c.created_at < end
+    ).group_by(bucket, shipments.c.status).all()
+
+    computed = {}
+    current = start
+    while current < end:
+        key = current.strftime('%Y-%m-%d')
+        computed[key] = {'bucket': key, 'count': 0, 'revenue': 0.0, 'status_counts': {}}
+        current = next_bucket(granularity, current)
+    for row in rows:
+        entry = computed.get(row.bucket)
+        if entry is None:
+            continue
+        entry['count'] += row.count
+        entry['revenue'] += float(row.revenue or 0)
+        entry['status_counts'][row.status] = entry['status_counts'].get(row.status, 0) + row.count
+    return computed
+
+
+# INSERT ... ON CONFLICT DO NOTHING of each supported backend
+_INSERT_IGNORING_CONFLICTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+def _store_period_stats(granularity, entries):
+    """Memoize computed buckets on a connection of their own.
+
+    The request's session is left alone, whatever it has pending. Buckets
+    another worker stored first are skipped; their values are identical.
+    """
+    insert = _INSERT_IGNORING_CONFLICTS[db.engine.dialect.name]
+    with db.engine.begin() as connection:
+        connection.execute(insert(PeriodStats.__table__).on_conflict_do_nothing(), [{
+            'granularity': granularity,
+            'period_start': datetime.strptime(entry['bucket'], '%Y-%m-%d').date(),
+            'shipment_count': entry['count'],
+            'revenue': entry['revenue'],
+            'status_counts': entry['status_counts']
+        } for entry in entries])
+
+
+def closed_period_stats(granularity, start=None, end=None, now=None):
+    """Return per-bucket stats for every closed day/month in ``[start, end)``.
+
+    Closed buckets are read from the ``period_stats`` table; any that are
+    missing are computed with a single query and stored for next time. The
+    open (current) bucket is never included, callers compute it live. A
+    ``start`` of None means "from the first shipment".
+
+    Returns:
+        list: Bucket dicts with 'bucket', 'count', 'revenue' and 'status_counts'.
+    """
+    now = now or datetime.now()
+    open_start = bucket_start(granularity, now)
+    end = open_start if end is None else min(bucket_start(granularity, end), open_start)
+
+    if start is None:
+        first_created = db.session.query(func.min(all_shipments('created_at').c.created_at)).scalar()
+        if first_created is None:
+            return []
+        start = first_created
+    start = bucket_start(granularity, start)
+    if start >= end:
+        return []
+
+    cached = {
+        row.period_start.strftime('%Y-%m-%d'): {
+            'bucket': row.period_start.strftime('%Y-%m-%d'),
+            'count': row.shipment_count,
+            'revenue': row.revenue,
+            'status_counts': dict(row.status_counts or {})
+        }
+        for row in PeriodStats.query.filter(
+            PeriodStats.granularity == granularity,
+            PeriodStats.period_start >= start.date(),
+            PeriodStats.period_start < end.date()
+        )
+    }
+
+    missing = []
+    current = start
+    while current < end:
+        if current.strftime('%Y-%m-%d') not in cached:
+            missing.append(current)
+        current = next_bucket(granularity, current)
+
+    if missing:
+        logger.debug("Computing %d uncached %s buckets", len(missing), granularity)
+        computed = _compute_buckets(granularity, missing[0], next_bucket(granularity, missing[-1]))
+        fresh = [computed[m.strftime('%Y-%m-%d')] for m in missing]
+        _store_period_stats(granularity, fresh)
+        for entry in fresh:
+            cached[entry['bucket']] = entry
+
+    return [cached[key] for key in sorted(cached)]
+
+
+def monthly_overview(months=6, all_time=False, now=None):
+    """Dashboard statistics: the open month live, closed months memoized.
+
+    Returns the same shape as :func:`collect_stats` with 'current' and
+    'previous' periods (plus 'all' when ``all_time``) and monthly trends
+    covering the last ``months`` months including the current one.
+    """
+    now = now or datetime.now()
+    current_start = bucket_start('month', now)
+    previous_start = previous_bucket('month', current_start)
+    trend_start = current_start
+    for _ in range(months - 1):
+        trend_start = previous_bucket('month', trend_start)
+
+    current = collect_stats({'current': (current_start, None)})['periods']['current']
+    closed = closed_period_stats('month', None if all_time else min(previous_start, trend_start), current_start, now)
+    current_bucket = _summary_bucket(current_start.strftime('%Y-%m-%d'), current)
+
+    previous_key = previous_start.strftime('%Y-%m-%d')
+    trend_key = trend_start.strftime('%Y-%m-%d')
+    periods = {
+        'current': current,
+        'previous': merge_buckets([b for b in closed if b['bucket'] == previous_key])
+    }
+    if all_time:
+        periods['all'] = merge_buckets(closed + [current_bucket])
+
+    return {
+        'periods': periods,
+        'trends': [b for b in closed if b['bucket'] >= trend_key] + [current_bucket]
+    }
+
+
+def daily_overview(start=None, now=None):
+    """Statistics for the days from ``start`` to now, closed days memoized.
+
+    ``start`` is truncated to midnight; None covers the whole history.
+    Returns the same shape as :func:`collect_stats` with a 'window' period
+    and one trend bucket per day.
+    """
+    now = now or datetime.now()
+    today_start = bucket_start('day', now)
+
+    today = collect_stats({'today': (today_start, None)})['periods']['today']
+    closed = closed_period_stats('day', start, today_start, now)
+    buckets = closed + [_summary_bucket(today_start.strftime('%Y-%m-%d'), today)]
+
+    return {
+        'periods': {'window': merge_buckets(buckets)},
+        'trends': buckets
+    }
+
+
+def user_stats(user_id):
+    """Counters for one user's shipments from a single primary-key lookup.
+
+    Builds the row on first use for users whose counters were never created,
+    in a transaction of its own so the request's session is left alone.
+    """
+    stats = db.session.get(UserShipmentStats, user_id)
+    if stats is None:
+        with db.engine.begin() as connection:
+            reconcile_user_stats(connection, user_id)
+        stats = db.session.get(UserShipmentStats, user_id)
+    return stats
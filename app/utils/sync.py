@@ -0,0 +1,144 @@
+import base64
+import binascii
+import logging
+import uuid
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import and_, or_
+from ..models.shipment import Shipment, ShipmentItem, ShipmentStatusHistory
+from ..models.sync import SyncTombstone
+from ..extensions import db
+
+logger = logging.getLogger(__name__)
+
+# Feed sections in cursor order: (response key, model, timestamp column, shipment key)
+FEED_SECTIONS = (
+    ('shipments', Shipment, Shipment.updated_at, 'id'),
+    ('items', ShipmentItem, ShipmentItem.updated_at, 'export_request_id'),
+    ('status_history', ShipmentStatusHistory, ShipmentStatusHistory.updated_at, 'shipment_id'),
+    ('deleted', SyncTombstone, SyncTombstone.deleted_at, 'shipment_id')
+)
+
+# Large base64 blobs the offline views never show; fetched with the full page instead
+UNSYNCED_COLUMNS = {'qr_code', 'sender_signature'}
+
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(timestamp, section, row_id):
+    """Opaque cursor for the position just after one feed row"""
+    raw = f"{timestamp.isoformat()}|{section}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Inverse of :func:`encode_cursor`; raises InvalidCursor on bad input"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, section, row_id = base64.urlsafe_b64decode(padded).decode().split('|')
+        return datetime.fromisoformat(timestamp), int(section), str(uuid.UUID(row_id))
+    except (ValueError, UnicodeDecodeError, binascii.Error) as e:
+        raise InvalidCursor(f"Invalid sync cursor: {cursor}") from e
+
+def _json_value(value):
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+def serialize_row(row):
+    """Column values of a synced row as a JSON-safe dict"""
+    return {
+        column.key: _json_value(getattr(row, column.key))
+        for column in row.__table__.columns
+        if column.key not in UNSYNCED_COLUMNS
+    }
+
+def _after_cursor(timestamp_column, id_column, index, cursor):
+    """Rows of section ``index`` ordered after ``cursor``"""
+    if cursor is None:
+        return None
+    timestamp, section, row_id = cursor
+    if index < section:
+        return timestamp_column > timestamp
+    if index > section:
+        return timestamp_column >= timestamp
+    return or_(
+        timestamp_column > timestamp,
+        and_(timestamp_column == timestamp, id_column > row_id)
+    )
+
+def collect_changes(since=None, limit=None, now=None):
+    """Rows changed or deleted after ``since``, one page at a time.
+
+    The feed is ordered by (timestamp, section, id) across all sections, so a
+    page can stop anywhere and the returned cursor resumes exactly after the
+    last row sent. Without ``since`` the page is a snapshot of live rows and
+    tombstones are skipped. A cursor older than the tombstone retention
+    cannot be replayed safely; the feed then restarts with ``reset`` set and
+    the client should drop its local copy.
+
+    Returns:
+        dict: Rows per section plus 'cursor', 'has_more' and 'reset'.
+    """
+    limit = limit or current_app.config['SYNC_PAGE_SIZE']
+    now = now or datetime.utcnow()
+    horizon = now - timedelta(seconds=current_app.config['SYNC_SETTLE_SECONDS'])
+
+    cursor = decode_cursor(since) if since else None
+    reset = False
+    if cursor and cursor[0] < now - timedelta(days=current_app.config['SYNC_TOMBSTONE_DAYS']):
+        logger.info("Sync cursor from %s is past tombstone retention, restarting", cursor[0])
+        cursor = None
+        reset = True
+
+    candidates = []
+    for index, (key, model, timestamp_column, shipment_key) in enumerate(FEED_SECTIONS):
+        if model is SyncTombstone and cursor is None:
+            continue
+        query = model.query.filter(timestamp_column <= horizon)
+        condition = _after_cursor(timestamp_column, model.id, index, cursor)
+        if condition is not None:
+            query = query.filter(condition)
+        # One extra row tells us whether another page follows
+        rows = query.order_by(timestamp_column, model.id).limit(limit + 1).all()
+        for row in rows:
+            candidates.append((getattr(row, timestamp_column.key), index, str(row.id), row))
+
+    candidates.sort(key=lambda candidate: candidate[:3])
+    page = candidates[:limit]
+
+    result = {key: [] for key, _, _, _ in FEED_SECTIONS}
+    for timestamp, index, row_id, row in page:
+        key = FEED_SECTIONS[index][0]
+        if key == 'deleted':
+            # The tombstone's own id only orders the feed; clients delete by entity id
+            result[key].append({
+                'type': row.entity,
+                'id': _json_value(row.entity_id),
+                'shipment_id': _json_value(row.shipment_id)
+            })
+        else:
+            result[key].append(serialize_row(row))
+
+    if page:
+        timestamp, index, row_id, _ = page[-1]
+        next_cursor = encode_cursor(timestamp, index, row_id)
+    else:
+        next_cursor = since if not reset else None
+
+    result.update({
+        'cursor': next_cursor,
+        'has_more': len(candidates) > limit,
+        'reset': reset
+    })
+    logger.debug("Sync page: %d rows, has_more=%s", len(page), result['has_more'])
+    return result
+
+def purge_tombstones(days=None, now=None):
+    """Delete tombstones older than the retention window; returns the count"""
+    days = days if days is not None else current_app.config['SYNC_TOMBSTONE_DAYS']
+    cutoff = (now or datetime.utcnow()) - timedelta(days=days)
+    count = SyncTombstone.query.filter(SyncTombstone.deleted_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    return count
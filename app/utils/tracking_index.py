@@ -0,0 +1,289 @@
+import os
+import math
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from flask import current_app, has_app_context
+from sqlalchemy import event, func, select, union_all
+from sqlalchemy.orm import Session, object_session
+from ..extensions import db
+from ..models.shipment import Shipment, ShipmentItem
+from ..models.archive import ArchivedShipment
+from .archive import find_shipment_by_waybill
+from .change_stamp import ChangeStamp
+
+logger = logging.getLogger(__name__)
+
+# Room for this many waybills at least, so a young database does not rebuild on every new shipment
+MIN_CAPACITY = 10000
+FALSE_POSITIVE_RATE = 0.01
+# Changes are caught up from this long before the previous catch-up, for
+# transactions that committed after it but wrote updated_at before it
+CATCH_UP_OVERLAP = timedelta(seconds=60)
+BUILD_CHUNK_SIZE = 10000
+
+
+class BloomFilter:
+    """Set membership in ~10 bits per key, with false positives but never false negatives"""
+
+    def __init__(self, capacity, error_rate=FALSE_POSITIVE_RATE):
+        self.capacity = max(int(capacity), 1)
+        self.size = max(int(-self.capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / self.capacity * math.log(2)), 1)
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        # Double hashing: k positions from the two halves of one digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        """Add ``key``; keys that seem present already are not counted again"""
+        new = False
+        for position in self._positions(key):
+            byte, bit = position >> 3, 1 << (position & 7)
+            if not self._bits[byte] & bit:
+                self._bits[byte] |= bit
+                new = True
+        if new:
+            self.count += 1
+        return new
+
+    def __contains__(self, key):
+        bits = self._bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    @property
+    def nbytes(self):
+        return len(self._bits)
+
+
+def tracking_payload(shipment):
+    """What the public tracking views show of ``shipment``; ``created_at`` stays a datetime"""
+    return {
+        'waybill_number': shipment.waybill_number,
+        'status': shipment.status,
+        'created_at': shipment.created_at,
+        'destination': shipment.destination_address,
+        'sender': {
+            'name': shipment.sender_name,
+            'business': shipment.sender_business
+        },
+        'receiver': {
+            'name': shipment.receiver_name,
+            'business': shipment.receiver_business
+        },
+        'items': [{
+            'description': item.description,
+            'quantity': item.quantity
+        } for item in shipment.items],
+        'qr_code': shipment.qr_code if shipment.qr_code else None
+    }
+
+
+class TrackingIndex:
+    """Which waybills exist, and recent tracking answers, per worker.
+
+    A Bloom filter of every waybill in the hot and archive tables answers
+    most lookups of unknown waybills without a query; a waybill it lets
+    through is looked up once and its payload (or its absence, for a false
+    positive) kept for ``ttl`` seconds in an LRU of ``maxsize`` entries.
+    Committing a new shipment or a change to one appends a byte to
+    ``stamp_path``: each lookup stats the file, and when it changed the
+    worker drops its payloads and adds the waybills updated since its last
+    catch-up to the filter. The filter is rebuilt every
+    ``rebuild_seconds`` for rows written without the ORM, such as seeded
+    shipments, and when it outgrows its capacity.
+    """
+
+    def __init__(self, stamp_path, maxsize=4096, ttl=300, rebuild_seconds=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.rebuild_seconds = rebuild_seconds
+        self.stamp = ChangeStamp(stamp_path)
+        self._filter = None
+        self._built_at = 0.0
+        self._synced_at = None
+        self._stamp = None
+        self._payloads = OrderedDict()
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+
+    def build(self):
+        """Load every waybill into a new filter, returning the number loaded"""
+        with self._build_lock:
+            self._build()
+        return self._filter.count
+
+    def _build(self):
+        started = time.perf_counter()
+        stamp = self.stamp.read()
+        synced_at = datetime.utcnow()
+        # Two statements, so a request that builds the filter stays within its query budget
+        counts = [select(func.count()).select_from(model).scalar_subquery() for model in (Shipment, ArchivedShipment)]
+        total = db.session.execute(select(counts[0] + counts[1])).scalar()
+        bloom = BloomFilter(max(total * 2, MIN_CAPACITY))
+        waybills = union_all(select(Shipment.waybill_number), select(ArchivedShipment.waybill_number))
+        rows = db.session.execute(select(waybills.subquery().c.waybill_number).execution_options(
+            yield_per=BUILD_CHUNK_SIZE))
+        for waybill in rows.scalars():
+            bloom.add(waybill)
+        with self._lock:
+            self._filter = bloom
+            self._payloads.clear()
+            self._stamp = stamp
+        self._synced_at = synced_at
+        self._built_at = time.monotonic()
+        logger.info("Tracking index built: %d waybills in %d KiB, %.0f ms", bloom.count, bloom.nbytes // 1024,
+                    (time.perf_counter() - started) * 1000)
+
+    def _catch_up(self, stamp):
+        synced_at = datetime.utcnow()
+        waybills = db.session.execute(select(Shipment.waybill_number).where(
+            Shipment.updated_at > self._synced_at - CATCH_UP_OVERLAP)).scalars().all()
+        added = 0
+        with self._lock:
+            for waybill in waybills:
+                added += self._filter.add(waybill)
+            # Status and item changes: which waybills they touched is not known here
+            self._payloads.clear()
+            self._stamp = stamp
+        self._synced_at = synced_at
+        logger.debug("Tracking index caught up with %d changed shipments, %d new", len(waybills), added)
+
+    def _sync(self):
+        """Bring the filter up to date with the stamp; returns the stamp it now matches"""
+        stamp = self.stamp.read()
+        if self._filter is None:
+            with self._build_lock:
+                if self._filter is None:
+                    self._build()
+        elif (time.monotonic() - self._built_at > self.rebuild_seconds
+              or self._filter.count > self._filter.capacity):
+            # One thread rebuilds, the others go on with the current filter
+            if self._build_lock.acquire(blocking=False):
+                try:
+                    self._build()
+                finally:
+                    self._build_lock.release()
+        if stamp != self._stamp:
+            with self._build_lock:
+                if stamp != self._stamp:
+                    self._catch_up(stamp)
+        return stamp
+
+    def lookup(self, waybill):
+        """Tracking payload of ``waybill``, None when no shipment has it"""
+        # Only the tracking views get here; scripts go without the metrics
+        from .metrics import count_tracking_lookup
+        stamp = self._sync()
+        if waybill not in self._filter:
+            count_tracking_lookup('filtered')
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._payloads.get(waybill)
+            if entry is not None and entry[1] > now:
+                self._payloads.move_to_end(waybill)
+                count_tracking_lookup('cached')
+                return entry[0]
+
+        count_tracking_lookup('database')
+        shipment = find_shipment_by_waybill(waybill, profile='tracking')
+        payload = tracking_payload(shipment) if shipment is not None else None
+        with self._lock:
+            # A change committed while loading is picked up on the next lookup
+            if stamp == self._stamp:
+                self._payloads[waybill] = (payload, now + self.ttl)
+                self._payloads.move_to_end(waybill)
+                while len(self._payloads) > self.maxsize:
+                    self._payloads.popitem(last=False)
+        return payload
+
+    def clear(self):
+        """Forget the cached answers; the waybill filter stays"""
+        with self._lock:
+            self._payloads.clear()
+
+    def add(self, waybill):
+        """Count ``waybill`` as issued in this worker, before the others catch up"""
+        if self._filter is not None:
+            with self._lock:
+                self._filter.add(waybill)
+
+
+_index = None
+
+
+def stamp_path(config):
+    """TRACKING_CACHE_STAMP of ``config``, shared by every process that changes shipments"""
+    return config.get('TRACKING_CACHE_STAMP') or os.path.join(tempfile.gettempdir(), 'sgk_export-tracking.stamp')
+
+def init_tracking_index(app):
+    """The index public tracking goes through, or None when TRACKING_CACHE_SECONDS is 0.
+
+    Each app gets a new one, so an app created later in the same process
+    (benchmarks) never answers from another app's database.
+    """
+    global _index
+    if app.config.get('TRACKING_CACHE_SECONDS', 300) <= 0:
+        _index = None
+        return None
+    _index = TrackingIndex(stamp_path(app.config), app.config.get('TRACKING_CACHE_SIZE', 4096),
+                           app.config['TRACKING_CACHE_SECONDS'],
+                           app.config.get('TRACKING_INDEX_REBUILD_SECONDS', 3600))
+    logger.debug("Tracking index enabled (%d answers, %ss, stamp %s)", _index.maxsize, _index.ttl,
+                 _index.stamp.path)
+    return _index
+
+def get_index():
+    """This worker's index, None when tracking is not served or the cache is off"""
+    return _index
+
+def find_tracking(waybill):
+    """Tracking payload of ``waybill`` through the index, or from the database without one"""
+    if _index is not None:
+        return _index.lookup(waybill)
+    shipment = find_shipment_by_waybill(waybill, profile='tracking')
+    return tracking_payload(shipment) if shipment is not None else None
+
+
+# The stamp is touched once the transaction commits, so other workers never
+# catch up before the rows are visible to them. Every process that changes
+# shipments does this, whether or not it serves the tracking pages.
+
+def _mark_changed(session):
+    if session is not None:
+        session.info['tracking_index_stale'] = True
+
+def _shipment_inserted(mapper, connection, target):
+    # A rolled back insert only leaves a false positive behind
+    if _index is not None:
+        _index.add(target.waybill_number)
+    _mark_changed(object_session(target))
+
+def _shipment_changed(mapper, connection, target):
+    _mark_changed(object_session(target))
+
+event.listen(Shipment, 'after_insert', _shipment_inserted)
+event.listen(Shipment, 'after_update', _shipment_changed)
+event.listen(Shipment, 'after_delete', _shipment_changed)
+event.listen(ShipmentItem, 'after_insert', _shipment_changed)
+event.listen(ShipmentItem, 'after_update', _shipment_changed)
+event.listen(ShipmentItem, 'after_delete', _shipment_changed)
+
+@event.listens_for(Session, 'after_commit')
+def _touch_after_commit(session):
+    if session.info.pop('tracking_index_stale', False) and has_app_context():
+        ChangeStamp(stamp_path(current_app.config)).touch()
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back(session):
+    session.info.pop('tracking_index_stale', None)
@@ -0,0 +1,121 @@
+import os
+import time
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from uuid import UUID
+from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from ..extensions import db
+from ..models.user import User
+from .change_stamp import ChangeStamp
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, eq=False)
+class CachedUser(UserMixin):
+    """What requests read from the logged-in user, safe to share between threads.
+
+    Routes that change the user load the row itself, e.g.
+    ``db.session.get(User, current_user.id)``.
+    """
+    id: UUID
+    username: str
+    name: str
+    is_admin: bool
+    is_superuser: bool
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(id=user.id, username=user.username, name=user.name,
+                   is_admin=bool(user.is_admin), is_superuser=bool(user.is_superuser))
+
+
+class UserCache:
+    """Least recently used snapshots of users, each kept for ``ttl`` seconds.
+
+    Every worker has its own. A committed change to a user appends a byte
+    to ``stamp_path``; each lookup stats the file and drops all entries when
+    it changed, so the other workers see password, flag and deletion changes
+    on their next request without asking the database.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60, stamp_path=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stamp = ChangeStamp(stamp_path or os.path.join(tempfile.gettempdir(), 'sgk_export-users.stamp'))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stamp = self.stamp.read()
+
+    def get(self, user_id):
+        """CachedUser for ``user_id``, loaded from the database when missing or expired"""
+        stamp = self.stamp.read()
+        now = time.monotonic()
+        with self._lock:
+            if stamp != self._stamp:
+                self._entries.clear()
+                self._stamp = stamp
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(user_id)
+                return entry[0]
+
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        snapshot = CachedUser.from_user(user)
+        with self._lock:
+            # A change committed while loading is picked up on the next lookup
+            if stamp == self._stamp:
+                self._entries[user_id] = (snapshot, now + self.ttl)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return snapshot
+
+    def invalidate(self):
+        """Forget every user, in this worker and the others"""
+        with self._lock:
+            self._entries.clear()
+        self.stamp.touch()
+
+
+_cache = None
+
+
+def init_user_cache(app):
+    """The cache ``load_user`` goes through, or None when USER_CACHE_SECONDS is 0"""
+    global _cache
+    if app.config.get('USER_CACHE_SECONDS', 60) <= 0:
+        return None
+    if _cache is None:
+        _cache = UserCache(app.config.get('USER_CACHE_SIZE', 1024), app.config['USER_CACHE_SECONDS'],
+                           app.config.get('USER_CACHE_STAMP'))
+        logger.debug("User cache enabled (%d users, %ss, stamp %s)", _cache.maxsize, _cache.ttl, _cache.stamp.path)
+    return _cache
+
+
+# Users changed in a transaction are forgotten once it commits: dropping
+# them at flush would let another worker cache the old row before the commit
+
+def _user_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info['user_cache_stale'] = True
+
+event.listen(User, 'after_update', _user_changed)
+event.listen(User, 'after_delete', _user_changed)
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    if session.info.pop('user_cache_stale', False) and _cache is not None:
+        _cache.invalidate()
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back(session):
+    session.info.pop('user_cache_stale', None)
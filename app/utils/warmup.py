@@ -0,0 +1,115 @@
+import os
+import time
+import logging
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy.orm import configure_mappers
+from sqlalchemy.pool import QueuePool
+from ..extensions import db
+from .file_storage import get_upload_path
+from .tracking_index import get_index
+
+logger = logging.getLogger(__name__)
+
+
+def template_cache_dir(app):
+    """Where compiled templates are kept, shared by all workers and restarts"""
+    return app.config.get('TEMPLATE_CACHE_DIR') or os.path.join(app.instance_path, 'template-cache')
+
+def init_template_cache(app):
+    """Keep compiled templates on disk so a new worker loads instead of compiling them.
+
+    Jinja checks each entry against the template source, so edited
+    templates are compiled again. The cached bytecode is executed, so the
+    directory must belong to this user and be writable by nobody else;
+    otherwise the cache is left off.
+    """
+    directory = template_cache_dir(app)
+    try:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        stat = os.stat(directory)
+    except OSError as e:
+        logger.warning("Template bytecode cache disabled, cannot create %s: %s", directory, e)
+        return
+    if stat.st_uid != os.getuid() or stat.st_mode & 0o022:
+        logger.warning("Template bytecode cache disabled, %s is not private to this user", directory)
+        return
+    # Flask-WTF has created the environment already; the loader reads this on every load
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+def compile_templates(app):
+    """Load every HTML template, returning the number loaded and the names that failed"""
+    env = app.jinja_env
+    loaded, failed = 0, []
+    for name in env.list_templates(filter_func=lambda name: name.endswith('.html')):
+        try:
+            env.get_template(name)
+            loaded += 1
+        except Exception as e:
+            logger.warning("Template %s does not compile: %s", name, e)
+            failed.append(name)
+    return loaded, failed
+
+def prime_pool(count):
+    """Open up to ``count`` pooled connections of the app's engine, returning how many"""
+    pool = db.engine.pool
+    # Only a QueuePool keeps several idle connections around
+    count = min(count, pool.size()) if isinstance(pool, QueuePool) else min(count, 1)
+    connections = []
+    try:
+        for _ in range(count):
+            connections.append(db.engine.connect())
+    finally:
+        # Back into the pool, still open
+        for connection in connections:
+            connection.close()
+    return len(connections)
+
+def warm_up(app):
+    """Do the work the first requests of a new worker would otherwise pay for.
+
+    Compiles the templates (through the bytecode cache), opens DB_POOL_MIN
+    database connections, configures the ORM mappers and resolves the
+    upload folder, and loads the tracking waybill filter when the worker
+    serves tracking. A step that fails is logged and skipped so the worker
+    still starts. Returns the timings in milliseconds and the counts.
+    """
+    report = {}
+    started = time.perf_counter()
+    with app.app_context():
+        step = time.perf_counter()
+        report['templates'], failed = compile_templates(app)
+        report['templates_failed'] = len(failed)
+        report['templates_ms'] = (time.perf_counter() - step) * 1000
+
+        step = time.perf_counter()
+        try:
+            report['connections'] = prime_pool(app.config.get('DB_POOL_MIN', 2))
+        except Exception as e:
+            logger.warning("Could not open database connections during warm-up: %s", e)
+            report['connections'] = 0
+        report['database_ms'] = (time.perf_counter() - step) * 1000
+
+        step = time.perf_counter()
+        try:
+            configure_mappers()
+            get_upload_path()
+        except Exception as e:
+            logger.warning("Lookups failed during warm-up: %s", e)
+        report['lookups_ms'] = (time.perf_counter() - step) * 1000
+
+        step = time.perf_counter()
+        report['waybills'] = 0
+        index = get_index()
+        if index is not None:
+            try:
+                report['waybills'] = index.build()
+            except Exception as e:
+                logger.warning("Could not build the tracking index during warm-up: %s", e)
+        report['tracking_ms'] = (time.perf_counter() - step) * 1000
+    report['total_ms'] = (time.perf_counter() - started) * 1000
+
+    logger.info("Warm-up took %.0f ms: %d templates in %.0f ms, %d database connections in %.0f ms, "
+                "lookups in %.0f ms, %d waybills in %.0f ms", report['total_ms'], report['templates'],
+                report['templates_ms'], report['connections'], report['database_ms'], report['lookups_ms'],
+                report['waybills'], report['tracking_ms'])
+    return report
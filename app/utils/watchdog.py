@@ -0,0 +1,117 @@
+import os
+import sys
+import time
+import logging
+import threading
+import traceback
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Longer statements are cut in the log
+MAX_SQL_CHARS = 2000
+
+# Requests being handled by this process, by thread id
+_active = {}
+_watchdog = None
+_watchdog_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    # Threads do not survive a fork; the worker starts its own watchdog
+    global _watchdog, _watchdog_lock
+    _active.clear()
+    _watchdog = None
+    _watchdog_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def describe_request(thread_id, entry, now=None):
+    """Endpoint, elapsed time, running SQL and stack of a request being handled"""
+    now = now or time.monotonic()
+    lines = [f"{entry['method']} {entry['path']} ({entry['endpoint']}) running for "
+             f"{now - entry['started']:.1f}s in thread {thread_id}"]
+    sql = entry.get('sql')
+    if sql is not None:
+        statement, started = sql
+        lines.append(f"SQL running for {now - started:.1f}s:\n{statement[:MAX_SQL_CHARS]}")
+    frame = sys._current_frames().get(thread_id)
+    if frame is not None:
+        lines.append('Stack (most recent call last):\n' + ''.join(traceback.format_stack(frame)).rstrip())
+    return '\n'.join(lines)
+
+def dump_active_requests(reason):
+    """Log every request in flight, e.g. when gunicorn is about to kill the worker"""
+    for thread_id, entry in list(_active.items()):
+        logger.error("%s: %s", reason, describe_request(thread_id, entry))
+
+
+class Watchdog(threading.Thread):
+    """Logs requests that run longer than ``threshold`` seconds.
+
+    A request is reported once it passes the threshold and again each
+    time another ``threshold`` has passed, so a hung request leaves a few
+    snapshots in the log before the gunicorn timeout kills the worker.
+    """
+    def __init__(self, threshold):
+        super().__init__(name='slow-request-watchdog', daemon=True)
+        self.threshold = threshold
+        self.interval = min(max(threshold / 4, 0.1), 5)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            now = time.monotonic()
+            for thread_id, entry in list(_active.items()):
+                elapsed = now - entry['started']
+                if elapsed >= self.threshold * (entry['reports'] + 1):
+                    entry['reports'] += 1
+                    logger.warning("Slow request: %s", describe_request(thread_id, entry, now))
+
+
+def _start_watchdog(threshold):
+    global _watchdog
+    with _watchdog_lock:
+        if _watchdog is None:
+            _watchdog = Watchdog(threshold)
+            _watchdog.start()
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    entry = _active.get(threading.get_ident())
+    if entry is not None:
+        entry['sql'] = (statement, time.monotonic())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    entry = _active.get(threading.get_ident())
+    if entry is not None:
+        entry['sql'] = None
+
+def init_watchdog(app):
+    """Log stack snapshots of requests slower than SLOW_REQUEST_SECONDS (WATCHDOG_ENABLED)"""
+    if not app.config.get('WATCHDOG_ENABLED', True):
+        return
+    threshold = app.config['SLOW_REQUEST_SECONDS']
+
+    @app.before_request
+    def _watch_request():
+        if _watchdog is None:
+            _start_watchdog(threshold)
+        _active[threading.get_ident()] = {
+            'started': time.monotonic(),
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint or 'unmatched',
+            'sql': None,
+            'reports': 0
+        }
+
+    @app.teardown_request
+    def _unwatch_request(exc):
+        _active.pop(threading.get_ident(), None)
+
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
@@ -0,0 +1,91 @@
+"""Benchmark request throughput with logging at INFO versus DEBUG
+
+Seeds an in-memory SQLite database, then drives the shipment detail, list
+and dashboard pages and the new shipment form through the test client at
+each root level. Records go through the configured formatter into a
+discarded stream, so the numbers include formatting but not disk I/O.
+
+Usage:
+    python -m benchmarks.bench_logging [--shipments 200] [--requests 300] [--format text]
+"""
+
+import argparse
+import io
+import logging
+import time
+
+from app import create_app
+from app.extensions import db
+from app.models.shipment import Shipment
+from app.utils.logging_config import build_logging_config
+from benchmarks.bench_stats import seed
+
+LEVELS = ('INFO', 'DEBUG')
+
+FORM = {
+    'sender_name': 'Sender', 'sender_mobile': '0800000000',
+    'receiver_name': 'Receiver', 'receiver_mobile': '0800000001',
+    'freight': '1000', 'description[]': 'Box', 'value[]': '500',
+    'quantity[]': '1', 'weight[]': '2'
+}
+
+
+def configure(level, fmt):
+    """Apply the app's logging config at ``level``, writing to a discarded stream"""
+    config = build_logging_config(level, fmt=fmt)
+    for handler in config['handlers'].values():
+        handler.clear()
+        handler.update({'class': 'logging.StreamHandler', 'stream': io.StringIO(),
+                        'formatter': 'json' if fmt == 'json' else 'standard'})
+    logging.config.dictConfig(config)
+
+
+def run(client, paths, count):
+    """Send ``count`` requests cycling through ``paths``; returns requests/s"""
+    started = time.perf_counter()
+    for i in range(count):
+        method, path = paths[i % len(paths)]
+        if method == 'POST':
+            client.post(path, data=FORM)
+        else:
+            client.get(path)
+    return count / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--shipments', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--format', choices=('text', 'json'), default='text')
+    args = parser.parse_args()
+
+    app = create_app('testing')
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    with app.app_context():
+        configure('WARNING', args.format)
+        db.create_all()
+        seed(args.shipments)
+        shipment = Shipment.query.first()
+        paths = [
+            ('GET', f'/shipments/view/{shipment.id}'),
+            ('GET', '/shipments/list'),
+            ('GET', '/dashboard'),
+            ('POST', '/shipments/submit')
+        ]
+
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(shipment.created_by)
+
+        print(f"Request throughput over {len(paths)} routes ({args.requests} requests, {args.format} format)")
+        print(f"{'level':<8} {'req/s':>10} {'ms/req':>10}")
+        for level in LEVELS:
+            configure(level, args.format)
+            run(client, paths, len(paths))  # warm up
+            rate = run(client, paths, args.requests)
+            print(f"{level:<8} {rate:>10.1f} {1000 / rate:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""Check that shipment views run a fixed number of SQL statements
+
+Seeds two in-memory SQLite databases, one with few items, creators and
+status changes per shipment and one with many, then requests every view
+that uses a loader profile on both. The statement counts have to match:
+any difference means a relationship is loaded per row or per item.
+
+Every profile has a view here that renders its template (list: shipment
+list, dashboard and profile pages; preview; print), or for tracking the
+payload both tracking views are built from. The testing config makes the profiles raise on a column
+they leave out and the views raise over their @query_budget, so a
+template reading a deferred column fails its view, also where the view
+catches the error and logs it. Exits with status 1 if the counts differ
+or a view fails.
+
+Usage:
+    python -m benchmarks.bench_queries [--shipments 50]
+"""
+
+import argparse
+import logging
+import sys
+import time
+from datetime import datetime, timedelta
+
+from app import create_app
+from app.extensions import db
+from app.models.user import User
+from app.models.shipment import Shipment, ShipmentItem, ShipmentStatusHistory
+from app.utils.query_inspector import track_queries
+from app.utils.tracking_index import get_index
+
+# (items per shipment, creators, status changes per shipment)
+SCALES = {'small': (1, 1, 1), 'large': (25, 10, 5)}
+
+
+def seed(count, items, creators, changes):
+    """Insert ``count`` shipments spread over ``creators`` users"""
+    users = []
+    for i in range(creators):
+        user = User(username=f'bench{i}', name=f'Bench User {i}', is_admin=True, is_superuser=True)
+        user.set_password('bench-password')
+        users.append(user)
+    db.session.add_all(users)
+    db.session.flush()
+
+    now = datetime.now()
+    for i in range(count):
+        user = users[i % creators]
+        shipment = Shipment(
+            waybill_number=f'EX{i + 1:06d}', sender_name='Sender', sender_mobile='0800000000',
+            receiver_name='Receiver', receiver_mobile='0800000001', status='in_transit',
+            created_by=user.id, status_changed_by=users[(i + 1) % creators].id,
+            created_at=now - timedelta(hours=i), qr_code='qr'
+        )
+        shipment.items = [
+            ShipmentItem(description=f'Item {n}', value=100, quantity=1, weight=2)
+            for n in range(items)
+        ]
+        db.session.add(shipment)
+        db.session.flush()
+        for n in range(changes):
+            db.session.add(ShipmentStatusHistory(
+                shipment_id=shipment.id, old_status='pending', new_status='in_transit',
+                changed_by=users[n % creators].id, changed_at=now
+            ))
+    db.session.commit()
+    return users[0], Shipment.query.order_by(Shipment.created_at).first()
+
+
+class ErrorLog(logging.Handler):
+    """Errors the views log, which they answer with an error page instead of a 500"""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def measure(scale, count):
+    """Statement count and latency of each view at ``scale``"""
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        user, shipment = seed(count, *SCALES[scale])
+        paths = {
+            'shipment list': '/shipments/list',
+            'dashboard': '/dashboard',
+            'preview': f'/shipments/view/{shipment.id}',
+            'tracking api': f'/track/api/{shipment.waybill_number}',
+            'tracking cached': f'/track/api/{shipment.waybill_number}',
+            'print form': f'/print_form_template?shipment_id={shipment.id}',
+            'profile': '/profile/',
+            'profile shipments': '/profile/shipments?per_page=50',
+        }
+        user_id = str(user.id)
+
+    results = {}
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = user_id
+    errors = ErrorLog()
+    logging.getLogger().addHandler(errors)
+    try:
+        for name, path in paths.items():
+            client.get(path)  # warm up
+            if name == 'tracking api':
+                # The warm-up answer is cached; measure the loader profile behind it
+                get_index().clear()
+            del errors.messages[:]
+            with track_queries() as log:
+                started = time.perf_counter()
+                response = client.get(path)
+                elapsed = time.perf_counter() - started
+            if response.status_code != 200:
+                raise RuntimeError(f"{path} returned {response.status_code}")
+            if errors.messages:
+                raise RuntimeError(f"{path} logged: {errors.messages[0]}")
+            results[name] = (log.count, elapsed)
+    finally:
+        logging.getLogger().removeHandler(errors)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--shipments', type=int, default=50)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    small = measure('small', args.shipments)
+    large = measure('large', args.shipments)
+
+    print(f"SQL statements per view ({args.shipments} shipments; small/large = {SCALES['small']} / {SCALES['large']} items, creators, changes)")
+    print(f"{'view':<20} {'small':>6} {'large':>6} {'ms small':>9} {'ms large':>9}")
+    failed = False
+    for name in small:
+        (small_count, small_time), (large_count, large_time) = small[name], large[name]
+        flag = '' if small_count == large_count else '  <- grows with the data'
+        failed = failed or bool(flag)
+        print(f"{name:<20} {small_count:>6} {large_count:>6} {small_time * 1000:>9.1f} {large_time * 1000:>9.1f}{flag}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
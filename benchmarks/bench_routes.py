@@ -0,0 +1,213 @@
+"""Benchmark the hot routes against a seeded dataset and compare with a baseline
+
+Builds the synthetic dataset (benchmarks/dataset.py) in an in-memory
+SQLite database, or in a local PostgreSQL database with --database-url,
+then requests each route through the test client. For every route it
+records p50/p95 latency, SQL statements per request and the peak Python
+memory allocated while handling one request.
+
+--save writes the results as a JSON baseline; --compare reads one and
+exits with status 1 when a route got slower than --tolerance allows, runs
+more queries or allocates more memory.
+
+Usage:
+    python -m benchmarks.bench_routes [--size small] [--repeat 30] [--save benchmarks/baseline.json]
+    python -m benchmarks.bench_routes --compare benchmarks/baseline.json
+    python -m benchmarks.bench_routes --database-url postgresql://localhost/sgk_export_bench
+"""
+
+import argparse
+import json
+import logging
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import jwt
+
+from app import create_app
+from app.config import config
+from app.extensions import db
+from app.utils.query_inspector import track_queries
+from app.utils.tracking_index import get_index
+from benchmarks.dataset import SIZES, build_dataset
+
+# name: (path, authentication)
+ROUTES = {
+    'list_shipments': ('/shipments/list', 'session'),
+    'view_shipment': ('/shipments/view/{shipment_id}', 'session'),
+    'dashboard': ('/dashboard', 'session'),
+    'dashboard_data': ('/api/dashboard/data?timeRange=30', 'session'),
+    'api_stats': ('/api/stats', 'token'),
+    'reports': ('/reports', 'session'),
+    'contacts_senders': ('/contacts/senders', 'session'),
+    'contacts_receivers': ('/contacts/receivers', 'session'),
+    'tracking': ('/track/api/{waybill_number}', None),
+    'tracking_cached': ('/track/api/{waybill_number}', None),
+}
+
+# Measured with the tracking answers forgotten before each request, so the
+# database lookup is timed; tracking_cached times the cached answer
+UNCACHED = {'tracking'}
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of ``values``"""
+    ordered = sorted(values)
+    return ordered[max(int(round(fraction * len(ordered))) - 1, 0)]
+
+
+def make_app(database_url):
+    """Testing app, or the production config pointed at a benchmark database"""
+    if database_url is None:
+        config['testing'].QUERY_INSPECTION = False
+        return create_app('testing')
+    if 'bench' not in database_url.rsplit('/', 1)[-1]:
+        sys.exit("Refusing to drop tables in a database whose name does not contain 'bench'")
+    config['production'].SQLALCHEMY_DATABASE_URI = database_url
+    return create_app('production')
+
+
+def measure(client, path, headers, repeat, before=None):
+    """Latencies in ms, median statement count and peak KiB of one request.
+
+    ``before`` runs ahead of every request, outside the measurement.
+    """
+    before = before or (lambda: None)
+    try:
+        before()
+        status = client.get(path, headers=headers).status_code  # warm up
+    except Exception as e:
+        # Testing apps propagate view errors; report the route as broken
+        return {'status': 'error', 'error': f'{type(e).__name__}: {e}'}
+    latencies, counts = [], []
+    for _ in range(repeat):
+        before()
+        with track_queries() as log:
+            started = time.perf_counter()
+            client.get(path, headers=headers)
+            latencies.append((time.perf_counter() - started) * 1000)
+        counts.append(log.count)
+
+    before()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    client.get(path, headers=headers)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'status': status,
+        'p50_ms': round(percentile(latencies, 0.5), 2),
+        'p95_ms': round(percentile(latencies, 0.95), 2),
+        'queries': int(statistics.median(counts)),
+        'peak_kib': round(peak / 1024, 1)
+    }
+
+
+def run(args):
+    app = make_app(args.database_url)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        started = time.perf_counter()
+        info = build_dataset(shipments=args.shipments or SIZES[args.size], seed=args.seed)
+        seeded = time.perf_counter() - started
+        token = jwt.encode({'user_id': str(info['admin_id']), 'exp': datetime.utcnow() + timedelta(hours=1)},
+                           app.config['SECRET_KEY'], algorithm='HS256')
+        database = db.engine.dialect.name
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(info['admin_id'])
+
+    results = {}
+    for name, (path, auth) in ROUTES.items():
+        headers = {'Authorization': f'Bearer {token}'} if auth == 'token' else {}
+        before = get_index().clear if name in UNCACHED and get_index() is not None else None
+        results[name] = measure(client, path.format(**info), headers, args.repeat, before)
+
+    return {
+        'meta': {
+            'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'database': database,
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'dataset': {key: info[key] for key in ('shipments', 'items', 'status_changes')},
+            'seed_seconds': round(seeded, 1)
+        },
+        'routes': results
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Regressions of ``results`` against ``baseline``, one message each"""
+    problems = []
+    for name, current in results['routes'].items():
+        before = baseline['routes'].get(name)
+        if before is None:
+            continue
+        if current['status'] != before['status']:
+            problems.append(f"{name}: status {before['status']} -> {current['status']}")
+        if 'error' in (current['status'], before['status']):
+            continue
+        if current['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            problems.append(f"{name}: p95 {before['p95_ms']} -> {current['p95_ms']} ms")
+        if current['queries'] > before['queries']:
+            problems.append(f"{name}: queries {before['queries']} -> {current['queries']}")
+        if current['peak_kib'] > before['peak_kib'] * (1 + tolerance):
+            problems.append(f"{name}: peak memory {before['peak_kib']} -> {current['peak_kib']} KiB")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', choices=SIZES, default='small')
+    parser.add_argument('--shipments', type=int, default=None, help='Overrides --size')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument('--database-url', default=None,
+                        help="PostgreSQL database to use instead of SQLite; its tables are dropped")
+    parser.add_argument('--save', metavar='PATH', help='Write the results as a baseline')
+    parser.add_argument('--compare', metavar='PATH', help='Baseline to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed relative increase of p95 latency and peak memory')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    results = run(args)
+    meta = results['meta']
+    print(f"{meta['dataset']['shipments']} shipments, {meta['dataset']['items']} items, "
+          f"{meta['dataset']['status_changes']} status changes on {meta['database']} "
+          f"(seeded in {meta['seed_seconds']}s), {args.repeat} requests per route")
+    print(f"{'route':<20} {'status':>6} {'p50 ms':>8} {'p95 ms':>8} {'queries':>8} {'peak KiB':>9}")
+    for name, row in results['routes'].items():
+        if row['status'] == 'error':
+            print(f"{name:<20} {'error':>6}  {row['error']}")
+            continue
+        print(f"{name:<20} {row['status']:>6} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} "
+              f"{row['queries']:>8} {row['peak_kib']:>9.1f}")
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline written to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline['meta']['dataset'] != meta['dataset']:
+            print("Warning: the baseline was taken on a different dataset")
+        problems = compare(results, baseline, args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION {problem}")
+        if problems:
+            sys.exit(1)
+        print(f"No regressions against {args.compare}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""Measure import and create_app time, and catch heavy imports creeping back
+
+Runs ``python -X importtime`` in a fresh interpreter a few times for each
+mode and reports the median time spent importing the app, the time
+create_app takes and the slowest imports made by the app package:
+
+    script  create_app(blueprints=()), what check_shipments.py and the
+            migration scripts use
+    full    create_app() with every blueprint, what gunicorn serves
+
+Interpreter start-up (site, .pth files) is left out. Each mode also lists
+modules it must not load; importing one of them fails the run. --save
+writes the medians as a JSON baseline and --compare exits with status 1
+when a mode got slower than --tolerance allows.
+
+Usage:
+    python -m benchmarks.bench_startup [--repeat 5] [--save benchmarks/startup.json]
+    python -m benchmarks.bench_startup --compare benchmarks/startup.json
+    python -m benchmarks.bench_startup --max-ms script=400,full=900
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# mode: (create_app arguments, modules that must stay unimported)
+MODES = {
+    'script': ("'testing', blueprints=()", ('PIL', 'qrcode', 'alembic', 'flask_migrate', 'jwt', 'app.routes',
+                                            'app.commands', 'app.utils.metrics', 'cProfile')),
+    'full': ("'testing'", ('PIL', 'qrcode')),
+}
+
+MARKER = 'bench-startup:'
+_IMPORT_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+PROGRAM = '''
+import sys, time, json
+sys.stderr.write({marker!r} + "\\n")
+started = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+create_app({arguments})
+created = time.perf_counter()
+print({marker!r} + json.dumps({{
+    "import_ms": (imported - started) * 1000,
+    "create_ms": (created - imported) * 1000,
+    "loaded": [name for name in {forbidden!r} if name in sys.modules]
+}}))
+'''
+
+
+def run_once(mode):
+    arguments, forbidden = MODES[mode]
+    program = PROGRAM.format(marker=MARKER, arguments=arguments, forbidden=forbidden)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', program], cwd=ROOT,
+                            capture_output=True, text=True)
+    lines = [line for line in result.stdout.splitlines() if line.startswith(MARKER)]
+    if result.returncode or not lines:
+        sys.exit(f"{mode}: the interpreter failed\n{result.stderr[-2000:]}")
+    measured = json.loads(lines[-1][len(MARKER):])
+
+    # Imports after the marker, down to what the app package imports itself
+    stderr = result.stderr.split(MARKER, 1)[1]
+    top = []
+    for match in _IMPORT_LINE.finditer(stderr):
+        if len(match.group(3)) <= 3 and match.group(4) != 'app':
+            top.append((int(match.group(2)) / 1000, match.group(4)))
+    measured['top'] = sorted(top, reverse=True)[:8]
+    return measured
+
+def measure(mode, repeat):
+    runs = [run_once(mode) for _ in range(repeat)]
+    return {
+        'import_ms': round(statistics.median(run['import_ms'] for run in runs), 1),
+        'create_ms': round(statistics.median(run['create_ms'] for run in runs), 1),
+        'total_ms': round(statistics.median(run['import_ms'] + run['create_ms'] for run in runs), 1),
+        'loaded': sorted({name for run in runs for name in run['loaded']}),
+        'top': runs[-1]['top']
+    }
+
+def parse_limits(value):
+    limits = {}
+    for part in value.split(','):
+        mode, _, limit = part.partition('=')
+        if mode not in MODES:
+            raise argparse.ArgumentTypeError(f"unknown mode {mode!r}")
+        limits[mode] = float(limit)
+    return limits
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--save', metavar='PATH', help='Write the results as a baseline')
+    parser.add_argument('--compare', metavar='PATH', help='Baseline to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed relative increase of the total time')
+    parser.add_argument('--max-ms', type=parse_limits, default={},
+                        help='Absolute limits on the total time, e.g. script=400,full=900')
+    args = parser.parse_args()
+
+    results = {mode: measure(mode, args.repeat) for mode in MODES}
+    problems = []
+    print(f"{'mode':<8} {'import ms':>10} {'create ms':>10} {'total ms':>9}")
+    for mode, row in results.items():
+        print(f"{mode:<8} {row['import_ms']:>10.1f} {row['create_ms']:>10.1f} {row['total_ms']:>9.1f}")
+        for ms, name in row['top']:
+            print(f"    {ms:>8.1f} ms  {name}")
+        if row['loaded']:
+            problems.append(f"{mode}: imports {', '.join(row['loaded'])}")
+        if mode in args.max_ms and row['total_ms'] > args.max_ms[mode]:
+            problems.append(f"{mode}: {row['total_ms']} ms, limit {args.max_ms[mode]} ms")
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({mode: {key: row[key] for key in ('import_ms', 'create_ms', 'total_ms')}
+                       for mode, row in results.items()}, f, indent=2)
+        print(f"Baseline written to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        for mode, row in results.items():
+            before = baseline.get(mode)
+            if before and row['total_ms'] > before['total_ms'] * (1 + args.tolerance):
+                problems.append(f"{mode}: {before['total_ms']} -> {row['total_ms']} ms")
+
+    for problem in problems:
+        print(f"REGRESSION {problem}")
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""Benchmark the dashboard statistics: legacy per-metric scans vs the current path
+
+Seeds an in-memory SQLite database and reports the number of SQL statements
+and the mean latency of building the dashboard numbers three ways: the
+separate scans the dashboard used to issue, one collect_stats pass over
+every period (the shape the reports and the stats API use), and
+monthly_overview, which the dashboard calls: the open month live, closed
+months read from period_stats. Each variant runs once before it is
+measured, so the closed months are memoized by then.
+
+Usage:
+    python -m benchmarks.bench_stats [--shipments 20000] [--repeat 20]
+"""
+
+import argparse
+import logging
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, func, case
+
+from app import create_app
+from app.extensions import db
+from app.models.user import User
+from app.models.shipment import Shipment
+from app.utils.stats import collect_stats, monthly_overview, time_bucket
+
+
+def seed(count, seed_value=42):
+    """Insert ``count`` shipments spread over the last two years"""
+    rnd = random.Random(seed_value)
+    user = User(username='bench', name='Bench User')
+    user.set_password('bench-password')
+    db.session.add(user)
+    db.session.flush()
+
+    now = datetime.now()
+    rows = [{
+        'waybill_number': f'EX{i + 1:06d}',
+        'sender_name': 'Sender',
+        'sender_mobile': '0800000000',
+        'receiver_name': 'Receiver',
+        'receiver_mobile': '0800000001',
+        'total': round(rnd.uniform(1000, 50000), 2),
+        'status': rnd.choice(Shipment.VALID_STATUSES),
+        'customer_group': rnd.choice(['regular', 'corporate', 'vip']),
+        'created_by': user.id,
+        'created_at': now - timedelta(minutes=rnd.randint(0, 60 * 24 * 730))
+    } for i in range(count)]
+    db.session.bulk_insert_mappings(Shipment, rows)
+    db.session.commit()
+
+
+def legacy_dashboard_stats():
+    """The separate scans the dashboard used to issue"""
+    now = datetime.now()
+    current_month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    previous_month_start = (current_month_start - timedelta(days=1)).replace(day=1)
+    columns = (
+        func.count(Shipment.id),
+        func.sum(Shipment.total),
+        func.count(case((Shipment.status.in_(['processing', 'in_transit']), 1))),
+        func.count(case((Shipment.status == 'delivered', 1)))
+    )
+    db.session.query(*columns).filter(Shipment.created_at >= current_month_start).first()
+    db.session.query(*columns).filter(
+        Shipment.created_at.between(previous_month_start, current_month_start)
+    ).first()
+    db.session.query(Shipment.status, func.count(Shipment.id)).filter(
+        Shipment.created_at >= current_month_start
+    ).group_by(Shipment.status).all()
+    # date_trunc is PostgreSQL only; the portable bucket stands in for it here
+    month = time_bucket('month', Shipment.created_at).label('month')
+    db.session.query(month, func.count(Shipment.id), func.sum(Shipment.total)).filter(
+        Shipment.created_at.between(now - timedelta(days=180), now)
+    ).group_by(month).order_by(month).all()
+
+
+def single_pass_stats():
+    now = datetime.now()
+    current_month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    previous_month_start = (current_month_start - timedelta(days=1)).replace(day=1)
+    collect_stats(
+        {
+            'current': (current_month_start, None),
+            'previous': (previous_month_start, current_month_start)
+        },
+        trend=('month', now - timedelta(days=180), None)
+    )
+
+
+def dashboard_stats():
+    monthly_overview(months=6)
+
+
+def measure(fn, repeat):
+    statements = []
+
+    def count_statement(*args, **kwargs):
+        statements.append(1)
+
+    fn()  # warm up
+    event.listen(db.engine, 'before_cursor_execute', count_statement)
+    try:
+        fn()
+        queries = len(statements)
+        started = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        elapsed = (time.perf_counter() - started) / repeat
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count_statement)
+    return queries, elapsed * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--shipments', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    app = create_app('testing')
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with app.app_context():
+        db.create_all()
+        seed(args.shipments)
+
+        print(f"Dashboard statistics over {args.shipments} shipments ({args.repeat} runs)")
+        print(f"{'variant':<14} {'queries':>8} {'mean ms':>10}")
+        variants = (
+            ('legacy', legacy_dashboard_stats),
+            ('single-pass', single_pass_stats),
+            ('dashboard', dashboard_stats)
+        )
+        for name, fn in variants:
+            queries, mean_ms = measure(fn, args.repeat)
+            print(f"{name:<14} {queries:>8} {mean_ms:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
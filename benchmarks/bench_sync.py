@@ -0,0 +1,88 @@
+"""Walk the delta sync feed and check that deletions reach offline clients
+
+Seeds an in-memory SQLite database, pages through the whole feed the way
+delta-sync.js does and reports the pages, statements and time it took.
+Then deletes an item and a status change, archives a shipment, and reads
+the feed again from the cursor: each of them has to come back in
+'deleted' under the id the client stores it by. Exits with status 1 if
+one does not.
+
+Usage:
+    python -m benchmarks.bench_sync [--shipments 200] [--limit 100]
+"""
+
+import argparse
+import logging
+import sys
+import time
+
+from app import create_app
+from app.extensions import db
+from app.models.shipment import Shipment
+from app.utils.archive import archive_batch
+from app.utils.query_inspector import track_queries
+from benchmarks.bench_queries import SCALES, seed
+
+
+def walk(client, cursor, limit):
+    """Pages of the feed after ``cursor`` until has_more is false"""
+    pages = []
+    while True:
+        query = f'?limit={limit}' + (f'&since={cursor}' if cursor else '')
+        response = client.get(f'/api/shipments/changes{query}')
+        if response.status_code != 200:
+            raise RuntimeError(f"Changes feed returned {response.status_code}")
+        page = response.get_json()
+        pages.append(page)
+        cursor = page['cursor']
+        if not page['has_more']:
+            return pages, cursor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--shipments', type=int, default=200)
+    parser.add_argument('--limit', type=int, default=100)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    app = create_app('testing')
+    # Rows written a moment ago are part of the page here
+    app.config['SYNC_SETTLE_SECONDS'] = 0
+    app.config['QUERY_INSPECTION'] = False
+    with app.app_context():
+        db.create_all()
+        user, _ = seed(args.shipments, *SCALES['large'])
+        user_id = str(user.id)
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = user_id
+
+    with track_queries() as log:
+        started = time.perf_counter()
+        pages, cursor = walk(client, None, args.limit)
+        elapsed = time.perf_counter() - started
+    rows = sum(len(page[key]) for page in pages for key in ('shipments', 'items', 'status_history'))
+    print(f"Snapshot of {args.shipments} shipments: {rows} rows in {len(pages)} pages, "
+          f"{log.count} statements, {elapsed * 1000:.1f} ms")
+
+    with app.app_context():
+        shipments = Shipment.query.order_by(Shipment.created_at).limit(2).all()
+        item, change = shipments[0].items[0], shipments[0].status_history[0]
+        expected = {('item', str(item.id)), ('status_history', str(change.id)), ('shipment', str(shipments[1].id))}
+        db.session.delete(item)
+        db.session.delete(change)
+        archive_batch([shipments[1].id])
+        db.session.commit()
+
+    pages, _ = walk(client, cursor, args.limit)
+    deleted = {(tombstone['type'], tombstone['id']) for page in pages for tombstone in page['deleted']}
+    missing = expected - deleted
+    for entity, entity_id in sorted(expected):
+        print(f"{entity:<16} {entity_id}  {'missing' if (entity, entity_id) in missing else 'deleted'}")
+    sys.exit(1 if missing else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""Compare throughput of the gunicorn worker classes under the same load
+
+Seeds a database (a SQLite file by default, or a local PostgreSQL database
+with --database-url), checks that concurrent requests each get their own
+SQLAlchemy session and connection, then starts gunicorn with
+gunicorn.conf.py once per worker class and replays the load_test mix
+against it for --duration seconds.
+
+gevent is only run when it is installed. Uploaded images go to a temporary
+folder, never to app/uploads.
+
+Usage:
+    python -m benchmarks.bench_workers [--classes sync,gthread,gevent] [--workers 2] [--threads 4]
+    python -m benchmarks.bench_workers --database-url postgresql://localhost/sgk_export_bench --concurrency 32
+"""
+
+import argparse
+import importlib.util
+import logging
+import os
+import secrets
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+from sqlalchemy import text
+
+from app import create_app
+from app.config import config
+from app.extensions import db
+from app.utils.seed import seed_database
+from benchmarks import load_test
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def check_sessions(app, threads=8, rounds=20):
+    """Problems found running ``threads`` request contexts at once.
+
+    Within a round every thread must hold a different session and
+    database connection, and no session may be left behind afterwards.
+    """
+    problems = []
+    held = [[] for _ in range(rounds)]
+    barrier = threading.Barrier(threads)
+    lock = threading.Lock()
+
+    def handle_requests():
+        for number in range(rounds):
+            with app.test_request_context('/'):
+                session = db.session()
+                session.execute(text('SELECT 1'))
+                connection = session.connection().connection.dbapi_connection
+                with lock:
+                    held[number].append((id(session), id(connection)))
+                # Everybody holds their session at this point
+                barrier.wait()
+            barrier.wait()
+
+    workers = [threading.Thread(target=handle_requests) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    for number, pairs in enumerate(held):
+        if len({session for session, _ in pairs}) != threads:
+            problems.append(f"round {number}: concurrent requests shared a session")
+        if len({connection for _, connection in pairs}) != threads:
+            problems.append(f"round {number}: concurrent requests shared a connection")
+    leftover = len(db.session.registry.registry)
+    if leftover:
+        problems.append(f"{leftover} sessions were not removed at teardown")
+    return problems
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_gunicorn(worker_class, args, env):
+    port = free_port()
+    env = dict(env, GUNICORN_WORKER_CLASS=worker_class, GUNICORN_WORKERS=str(args.workers),
+               GUNICORN_THREADS=str(args.threads), GUNICORN_LOG_LEVEL='warning')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}', 'wsgi:app'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"gunicorn with {worker_class} workers exited with status {process.returncode}")
+        try:
+            requests.get(url + '/login', timeout=1)
+            return process, url
+        except requests.RequestException:
+            time.sleep(0.5)
+    process.kill()
+    sys.exit(f"gunicorn with {worker_class} workers did not start")
+
+def stop_gunicorn(process):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--classes', default='sync,gthread,gevent', help='Worker classes to compare')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4, help='Threads per gthread worker')
+    parser.add_argument('--concurrency', type=int, default=16, help='Virtual users')
+    parser.add_argument('--duration', type=float, default=20, help='Seconds per worker class')
+    parser.add_argument('--shipments', type=int, default=5000)
+    parser.add_argument('--mix', type=load_test.parse_mix, default=load_test.DEFAULT_MIX)
+    parser.add_argument('--database-url', default=None,
+                        help="PostgreSQL database to use instead of SQLite; its tables are dropped")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    workdir = tempfile.mkdtemp(prefix='sgk_export-bench-')
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.sqlite')}"
+    if args.database_url and 'bench' not in database_url.rsplit('/', 1)[-1]:
+        sys.exit("Refusing to drop tables in a database whose name does not contain 'bench'")
+    env = dict(os.environ, FLASK_ENV='production', DATABASE_URL=database_url,
+               SECRET_KEY=os.environ.get('SECRET_KEY') or secrets.token_hex(32),
+               USE_NAS_STORAGE='true', NAS_UPLOAD_FOLDER=os.path.join(workdir, 'uploads'),
+               METRICS_DIR=os.path.join(workdir, 'metrics'),
+               # Every virtual user comes from 127.0.0.1
+               RATE_LIMIT_ENABLED='false')
+    os.environ.update(env)
+
+    production = config['production']
+    production.SQLALCHEMY_DATABASE_URI = database_url
+    production.SECRET_KEY = env['SECRET_KEY']
+    if database_url.startswith('sqlite'):
+        production.SQLALCHEMY_ENGINE_OPTIONS = {}
+    app = create_app('production')
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed_database(args.shipments, processes=1, image_ratio=0)
+    problems = check_sessions(app, threads=max(args.threads, 2))
+    for problem in problems:
+        print(f"SESSION PROBLEM {problem}")
+    print(f"Sessions: {'shared between requests' if problems else 'one per request context, removed at teardown'}")
+
+    accounts, targets, secret_key = load_test.load_targets(app, 5, 5000)
+    tokens = load_test.api_tokens(accounts, secret_key)
+
+    rows = []
+    for worker_class in args.classes.split(','):
+        if worker_class == 'gevent' and importlib.util.find_spec('gevent') is None:
+            print("Skipping gevent: not installed")
+            continue
+        process, url = start_gunicorn(worker_class, args, env)
+        try:
+            flows, elapsed = load_test.run(url, accounts, tokens, targets, args.concurrency,
+                                           args.duration, args.mix)
+        finally:
+            stop_gunicorn(process)
+        rows.append((worker_class, flows, elapsed))
+
+    threads = {'sync': 1, 'gthread': args.threads}
+    print(f"{args.concurrency} virtual users, {args.duration:.0f}s per class, "
+          f"{args.workers} workers, {database_url.split(':')[0]}")
+    print(f"{'class':<10} {'threads':>7} {'flows/s':>8} {'errors':>7} " +
+          ' '.join(f'{flow[:12] + " p95":>16}' for flow in args.mix))
+    for worker_class, flows, elapsed in rows:
+        total = sum(row['requests'] for row in flows.values())
+        errors = sum(row['error_count'] for row in flows.values())
+        p95 = [flows.get(flow, {}).get('p95_ms') for flow in args.mix]
+        print(f"{worker_class:<10} {threads.get(worker_class, '-'):>7} {total / elapsed:>8.1f} "
+              f"{errors / total if total else 0:>7.1%} " +
+              ' '.join(f'{value:>16.1f}' if value is not None else f'{"-":>16}' for value in p95))
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+"""Seeded synthetic dataset for the benchmarks
+
+The rows come from app.utils.seed, the generator behind ``flask seed``:
+users, shipments with items and status histories that follow the allowed
+transitions, spread over two years, with senders and receivers drawn from
+a pool so contacts repeat and customer groups are skewed. The same seed
+and size always give the same rows, so runs can be compared.
+
+Usage:
+    from benchmarks.dataset import build_dataset
+    info = build_dataset(shipments=2000, seed=42)
+"""
+
+from datetime import datetime
+
+from app.utils.seed import seed_database
+
+SIZES = {'small': 500, 'medium': 5000, 'large': 50000}
+
+
+def build_dataset(shipments=1000, users=5, seed=42, max_items=5, now=None):
+    """Insert the dataset into the current app's database.
+
+    Generated in this process and without image files, so the benchmark
+    only measures the routes. Returns the ids the benchmarks need: the
+    admin user, a shipment with items and history, and its waybill number.
+    """
+    return seed_database(shipments, users=users, seed=seed, max_items=max_items, image_ratio=0.3,
+                         end=now or datetime(2025, 1, 1), processes=1)
@@ -0,0 +1,344 @@
+"""Replay a weighted mix of production flows against a running server
+
+Virtual users log in through the login form as the users created by
+``flask seed`` and, for the api blueprint, carry a JWT signed with the
+app's SECRET_KEY the way the API clients do. Each one then loops over
+weighted flows until --duration has passed:
+
+    create_shipment  new shipment form, then a multipart submit with item images
+    update_status    moves a known shipment along STATUS_TRANSITIONS
+    dashboard        polls /api/dashboard/data and the JWT /api/stats
+    tracking         anonymous /track/api lookups, some of unknown waybills
+    contacts         pages through the sender, receiver and all contact lists
+
+Waybills and shipments to work on, user ids and the secret key are read
+through the app with the same environment (FLASK_ENV, DATABASE_URL,
+SECRET_KEY) as the server, so run it on the same host against a local
+gunicorn. Only the server is contacted.
+
+For every flow it reports throughput, p50/p95/p99 latency of a whole flow
+and the error rate with the most common errors; --save writes the same
+as JSON. The exit status is 1 when more than --max-error-rate of the flows
+failed.
+
+Usage:
+    flask seed --shipments 100000 --yes
+    gunicorn -c gunicorn.conf.py wsgi:app &
+    python -m benchmarks.load_test --url http://127.0.0.1:8000 --concurrency 20 --duration 60
+    python -m benchmarks.load_test --mix tracking=10,dashboard=1 --save /tmp/load.json
+"""
+
+import argparse
+import json
+import logging
+import random
+import re
+import statistics
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+import jwt
+import requests
+
+from app import create_app
+from app.extensions import db
+from app.models.shipment import Shipment
+from app.models.user import User
+from app.utils.seed import ITEMS, SEED_PASSWORD, placeholder_images
+
+# Relative weights of the flows, overridden with --mix
+DEFAULT_MIX = {'create_shipment': 1, 'update_status': 2, 'dashboard': 4, 'tracking': 6, 'contacts': 2}
+
+# Share of tracking lookups for waybills that do not exist
+UNKNOWN_WAYBILL_RATIO = 0.1
+
+_CSRF = re.compile(r'name="csrf_token" value="([^"]+)"|name="csrf-token" content="([^"]+)"')
+_IDEMPOTENCY_KEY = re.compile(r'name="idempotency_key" value="([^"]+)"')
+
+
+class FlowError(Exception):
+    """A request of a flow got an unexpected answer"""
+
+
+class Targets:
+    """Shipments the virtual users work on, shared between their threads"""
+    def __init__(self, waybills, active):
+        self.waybills = waybills
+        # id -> status of shipments that can still change status
+        self.active = active
+        self.lock = threading.Lock()
+
+    def claim(self, rnd):
+        """A shipment and the next status to move it to, or None"""
+        with self.lock:
+            if not self.active:
+                return None
+            shipment_id = rnd.choice(list(self.active))
+            status = self.active[shipment_id]
+            new_status = rnd.choice(Shipment.STATUS_TRANSITIONS[status])
+            if Shipment.STATUS_TRANSITIONS[new_status]:
+                self.active[shipment_id] = new_status
+            else:
+                del self.active[shipment_id]
+            return shipment_id, new_status
+
+
+def load_targets(app, users, limit):
+    """Credentials of the seed users, waybills and shipments that can still move"""
+    with app.app_context():
+        accounts = db.session.execute(
+            db.select(User.id, User.username).where(User.username.like('seed%'))
+            .order_by(User.username).limit(users)).all()
+        if not accounts:
+            sys.exit("No seed users found; run `flask seed` against this database first")
+        open_statuses = [status for status, after in Shipment.STATUS_TRANSITIONS.items() if after]
+        rows = db.session.execute(
+            db.select(Shipment.id, Shipment.waybill_number, Shipment.status)
+            .order_by(Shipment.created_at.desc()).limit(limit)).all()
+        waybills = [row.waybill_number for row in rows]
+        active = {str(row.id): row.status for row in rows if row.status in open_statuses}
+        secret_key = app.config['SECRET_KEY']
+    return [(str(user_id), username) for user_id, username in accounts], Targets(waybills, active), secret_key
+
+
+class VirtualUser(threading.Thread):
+    """One logged in browser session plus an API token, running flows in a loop"""
+    def __init__(self, number, base_url, account, token, targets, mix, deadline, think, timeout, results):
+        super().__init__(name=f'virtual-user-{number}', daemon=True)
+        self.base_url = base_url.rstrip('/')
+        self.username = account[1]
+        self.token = token
+        self.targets = targets
+        self.flows, self.weights = zip(*mix.items())
+        self.deadline = deadline
+        self.think = think
+        self.timeout = timeout
+        self.results = results
+        self.rnd = random.Random(number)
+        self.session = requests.Session()
+        # Tracking is public and looked up without the login cookie
+        self.anonymous = requests.Session()
+        self.csrf_token = None
+        self.images = placeholder_images()
+
+    def request(self, method, path, expect=(200,), session=None, route=None, **kwargs):
+        """Send a request, raising FlowError unless its status is in ``expect``.
+
+        Errors are reported under ``route`` (the path without query string
+        by default), so lookups of different shipments add up.
+        """
+        kwargs.setdefault('allow_redirects', False)
+        kwargs.setdefault('timeout', self.timeout)
+        response = (session or self.session).request(method, self.base_url + path, **kwargs)
+        if response.status_code not in expect:
+            raise FlowError(f'{method} {route or path.split("?")[0]}: {response.status_code}')
+        return response
+
+    def _csrf(self, html):
+        match = _CSRF.search(html)
+        if match:
+            self.csrf_token = match.group(1) or match.group(2)
+        return self.csrf_token
+
+    def login(self):
+        page = self.request('GET', '/login')
+        response = self.request('POST', '/login', expect=(302,), data={
+            'username': self.username, 'password': SEED_PASSWORD, 'csrf_token': self._csrf(page.text)
+        })
+        if not response.headers.get('Location', '').endswith('/dashboard'):
+            raise FlowError(f'login as {self.username} failed')
+
+    def create_shipment(self):
+        page = self.request('GET', '/shipments/new')
+        key = _IDEMPOTENCY_KEY.search(page.text)
+        count = self.rnd.randint(1, 3)
+        descriptions = [self.rnd.choice(ITEMS) for _ in range(count)]
+        number = self.rnd.randint(1, 10 ** 6)
+        data = {
+            'csrf_token': self._csrf(page.text),
+            'idempotency_key': key.group(1) if key else str(uuid.uuid4()),
+            'sender_name': f'Load Sender {number % 500}', 'sender_email': f'load{number % 500}@example.com',
+            'sender_mobile': '08000000000', 'sender_address': '1 Market Road, Lagos',
+            'receiver_name': f'Load Receiver {number}', 'receiver_email': f'receiver{number}@example.com',
+            'receiver_mobile': '07000000000', 'receiver_address': '10 High Street, London',
+            'destination_address': '10 High Street, London', 'destination_country': 'United Kingdom',
+            'freight': self.rnd.randint(5000, 80000), 'additional': self.rnd.randint(0, 5000),
+            'customer_group': 'regular',
+            'description[]': descriptions,
+            'value[]': [self.rnd.randint(1000, 200000) for _ in descriptions],
+            'quantity[]': [self.rnd.randint(1, 10) for _ in descriptions],
+            'weight[]': [self.rnd.randint(1, 30) for _ in descriptions]
+        }
+        files = [('item_image[]', (f'{description.lower().replace(" ", "_")}.png', self.images[description], 'image/png'))
+                 for description in descriptions]
+        self.request('POST', '/shipments/submit', expect=(302,), data=data, files=files)
+
+    def update_status(self):
+        claimed = self.targets.claim(self.rnd)
+        if claimed is None:
+            raise FlowError('no shipment left to update')
+        shipment_id, status = claimed
+        self.request('POST', f'/shipments/{shipment_id}/status', expect=(302,), route='/shipments/<id>/status',
+                     data={'status': status, 'csrf_token': self.csrf_token},
+                     headers={'X-CSRF-TOKEN': self.csrf_token or ''})
+
+    def dashboard(self):
+        self.request('GET', f'/api/dashboard/data?timeRange={self.rnd.choice((7, 30, 90))}')
+        self.request('GET', '/api/stats', headers={'Authorization': f'Bearer {self.token}'})
+
+    def tracking(self):
+        if not self.targets.waybills or self.rnd.random() < UNKNOWN_WAYBILL_RATIO:
+            self.request('GET', f'/track/api/ZZ{self.rnd.randint(0, 999999):06d}', expect=(404,),
+                         session=self.anonymous, route='/track/api/<unknown>')
+        else:
+            self.request('GET', f'/track/api/{self.rnd.choice(self.targets.waybills)}',
+                         session=self.anonymous, route='/track/api/<waybill>')
+
+    def contacts(self):
+        kind = self.rnd.choice(('senders', 'receivers', 'all'))
+        for page in range(1, self.rnd.randint(1, 3) + 1):
+            self.request('GET', f'/contacts/{kind}?page={page}')
+
+    def run(self):
+        try:
+            self.login()
+        except (FlowError, requests.RequestException) as e:
+            self.results.record('login', 0, f'{type(e).__name__}: {e}')
+            return
+        while time.monotonic() < self.deadline:
+            flow = self.rnd.choices(self.flows, self.weights)[0]
+            started = time.perf_counter()
+            error = None
+            try:
+                getattr(self, flow)()
+            except FlowError as e:
+                error = str(e)
+            except requests.RequestException as e:
+                error = type(e).__name__
+            self.results.record(flow, time.perf_counter() - started, error)
+            if self.think:
+                time.sleep(self.rnd.uniform(0, 2 * self.think))
+
+
+class Results:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(Counter)
+
+    def record(self, flow, seconds, error=None):
+        with self.lock:
+            if error is None:
+                self.latencies[flow].append(seconds * 1000)
+            else:
+                self.errors[flow][error] += 1
+
+    def summary(self, elapsed):
+        flows = {}
+        for flow in sorted(set(self.latencies) | set(self.errors)):
+            latencies = sorted(self.latencies[flow])
+            errors = sum(self.errors[flow].values())
+            total = len(latencies) + errors
+            flows[flow] = {
+                'requests': total,
+                'per_second': round(total / elapsed, 2),
+                'error_rate': round(errors / total, 4),
+                'p50_ms': round(percentile(latencies, 0.5), 1) if latencies else None,
+                'p95_ms': round(percentile(latencies, 0.95), 1) if latencies else None,
+                'p99_ms': round(percentile(latencies, 0.99), 1) if latencies else None,
+                'mean_ms': round(statistics.fmean(latencies), 1) if latencies else None,
+                'errors': dict(self.errors[flow].most_common(5)),
+                'error_count': errors
+            }
+        return flows
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of sorted ``values``"""
+    return values[max(int(round(fraction * len(values))) - 1, 0)]
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        flow, _, weight = part.partition('=')
+        if flow not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown flow {flow!r}, expected one of {', '.join(DEFAULT_MIX)}")
+        mix[flow] = float(weight or 1)
+    return mix
+
+
+def run(url, accounts, tokens, targets, concurrency, duration, mix=DEFAULT_MIX, think=0, timeout=30):
+    """Run ``concurrency`` virtual users for ``duration`` seconds; per flow results and elapsed seconds"""
+    results = Results()
+    started = time.monotonic()
+    deadline = started + duration
+    users = []
+    for number in range(concurrency):
+        account = accounts[number % len(accounts)]
+        users.append(VirtualUser(number, url, account, tokens[account[0]], targets, mix,
+                                 deadline, think, timeout, results))
+    for user in users:
+        user.start()
+    for user in users:
+        user.join()
+    elapsed = time.monotonic() - started
+    return results.summary(elapsed), elapsed
+
+def api_tokens(accounts, secret_key, hours=12):
+    """A JWT for the api blueprint per seed user, as the API clients send them"""
+    return {user_id: jwt.encode({'user_id': user_id, 'exp': datetime.utcnow() + timedelta(hours=hours)},
+                                secret_key, algorithm='HS256')
+            for user_id, _ in accounts}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help='Server to load')
+    parser.add_argument('--concurrency', type=int, default=10, help='Virtual users')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds to run')
+    parser.add_argument('--think', type=float, default=0, help='Mean pause between flows, in seconds')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help='Flow weights, e.g. tracking=6,dashboard=4 (flows left out do not run)')
+    parser.add_argument('--users', type=int, default=5, help='Seed users to log in as, round robin')
+    parser.add_argument('--targets', type=int, default=5000, help='Recent shipments to track and update')
+    parser.add_argument('--timeout', type=float, default=30, help='Per request timeout in seconds')
+    parser.add_argument('--max-error-rate', type=float, default=0.01,
+                        help='Exit with status 1 above this share of failed flows')
+    parser.add_argument('--save', metavar='PATH', help='Write the results as JSON')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    accounts, targets, secret_key = load_targets(create_app(), args.users, args.targets)
+    flows, elapsed = run(args.url, accounts, api_tokens(accounts, secret_key), targets, args.concurrency,
+                         args.duration, args.mix, args.think, args.timeout)
+
+    total = sum(row['requests'] for row in flows.values())
+    errors = sum(row['error_count'] for row in flows.values())
+    print(f"{args.concurrency} virtual users against {args.url} for {elapsed:.0f}s: "
+          f"{total} flows, {total / elapsed:.1f}/s, {errors} errors")
+    print(f"{'flow':<16} {'count':>7} {'per s':>7} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for flow, row in flows.items():
+        p50, p95, p99 = (f'{row[key]:.1f}' if row[key] is not None else '-' for key in ('p50_ms', 'p95_ms', 'p99_ms'))
+        print(f"{flow:<16} {row['requests']:>7} {row['per_second']:>7.1f} {row['error_rate']:>7.1%} "
+              f"{p50:>8} {p95:>8} {p99:>8}")
+        for error, count in row['errors'].items():
+            print(f"    {count} x {error}")
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({
+                'meta': {'url': args.url, 'concurrency': args.concurrency, 'duration': round(elapsed, 1),
+                         'mix': args.mix, 'think': args.think},
+                'flows': flows
+            }, f, indent=2)
+        print(f"Results written to {args.save}")
+    if total == 0 or errors / total > args.max_error_rate:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,7 @@
 from app import create_app
 from app.models.shipment import Shipment
 
-app = create_app()
+app = create_app(blueprints=())
 with app.app_context():
     shipments = Shipment.query.limit(5).all()
     for s in shipments:
@@ -1,7 +1,7 @@
 from app import create_app, db
 from app.models.user import User
 
-app = create_app()
+app = create_app(blueprints=())
 
 def main():
     with app.app_context():
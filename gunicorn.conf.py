@@ -1,23 +1,51 @@
 import multiprocessing
 import os
+import tempfile
 
 # Server socket
 bind = "0.0.0.0:8000"
 backlog = 2048
 
-# Worker processes - More conservative calculation
-workers = min(multiprocessing.cpu_count() + 1, 4)  # Max 4 workers
-worker_class = 'sync'
-worker_connections = 1000
+# Worker processes
+# gthread workers serve GUNICORN_THREADS requests each, so a slow NAS write or
+# report ties up one thread instead of a whole worker. gevent needs
+# `pip install gevent psycogreen`; sync handles one request per worker.
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.getenv('GUNICORN_WORKERS', min(multiprocessing.cpu_count() + 1, 4)))
+threads = int(os.getenv('GUNICORN_THREADS', 4)) if worker_class == 'gthread' else 1
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 1000))
 timeout = 120
 keepalive = 2
 
+# Load the app once in the master and fork it; post_fork drops the
+# database connections the workers would otherwise share with the master
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+# Database connections: a worker keeps one per request it serves at once,
+# and all workers together stay within DB_MAX_CONNECTIONS (leave room under
+# PostgreSQL's max_connections for cron jobs and psql). The overflow covers
+# the short side transactions a request opens next to its session (memoized
+# stats, user counters), as far as the budget allows. Requests beyond the
+# pool wait up to pool_timeout for a connection.
+concurrency = {'sync': 1, 'gthread': threads}.get(worker_class, worker_connections)
+db_max_connections = int(os.getenv('DB_MAX_CONNECTIONS', 80))
+db_pool_size = max(1, min(concurrency, db_max_connections // workers))
+os.environ.setdefault('DB_POOL_SIZE', str(db_pool_size))
+os.environ.setdefault('DB_MAX_OVERFLOW', str(max(0, min(concurrency, db_max_connections // workers - db_pool_size))))
+
+# Public tracking lookups may take half of the requests served at once, so a
+# scraper cannot keep staff pages waiting (see app.utils.rate_limit)
+os.environ.setdefault('TRACKING_MAX_CONCURRENT', str(max(1, workers * concurrency // 2)))
+
 # Logging
-accesslog = "logs/access.log"
-errorlog = "logs/error.log"
+# Workers never write log files themselves: records go through a queue to a
+# single writer process started by the master (see the hooks below), which
+# owns app.log, error.log and access.log and their rotation.
+accesslog = None
+errorlog = "-"
 loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
 
-# Log rotation
+# Until the writer is up the master logs to the console only
 logconfig_dict = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -26,20 +54,6 @@ logconfig_dict = {
             'class': 'logging.StreamHandler',
             'formatter': 'generic',
             'stream': 'ext://sys.stdout'
-        },
-        'error_file': {
-            'class': 'logging.handlers.RotatingFileHandler',
-            'formatter': 'generic',
-            'filename': 'logs/error.log',
-            'maxBytes': 10485760,  # 10MB
-            'backupCount': 5
-        },
-        'access_file': {
-            'class': 'logging.handlers.RotatingFileHandler',
-            'formatter': 'access',
-            'filename': 'logs/access.log',
-            'maxBytes': 10485760,  # 10MB
-            'backupCount': 5
         }
     },
     'formatters': {
@@ -57,13 +71,77 @@ logconfig_dict = {
     'loggers': {
         'gunicorn.error': {
             'level': 'INFO',
-            'handlers': ['console', 'error_file'],
+            'handlers': ['console'],
             'propagate': False,
             'qualname': 'gunicorn.error'
+        },
+        'gunicorn.access': {
+            'level': 'INFO',
+            'handlers': ['console'],
+            'propagate': False,
+            'qualname': 'gunicorn.access'
         }
     }
 }
 
+# Request metrics: each worker writes its own file here and /admin/metrics
+# adds them up, so a scrape that lands on any worker sees all of them
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'sgk_export-metrics'))
+
+def on_starting(server):
+    """Start the log writer before any worker is forked"""
+    from app.utils.log_shipping import start_log_writer, install_queue_handler
+    from app.utils.metrics import prepare_metrics_dir
+    from app.utils.rate_limit import forget_in_flight
+    start_log_writer()
+    install_queue_handler('gunicorn.error', 'gunicorn.access')
+    install_queue_handler()
+    prepare_metrics_dir()
+    forget_in_flight()
+    server.log.info("%s workers x %s (%s threads, %s connections), database pool %s+%s per worker",
+                    workers, worker_class, threads, worker_connections,
+                    os.environ['DB_POOL_SIZE'], os.environ['DB_MAX_OVERFLOW'])
+
+def post_fork(server, worker):
+    """Ship the worker's records, including a preloaded app's, to the writer"""
+    from app.utils.log_shipping import install_queue_handler
+    install_queue_handler('gunicorn.error', 'gunicorn.access')
+    install_queue_handler()
+    if worker_class == 'gevent':
+        # Lets psycopg2 yield to other greenlets while it waits on PostgreSQL
+        try:
+            from psycogreen.gevent import patch_psycopg
+            patch_psycopg()
+        except ImportError:
+            server.log.warning("psycogreen is not installed; database calls block the gevent worker")
+    if server.cfg.preload_app:
+        from app.extensions import dispose_engines
+        dispose_engines(server.app.callable)
+
+def post_worker_init(worker):
+    """Compile templates and open database connections before taking requests"""
+    app = worker.wsgi
+    if app.config.get('WARMUP_ENABLED', True):
+        from app.utils.warmup import warm_up
+        warm_up(app)
+
+def child_exit(server, worker):
+    """Keep the counters of an exited worker, drop its gauges and rate limit slots"""
+    from app.utils.metrics import mark_process_dead
+    from app.utils.rate_limit import forget_in_flight
+    mark_process_dead(worker.pid)
+    forget_in_flight(worker.pid)
+
+def worker_abort(worker):
+    """Log what the worker was doing when the timeout killed it"""
+    from app.utils.watchdog import dump_active_requests
+    dump_active_requests(f"Worker {worker.pid} timed out")
+
+def on_exit(server):
+    """Write out the queued records once the workers are gone"""
+    from app.utils.log_shipping import stop_log_writer
+    stop_log_writer()
+
 # Process naming
 proc_name = 'sgk_export'
 
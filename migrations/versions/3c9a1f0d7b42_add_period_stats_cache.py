@@ -0,0 +1,37 @@
+"""Add period stats cache and created_at index
+
+Revision ID: 3c9a1f0d7b42
+Revises: 205dedf96534
+Create Date: 2026-10-19 09:12:05.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c9a1f0d7b42'
+down_revision = '205dedf96534'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('period_stats',
+    sa.Column('granularity', sa.String(length=10), nullable=False),
+    sa.Column('period_start', sa.Date(), nullable=False),
+    sa.Column('shipment_count', sa.Integer(), nullable=False),
+    sa.Column('revenue', sa.Float(), nullable=False),
+    sa.Column('status_counts', sa.JSON(), nullable=False),
+    sa.Column('computed_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('granularity', 'period_start')
+    )
+    with op.batch_alter_table('export_request', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_export_request_created_at'), ['created_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('export_request', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_export_request_created_at'))
+
+    op.drop_table('period_stats')
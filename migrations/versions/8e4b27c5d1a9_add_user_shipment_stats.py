@@ -0,0 +1,60 @@
+"""Add per-user shipment stats counters
+
+Revision ID: 8e4b27c5d1a9
+Revises: 3c9a1f0d7b42
+Create Date: 2026-10-19 10:02:41.775130
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '8e4b27c5d1a9'
+down_revision = '3c9a1f0d7b42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('user_shipment_stats',
+    sa.Column('user_id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('total_shipments', sa.Integer(), nullable=False),
+    sa.Column('total_revenue', sa.Float(), nullable=False),
+    sa.Column('pending_count', sa.Integer(), nullable=False),
+    sa.Column('confirmed_count', sa.Integer(), nullable=False),
+    sa.Column('processing_count', sa.Integer(), nullable=False),
+    sa.Column('in_transit_count', sa.Integer(), nullable=False),
+    sa.Column('delivered_count', sa.Integer(), nullable=False),
+    sa.Column('cancelled_count', sa.Integer(), nullable=False),
+    sa.Column('saved_count', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    # Backfill the counters from existing shipments
+    op.execute("""
+        INSERT INTO user_shipment_stats (
+            user_id, total_shipments, total_revenue,
+            pending_count, confirmed_count, processing_count, in_transit_count,
+            delivered_count, cancelled_count, saved_count, updated_at
+        )
+        SELECT
+            created_by,
+            COUNT(id),
+            COALESCE(SUM(total), 0),
+            SUM(CASE WHEN status = 'pending' THEN 1 ELSE 0 END),
+            SUM(CASE WHEN status = 'confirmed' THEN 1 ELSE 0 END),
+            SUM(CASE WHEN status = 'processing' THEN 1 ELSE 0 END),
+            SUM(CASE WHEN status = 'in_transit' THEN 1 ELSE 0 END),
+            SUM(CASE WHEN status = 'delivered' THEN 1 ELSE 0 END),
+            SUM(CASE WHEN status = 'cancelled' THEN 1 ELSE 0 END),
+            SUM(CASE WHEN status = 'saved' THEN 1 ELSE 0 END),
+            CURRENT_TIMESTAMP
+        FROM export_request
+        GROUP BY created_by
+    """)
+
+
+def downgrade():
+    op.drop_table('user_shipment_stats')
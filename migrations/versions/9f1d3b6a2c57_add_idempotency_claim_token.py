@@ -0,0 +1,26 @@
+"""Add the claim token of idempotency keys
+
+Revision ID: 9f1d3b6a2c57
+Revises: e6b2d0c94f3a
+Create Date: 2026-10-19 16:21:08.473902
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '9f1d3b6a2c57'
+down_revision = 'e6b2d0c94f3a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('idempotency_key', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('claim_token', postgresql.UUID(as_uuid=True), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('idempotency_key', schema=None) as batch_op:
+        batch_op.drop_column('claim_token')
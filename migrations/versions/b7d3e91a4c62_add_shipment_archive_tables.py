@@ -0,0 +1,110 @@
+"""Add archive tables for delivered and cancelled shipments
+
+Revision ID: b7d3e91a4c62
+Revises: 8e4b27c5d1a9
+Create Date: 2026-10-19 11:24:18.402913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = 'b7d3e91a4c62'
+down_revision = '8e4b27c5d1a9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('export_request_archive',
+    sa.Column('id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('waybill_number', sa.String(length=50), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('delivery_date', sa.DateTime(), nullable=True),
+    sa.Column('qr_code', sa.Text(), nullable=True),
+    sa.Column('created_by', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('sender_name', sa.String(length=100), nullable=False),
+    sa.Column('sender_email', sa.String(length=120), nullable=True),
+    sa.Column('sender_address', sa.String(length=200), nullable=True),
+    sa.Column('sender_business', sa.String(length=100), nullable=True),
+    sa.Column('sender_mobile', sa.String(length=20), nullable=False),
+    sa.Column('sender_signature', sa.Text(), nullable=True),
+    sa.Column('receiver_name', sa.String(length=100), nullable=False),
+    sa.Column('receiver_email', sa.String(length=120), nullable=True),
+    sa.Column('receiver_address', sa.String(length=200), nullable=True),
+    sa.Column('receiver_business', sa.String(length=100), nullable=True),
+    sa.Column('receiver_mobile', sa.String(length=20), nullable=False),
+    sa.Column('destination_address', sa.String(length=200), nullable=True),
+    sa.Column('destination_country', sa.String(length=100), nullable=True),
+    sa.Column('destination_postcode', sa.String(length=20), nullable=True),
+    sa.Column('freight_pricing', sa.Float(), nullable=True),
+    sa.Column('additional_charges', sa.Float(), nullable=True),
+    sa.Column('pickup_charge', sa.Float(), nullable=True),
+    sa.Column('handling_fees', sa.Float(), nullable=True),
+    sa.Column('crating', sa.Float(), nullable=True),
+    sa.Column('insurance_charge', sa.Float(), nullable=True),
+    sa.Column('total', sa.Float(), nullable=True),
+    sa.Column('is_collection', sa.Boolean(), nullable=True),
+    sa.Column('customer_group', sa.String(length=100), nullable=True),
+    sa.Column('order_booked_by', sa.String(length=100), nullable=True),
+    sa.Column('status', sa.String(length=50), nullable=True),
+    sa.Column('status_changed_by', postgresql.UUID(as_uuid=True), nullable=True),
+    sa.Column('status_changed_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('archived_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['created_by'], ['user.id'], ),
+    sa.ForeignKeyConstraint(['status_changed_by'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('export_request_archive', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_export_request_archive_created_at'), ['created_at'], unique=False)
+        batch_op.create_index(batch_op.f('ix_export_request_archive_created_by'), ['created_by'], unique=False)
+        batch_op.create_index(batch_op.f('ix_export_request_archive_status_changed_by'), ['status_changed_by'], unique=False)
+        batch_op.create_index('ix_export_request_archive_waybill_number', ['waybill_number'], unique=False)
+
+    op.create_table('item_detail_archive',
+    sa.Column('id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('export_request_id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('description', sa.String(length=200), nullable=True),
+    sa.Column('value', sa.Float(), nullable=True),
+    sa.Column('quantity', sa.Integer(), nullable=True),
+    sa.Column('weight', sa.Float(), nullable=True),
+    sa.Column('image_filename', sa.String(length=255), nullable=True),
+    sa.Column('image_file_id', sa.String(length=255), nullable=True),
+    sa.ForeignKeyConstraint(['export_request_id'], ['export_request_archive.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('item_detail_archive', schema=None) as batch_op:
+        batch_op.create_index('ix_item_detail_archive_export_request_id', ['export_request_id'], unique=False)
+
+    op.create_table('shipment_status_history_archive',
+    sa.Column('id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('shipment_id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('old_status', sa.String(length=50), nullable=True),
+    sa.Column('new_status', sa.String(length=50), nullable=False),
+    sa.Column('changed_by', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('changed_at', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['changed_by'], ['user.id'], ),
+    sa.ForeignKeyConstraint(['shipment_id'], ['export_request_archive.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('shipment_status_history_archive', schema=None) as batch_op:
+        batch_op.create_index('ix_shipment_status_history_archive_shipment_id', ['shipment_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('shipment_status_history_archive', schema=None) as batch_op:
+        batch_op.drop_index('ix_shipment_status_history_archive_shipment_id')
+
+    op.drop_table('shipment_status_history_archive')
+    with op.batch_alter_table('item_detail_archive', schema=None) as batch_op:
+        batch_op.drop_index('ix_item_detail_archive_export_request_id')
+
+    op.drop_table('item_detail_archive')
+    with op.batch_alter_table('export_request_archive', schema=None) as batch_op:
+        batch_op.drop_index('ix_export_request_archive_waybill_number')
+        batch_op.drop_index(batch_op.f('ix_export_request_archive_status_changed_by'))
+        batch_op.drop_index(batch_op.f('ix_export_request_archive_created_by'))
+        batch_op.drop_index(batch_op.f('ix_export_request_archive_created_at'))
+
+    op.drop_table('export_request_archive')
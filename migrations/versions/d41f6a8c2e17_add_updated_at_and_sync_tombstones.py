@@ -0,0 +1,62 @@
+"""Add updated_at columns and sync tombstones for the delta sync feed
+
+Revision ID: d41f6a8c2e17
+Revises: b7d3e91a4c62
+Create Date: 2026-10-19 12:05:44.918370
+
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = 'd41f6a8c2e17'
+down_revision = 'b7d3e91a4c62'
+branch_labels = None
+depends_on = None
+
+# Hot tables and their archive twins, which mirror the same columns
+TABLES = (
+    'export_request',
+    'item_detail',
+    'shipment_status_history',
+    'export_request_archive',
+    'item_detail_archive',
+    'shipment_status_history_archive'
+)
+
+
+def upgrade():
+    op.create_table('sync_tombstone',
+    sa.Column('id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('entity', sa.String(length=30), nullable=False),
+    sa.Column('entity_id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('shipment_id', postgresql.UUID(as_uuid=True), nullable=True),
+    sa.Column('deleted_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('sync_tombstone', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_sync_tombstone_deleted_at'), ['deleted_at'], unique=False)
+
+    # Existing rows start out as changed "now"; a typed bind keeps the stored
+    # format identical to the values the application writes
+    now = datetime.utcnow()
+    for table_name in TABLES:
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+            batch_op.create_index(batch_op.f(f'ix_{table_name}_updated_at'), ['updated_at'], unique=False)
+        table = sa.table(table_name, sa.column('updated_at', sa.DateTime()))
+        op.execute(table.update().values(updated_at=now))
+
+
+def downgrade():
+    for table_name in reversed(TABLES):
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.drop_index(batch_op.f(f'ix_{table_name}_updated_at'))
+            batch_op.drop_column('updated_at')
+
+    with op.batch_alter_table('sync_tombstone', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_sync_tombstone_deleted_at'))
+
+    op.drop_table('sync_tombstone')
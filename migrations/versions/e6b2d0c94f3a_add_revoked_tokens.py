@@ -0,0 +1,38 @@
+"""Add revoked API tokens
+
+Revision ID: e6b2d0c94f3a
+Revises: 5a2c8e7f1b93
+Create Date: 2026-10-19 14:02:51.208113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = 'e6b2d0c94f3a'
+down_revision = '5a2c8e7f1b93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('revoked_token',
+    sa.Column('token_id', sa.String(length=64), nullable=False),
+    sa.Column('user_id', postgresql.UUID(as_uuid=True), nullable=True),
+    sa.Column('revoked_at', sa.DateTime(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('token_id')
+    )
+    with op.batch_alter_table('revoked_token', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_revoked_token_expires_at'), ['expires_at'], unique=False)
+        batch_op.create_index(batch_op.f('ix_revoked_token_user_id'), ['user_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('revoked_token', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_revoked_token_user_id'))
+        batch_op.drop_index(batch_op.f('ix_revoked_token_expires_at'))
+
+    op.drop_table('revoked_token')